@@ -1,136 +1,270 @@
+import time
 import logging
 import asyncio
-import asyncpg
 import pytz
 from aiogram import Bot, Dispatcher
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer, PRODUCTION
 from aiogram.filters import Command
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.cron import CronTrigger
+from apscheduler.triggers.interval import IntervalTrigger
 from functools import partial
 
 from app.config import (
-    TELEGRAM_TOKEN, DATABASE_URL, CODE_VERSION,
-    CHAT_ID, ADMIN_CHAT_ID, BACKUP_ENABLED, MONITORING_ENABLED
+    TELEGRAM_TOKEN, TELEGRAM_API_URL, DATABASE_URL, CODE_VERSION,
+    CHAT_ID, ADMIN_CHAT_ID, BACKUP_ENABLED, MONITORING_ENABLED,
+    TARGET_CHAT_ID, TARGET_USER_ID, TARGET_REACTION,
+    ARCHIVE_ENABLED, HISTORY_RETENTION_DAYS, MATCH_TRACKER_ENABLED,
+    MEMORY_PROFILING_ENABLED, LOOP_MONITOR_ENABLED, JOB_RUNS_RETENTION_DAYS,
+    SHUTDOWN_DRAIN_TIMEOUT, POLLING_LEASE_ENABLED, HEALTH_HTTP_HOST, HEALTH_HTTP_PORT
 )
+from app import runtime
 from app.services.messages import MorningMessageSender
-from app.services.monitoring import monitoring
-from app.database.models import ChatHistory
+from app.services.monitoring import monitoring, ERROR_DIGEST_INTERVAL
+from app.services.market import market_data
+from app.services.memory import memory_profiler
+from app.services.loop_monitor import loop_monitor
+from app.services.matches import MatchTracker
+from app.services.chat_config import chat_registry
+from app.services.jobs import JobRunner
+from app.services.lifecycle import UpdateTracker, PollingLease
+from app.services.health import (
+    health_monitor, probe_postgres, probe_ai_provider, register_upstream_probes
+)
+from app.services.ai_router import ai_router
+from app.services.tracing import tracer, TracingMiddleware, BotApiTracingMiddleware
+from app.database.models import ChatHistory, ChatConfigs, JobStore
+from app.database.pool import create_db_pool
 from app.database.migrations import apply_migrations
 from app.database.backup import backup_database
+from app.database.archive import ChatArchive, retention_cutoff
 from app.handlers.commands import CommandHandlers
 from app.handlers.messages import MessageHandlers
 
 logger = logging.getLogger(__name__)
 
+# Типы обновлений, которые получает бот
+ALLOWED_UPDATES = ["message"]
+
 class BotApp:
     def __init__(self):
-        self.bot = Bot(token=TELEGRAM_TOKEN)
+        # Собственный адрес Bot API (локальный сервер или заглушка для нагрузочных тестов)
+        api = TelegramAPIServer.from_base(TELEGRAM_API_URL) if TELEGRAM_API_URL else PRODUCTION
+        session = AiohttpSession(api=api, json_loads=runtime.json_loads, json_dumps=runtime.json_dumps)
+        self.bot = Bot(token=TELEGRAM_TOKEN, session=session)
+        # Спаны вызовов Bot API в трассах обновлений
+        session.middleware(BotApiTracingMiddleware())
         self.dp = Dispatcher()
         self.scheduler = None
+        self.jobs = None
         self.morning_sender = None
-        self.keep_alive_task = None
+        self.match_tracker = None
         self.db_pool = None
         self.command_handlers = None
         self.message_handlers = None
+        self.update_tracker = UpdateTracker()
+        self.polling_lease = (
+            PollingLease(DATABASE_URL, on_lost=self.dp.stop_polling) if POLLING_LEASE_ENABLED else None
+        )
 
-    async def keep_alive(self):
-        """Задача для поддержания бота в активном состоянии"""
-        while True:
-            logger.info("Бот активен")
-            await asyncio.sleep(300)
+    async def run_retention(self):
+        """Архивирует устаревшую историю чата и удаляет её из горячей таблицы"""
+        if ARCHIVE_ENABLED:
+            archived = await ChatArchive.archive_expired_messages(self.db_pool, HISTORY_RETENTION_DAYS)
+            if archived is None:
+                # Не удаляем строки, которые не удалось заархивировать
+                logger.error("Архивация не удалась, очистка истории пропущена")
+                return
+            await ChatHistory.cleanup_old_messages(
+                self.db_pool, before=retention_cutoff(HISTORY_RETENTION_DAYS)
+            )
+        else:
+            await ChatHistory.cleanup_old_messages(self.db_pool, HISTORY_RETENTION_DAYS)
 
     async def on_startup(self):
         """Выполняется при запуске бота"""
         logger.info(f"Запуск бота версии {CODE_VERSION}")
         
         # Инициализация БД
-        self.db_pool = await asyncpg.create_pool(DATABASE_URL)
+        self.db_pool = await create_db_pool(DATABASE_URL)
         await ChatHistory.create_tables(self.db_pool)
         
         # Применяем миграции
         await apply_migrations(self.db_pool)
         
+        # Настройки чатов: TARGET_* из окружения становятся настройками по умолчанию
+        # для TARGET_CHAT_ID, дальше они меняются в таблице chat_config
+        await ChatConfigs.ensure_default(
+            self.db_pool, TARGET_CHAT_ID, history_enabled=True,
+            reaction_user_ids=[TARGET_USER_ID], reaction_emoji=TARGET_REACTION
+        )
+        await chat_registry.start(self.db_pool, DATABASE_URL)
+        
         # Инициализация компонентов бота
-        self.morning_sender = MorningMessageSender(self.bot)
+        self.morning_sender = MorningMessageSender(self.bot, self.db_pool)
+        await self.morning_sender.ensure_default_subscription()
         self.command_handlers = CommandHandlers(self.bot, self.db_pool)
         self.message_handlers = MessageHandlers(self.bot, self.db_pool)
         
         # Настройка мониторинга
         if MONITORING_ENABLED:
-            monitoring.set_bot(self.bot)
+            monitoring.set_bot(self.bot, ADMIN_CHAT_ID)
             
         # Запуск планировщика
         self.scheduler = AsyncIOScheduler(timezone=pytz.timezone('Europe/Moscow'))
+        self.jobs = JobRunner(self.scheduler, self.db_pool)
+        self.command_handlers.job_runner = self.jobs
         
-        # Утренние сообщения
-        self.scheduler.add_job(
-            self.morning_sender.send_morning_message, 
-            trigger=CronTrigger(hour=8, minute=0)
-        )
-        
-        # Очистка старых сообщений
-        self.scheduler.add_job(
-            lambda: ChatHistory.cleanup_old_messages(self.db_pool), 
-            trigger=CronTrigger(hour=0, minute=0)
+        # Утренние сообщения (время отправки задаётся в подписках).
+        # Запускается каждую минуту: в журнал не пишется, аренда истекает сама до следующего запуска
+        self.jobs.add(
+            "morning_digest", self.morning_sender.send_morning_message,
+            trigger=CronTrigger(minute='*'), persist=False, lease=50, misfire_grace_time=30
         )
         
-        # Проверка состояния базы данных
-        self.scheduler.add_job(
-            self.command_handlers.check_database_health,
-            trigger='interval',
-            minutes=30
+        # Архивация и очистка старых сообщений
+        self.jobs.add(
+            "retention", self.run_retention,
+            trigger=CronTrigger(hour=0, minute=0),
+            heavy=True, catch_up=True, lease=3 * 3600, misfire_grace_time=3600
         )
         
         # Резервное копирование БД
         if BACKUP_ENABLED:
-            self.scheduler.add_job(
-                backup_database, 
-                args=[DATABASE_URL],
-                trigger=CronTrigger(day_of_week='mon-sun', hour=3, minute=0)  # Каждый день в 3:00
+            self.jobs.add(
+                "backup", backup_database, args=(DATABASE_URL,),
+                trigger=CronTrigger(day_of_week='mon-sun', hour=3, minute=0),  # Каждый день в 3:00
+                heavy=True, catch_up=True, lease=6 * 3600, misfire_grace_time=3600
+            )
+            
+        # Очистка журнала плановых задач
+        self.jobs.add(
+            "prune_job_runs", partial(JobStore.prune_runs, self.db_pool, JOB_RUNS_RETENTION_DAYS),
+            trigger=CronTrigger(hour=4, minute=30), heavy=True, misfire_grace_time=3600
+        )
+            
+        # Сводка повторяющихся ошибок
+        if MONITORING_ENABLED:
+            self.jobs.add(
+                "error_digest", monitoring.send_error_digest,
+                trigger=IntervalTrigger(seconds=ERROR_DIGEST_INTERVAL), shared=False, persist=False
             )
             
         # Логирование использования памяти
-        self.scheduler.add_job(
-            monitoring.log_memory_usage,
-            trigger='interval',
-            hours=2
+        self.jobs.add(
+            "memory_usage", monitoring.log_memory_usage,
+            trigger=IntervalTrigger(hours=2), shared=False, persist=False
         )
         
-        # Запуск планировщика
+        # Запуск планировщика и запусков, пропущенных во время простоя
         self.scheduler.start()
+        await self.jobs.catch_up()
         logger.info("Планировщик запущен")
         
-        # Запуск задачи поддержания активности
-        self.keep_alive_task = asyncio.create_task(self.keep_alive())
+        # Измерение задержки цикла событий
+        if LOOP_MONITOR_ENABLED:
+            loop_monitor.start()
+            
+        # Профилирование памяти
+        if MEMORY_PROFILING_ENABLED:
+            memory_profiler.start()
+            
+        # Фоновое обновление курсов валют и криптовалют
+        market_data.start()
+        
+        # Отслеживание голов в матчах команд
+        if MATCH_TRACKER_ENABLED:
+            self.match_tracker = MatchTracker(self.bot)
+            self.match_tracker.start()
+        
+        # Фоновые проверки зависимостей и эндпоинты liveness/readiness
+        health_monitor.add("postgres", partial(probe_postgres, self.db_pool), critical=True)
+        health_monitor.add("telegram", self.bot.get_me, critical=True)
+        for provider in ai_router.providers:
+            health_monitor.add(f"ai:{provider.name}", partial(probe_ai_provider, provider))
+        register_upstream_probes(health_monitor)
+        health_monitor.start()
+        if HEALTH_HTTP_PORT:
+            await health_monitor.start_http(HEALTH_HTTP_HOST, HEALTH_HTTP_PORT)
         
         # Уведомление о запуске
         if MONITORING_ENABLED:
             await monitoring.notify_admin(f"🚀 Бот запущен, версия {CODE_VERSION}")
             
+    async def release_polling(self):
+        """
+        Polling остановлен: подтверждаем полученные обновления и отпускаем
+        блокировку, чтобы новый экземпляр начал polling, пока этот дорабатывает
+        """
+        await self.update_tracker.confirm(self.bot, ALLOWED_UPDATES)
+        if self.polling_lease:
+            await self.polling_lease.release()
+
     async def on_shutdown(self):
-        """Выполняется при остановке бота"""
+        """
+        Выполняется при остановке бота. Новые обновления уже не принимаются;
+        начатые обработчики, ответы AI и фоновые записи получают время
+        до SHUTDOWN_DRAIN_TIMEOUT, после чего ресурсы закрываются по порядку
+        """
         logger.info("Остановка бота")
-        
-        # Остановка задачи keep_alive
-        if self.keep_alive_task and not self.keep_alive_task.done():
-            self.keep_alive_task.cancel()
-            try:
-                await self.keep_alive_task
-            except asyncio.CancelledError:
-                pass
+        deadline = time.monotonic() + SHUTDOWN_DRAIN_TIMEOUT
+
+        def remaining():
+            return max(0.0, deadline - time.monotonic())
+
+        # Оркестратор больше не считает экземпляр готовым
+        health_monitor.ready = False
+        await self.release_polling()
                 
-        # Остановка планировщика
+        # Остановка отслеживания матчей
+        if self.match_tracker:
+            await self.match_tracker.stop()
+                
+        # Остановка профилировщика памяти
+        await memory_profiler.stop()
+                
+        # Остановка обновления рыночных данных
+        await market_data.stop()
+                
+        # Новые плановые задачи не запускаются, начатые дорабатывают ниже
         if self.scheduler:
-            self.scheduler.shutdown()
+            self.scheduler.shutdown(wait=False)
             logger.info("Планировщик остановлен")
             
+        # Дожидаемся начатых обработчиков (в том числе ответов AI)
+        if not await self.update_tracker.wait_idle(remaining()):
+            logger.warning(f"Не дождались {self.update_tracker.inflight} обработчиков обновлений")
+            
+        # Дожидаемся фонового сохранения сообщений, реакций и сводок
+        if self.message_handlers:
+            await self.message_handlers.drain(timeout=remaining())
+            
+        # Дожидаемся выполняющихся плановых задач
+        if self.jobs:
+            await self.jobs.drain(timeout=remaining())
+        logger.info(f"Начатая работа завершена за {SHUTDOWN_DRAIN_TIMEOUT - remaining():.1f} с")
+            
+        # Остановка мониторинга цикла событий и проверок состояния
+        await loop_monitor.stop()
+        await health_monitor.stop()
+            
+        # Остановка слушателя настроек чатов
+        await chat_registry.stop()
+            
         # Закрытие соединения с базой данных
         if self.db_pool:
-            await self.db_pool.close()
+            try:
+                await asyncio.wait_for(self.db_pool.close(), timeout=remaining() + 5)
+            except asyncio.TimeoutError:
+                logger.warning("Соединения с PostgreSQL не освободились вовремя, закрываем принудительно")
+                self.db_pool.terminate()
             logger.info("Соединение с PostgreSQL закрыто")
             
         # Закрытие сессии бота
         await self.bot.session.close()
+        # Дописываем накопленные трассы
+        tracer.exporter.stop()
         logger.info("Бот остановлен")
 
     def setup_handlers(self):
@@ -141,6 +275,8 @@ class BotApp:
         self.dp.message.register(self.command_handlers.command_reset, Command("reset"))
         self.dp.message.register(self.command_handlers.command_stats, Command("stats"))
         self.dp.message.register(self.command_handlers.command_test, Command("test"))
+        self.dp.message.register(self.command_handlers.command_search, Command("search"))
+        self.dp.message.register(self.command_handlers.command_top, Command("top"))
         
         # Команды для футбольных матчей
         self.dp.message.register(
@@ -158,13 +294,24 @@ class BotApp:
         
         # Обработчик всех сообщений
         self.dp.message.register(self.message_handlers.handle_message)
+        
+        # Трасса на каждое обновление: обработчик, запросы к БД, AI и Telegram
+        self.dp.update.outer_middleware(TracingMiddleware())
+        # Учёт начатых обработчиков для остановки без потери ответов
+        self.dp.update.outer_middleware(self.update_tracker)
 
     async def start(self):
         """Запуск бота"""
-        self.setup_handlers()
         await self.on_startup()
+        self.setup_handlers()
+        # Готов принимать работу: при перезапуске оркестратор может останавливать старый экземпляр
+        health_monitor.ready = True
         try:
-            await self.dp.start_polling(self.bot, allowed_updates=["message"])
+            # Экземпляр полностью готов; polling начинается, когда предыдущий его отпустит
+            if self.polling_lease:
+                await self.polling_lease.acquire()
+            # Сессию бота закрывает on_shutdown, после того как допишутся начатые ответы
+            await self.dp.start_polling(self.bot, allowed_updates=ALLOWED_UPDATES, close_bot_session=False)
         except Exception as e:
             logger.error(f"Ошибка при запуске бота: {e}")
             if MONITORING_ENABLED:
@@ -39,9 +39,50 @@ TARGET_USER_ID = int(get_env_var('TARGET_USER_ID', '948182089'))
 TARGET_CHAT_ID = int(get_env_var('TARGET_CHAT_ID', '-1002520045054'))  # Чат, в котором сохраняем всю историю
 ADMIN_CHAT_ID = int(get_env_var('ADMIN_CHAT_ID', str(TARGET_USER_ID)))  # По умолчанию TARGET_USER_ID
 
+# Адреса API (можно направить на локальные заглушки, см. benchmarks/fakes.py)
+TELEGRAM_API_URL = get_env_var('TELEGRAM_API_URL', '')  # Пусто - api.telegram.org
+DEEPSEEK_BASE_URL = get_env_var('DEEPSEEK_BASE_URL', 'https://api.deepseek.com')
+DEEPSEEK_MODEL = get_env_var('DEEPSEEK_MODEL', 'deepseek-chat')
+
+# Пул соединений с базой данных
+DB_POOL_MIN_SIZE = int(get_env_var('DB_POOL_MIN_SIZE', '2'))
+DB_POOL_MAX_SIZE = int(get_env_var('DB_POOL_MAX_SIZE', '10'))
+DB_POOL_MAX_INACTIVE_LIFETIME = float(get_env_var('DB_POOL_MAX_INACTIVE_LIFETIME', '300'))  # Секунды простоя до закрытия
+DB_COMMAND_TIMEOUT = float(get_env_var('DB_COMMAND_TIMEOUT', '30'))  # Секунды, на стороне клиента
+DB_STATEMENT_TIMEOUT_MS = int(get_env_var('DB_STATEMENT_TIMEOUT_MS', '15000'))  # На стороне сервера, 0 - без ограничения
+DB_STATEMENT_CACHE_SIZE = int(get_env_var('DB_STATEMENT_CACHE_SIZE', '100'))  # 0 - для PgBouncer в режиме транзакций
+DB_SLOW_QUERY_MS = float(get_env_var('DB_SLOW_QUERY_MS', '500'))
+
 # AI настройки
 AI_SYSTEM_PROMPT = f"Ты Анатолий Шарий, твоя фамилия Шарий, у тебя есть жена Ольга Шарий. Ты пророссийский журналист, скамер, блогер, эксцентричный пиздец, любишь материться. Сегодня {datetime.now().strftime('%Y-%m-%d')}. Отвечай с иронией, надменностью и будь полезным помощником в Telegram-группе."
 
+# AI-провайдеры (OpenAI-совместимые API). Пусто - только DeepSeek с настройками выше. Пример:
+# [{"name": "deepseek", "base_url": "https://api.deepseek.com", "api_key_env": "DEEPSEEK_API_KEY",
+#   "model": "deepseek-chat"},
+#  {"name": "openrouter", "base_url": "https://openrouter.ai/api/v1", "api_key_env": "OPENROUTER_API_KEY",
+#   "model": "deepseek/deepseek-chat", "priority": 1, "max_concurrency": 5, "timeout": 20}]
+AI_PROVIDERS = json.loads(get_env_var('AI_PROVIDERS', '[]'))
+AI_REQUEST_TIMEOUT = float(get_env_var('AI_REQUEST_TIMEOUT', '30'))  # Секунды на попытку
+AI_MAX_ATTEMPTS = int(get_env_var('AI_MAX_ATTEMPTS', '3'))  # Попыток на запрос (по разным провайдерам)
+AI_EWMA_ALPHA = float(get_env_var('AI_EWMA_ALPHA', '0.3'))  # Вес нового измерения задержки
+AI_PRIORITY_PENALTY = float(get_env_var('AI_PRIORITY_PENALTY', '5'))  # Секунд задержки за единицу приоритета
+AI_PROVIDER_COOLDOWN = float(get_env_var('AI_PROVIDER_COOLDOWN', '30'))  # Секунд исключения после сбоя (удваивается)
+AI_EXPLORE_RATE = float(get_env_var('AI_EXPLORE_RATE', '0.05'))  # Доля запросов к не самому быстрому провайдеру
+
+# Долговременная память AI: релевантные старые сообщения чата в контексте запроса
+AI_MEMORY_ENABLED = get_env_var('AI_MEMORY_ENABLED', 'true').lower() == 'true'
+AI_MEMORY_TOP_K = int(get_env_var('AI_MEMORY_TOP_K', '5'))
+AI_MEMORY_SNIPPET_CHARS = int(get_env_var('AI_MEMORY_SNIPPET_CHARS', '300'))
+
+# Сводки разговоров: старые сообщения сворачиваются в краткое содержание,
+# в AI отправляется сводка и короткое окно последних сообщений
+AI_SUMMARY_ENABLED = get_env_var('AI_SUMMARY_ENABLED', 'true').lower() == 'true'
+AI_SUMMARY_RECENT_WINDOW = int(get_env_var('AI_SUMMARY_RECENT_WINDOW', '10'))  # Сообщений вне сводки
+AI_SUMMARY_MIN_BATCH = int(get_env_var('AI_SUMMARY_MIN_BATCH', '10'))  # Минимум сообщений для обновления сводки
+AI_SUMMARY_BATCH_MAX = int(get_env_var('AI_SUMMARY_BATCH_MAX', '100'))
+AI_SUMMARY_CONCURRENCY = int(get_env_var('AI_SUMMARY_CONCURRENCY', '2'))
+AI_SUMMARY_MAX_TOKENS = int(get_env_var('AI_SUMMARY_MAX_TOKENS', '400'))
+
 # Константы для ответов из .env
 RESPONSES_SOSAL = json.loads(get_env_var('RESPONSES_SOSAL'))  # Обязательная переменная
 RARE_RESPONSE_SOSAL = get_env_var('RARE_RESPONSE_SOSAL')      # Обязательная переменная
@@ -50,7 +91,78 @@ RESPONSES_SCAMIL = json.loads(get_env_var('RESPONSES_SCAMIL'))  # Обязате
 TEAM_IDS = json.loads(get_env_var('TEAM_IDS'))                # Обязательная переменная
 TARGET_REACTION = get_env_var('TARGET_REACTION')              # Обязательная переменная
 
+# Настройки утренней рассылки
+DIGEST_SEND_CONCURRENCY = int(get_env_var('DIGEST_SEND_CONCURRENCY', '10'))
+DIGEST_SEND_RATE = float(get_env_var('DIGEST_SEND_RATE', '25'))  # Сообщений в секунду
+DIGEST_CATCH_UP_MINUTES = int(get_env_var('DIGEST_CATCH_UP_MINUTES', '60'))  # Насколько поздно ещё отправлять пропущенную рассылку
+
+# Фоновое обновление курсов валют и криптовалют
+MARKET_REFRESH_INTERVAL = int(get_env_var('MARKET_REFRESH_INTERVAL', '600'))  # Секунды
+MARKET_REFRESH_JITTER = int(get_env_var('MARKET_REFRESH_JITTER', '60'))  # Секунды
+
+# Отслеживание матчей
+MATCH_TRACKER_ENABLED = get_env_var('MATCH_TRACKER_ENABLED', 'true').lower() == 'true'
+MATCH_LIVE_POLL_INTERVAL = int(get_env_var('MATCH_LIVE_POLL_INTERVAL', '60'))  # Секунды, во время матча
+MATCH_IDLE_POLL_INTERVAL = int(get_env_var('MATCH_IDLE_POLL_INTERVAL', '3600'))  # Секунды, без матчей
+
+# Быстрый режим выполнения: uvloop и orjson, если установлены
+FAST_RUNTIME = get_env_var('FAST_RUNTIME', 'true').lower() == 'true'
+
+# Мониторинг цикла событий
+LOOP_MONITOR_ENABLED = get_env_var('LOOP_MONITOR_ENABLED', 'true').lower() == 'true'
+LOOP_LAG_INTERVAL = float(get_env_var('LOOP_LAG_INTERVAL', '0.25'))  # Секунды между измерениями
+LOOP_LAG_THRESHOLD_MS = float(get_env_var('LOOP_LAG_THRESHOLD_MS', '100'))  # Порог блокировки
+LOOP_DEBUG_WINDOW = int(get_env_var('LOOP_DEBUG_WINDOW', '60'))  # Секунды логирования медленных колбэков
+
+# Логирование
+LOG_LEVEL = get_env_var('LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = get_env_var('LOG_FORMAT', 'json').lower()  # json или text
+# Доля сохраняемых INFO-записей для логгеров горячего пути (логгер:доля через запятую)
+LOG_SAMPLE_RATES = get_env_var(
+    'LOG_SAMPLE_RATES',
+    'app.handlers.messages:0.1,app.database.models:0.1,app.services.api:0.2,app.services.ai:0.5,aiogram.event:0.1'
+)
+
 # Настройки мониторинга и бэкапа
 BACKUP_ENABLED = get_env_var('BACKUP_ENABLED', 'true').lower() == 'true'
 BACKUP_PATH = get_env_var('BACKUP_PATH', './backups')
+BACKUP_FORMAT = get_env_var('BACKUP_FORMAT', 'custom').lower()  # custom (pg_dump -Fc) или gzip
+BACKUP_MAX_WRITE_RATE = int(float(get_env_var('BACKUP_MAX_WRITE_RATE_MB', '5')) * 1024 * 1024)  # Байт/с, 0 - без ограничения
+BACKUP_KEEP_DAILY = int(get_env_var('BACKUP_KEEP_DAILY', '7'))
+BACKUP_KEEP_WEEKLY = int(get_env_var('BACKUP_KEEP_WEEKLY', '4'))
+ARCHIVE_ENABLED = get_env_var('ARCHIVE_ENABLED', 'true').lower() == 'true'
+ARCHIVE_PATH = get_env_var('ARCHIVE_PATH', './archive')
+HISTORY_RETENTION_DAYS = int(get_env_var('HISTORY_RETENTION_DAYS', '30'))
 MONITORING_ENABLED = get_env_var('MONITORING_ENABLED', 'true').lower() == 'true'
+
+# Плановые задачи
+MAINTENANCE_JITTER = int(get_env_var('MAINTENANCE_JITTER', '600'))  # Секунды случайного сдвига тяжёлых задач
+MAINTENANCE_MAX_DEFER = int(get_env_var('MAINTENANCE_MAX_DEFER', '300'))  # Секунды ожидания разгрузки пула БД
+JOB_RUNS_RETENTION_DAYS = int(get_env_var('JOB_RUNS_RETENTION_DAYS', '30'))
+
+# Проверки состояния зависимостей
+HEALTH_PROBE_INTERVAL = int(get_env_var('HEALTH_PROBE_INTERVAL', '30'))  # Секунды, PostgreSQL, Telegram, DeepSeek
+HEALTH_UPSTREAM_INTERVAL = int(get_env_var('HEALTH_UPSTREAM_INTERVAL', '300'))  # Секунды, внешние HTTP API
+HEALTH_PROBE_TIMEOUT = float(get_env_var('HEALTH_PROBE_TIMEOUT', '5'))
+HEALTH_HTTP_HOST = get_env_var('HEALTH_HTTP_HOST', '0.0.0.0')
+HEALTH_HTTP_PORT = int(get_env_var('HEALTH_HTTP_PORT', '8080'))  # 0 - без HTTP-эндпоинтов
+
+# Трассировка обновлений: медленные и завершившиеся ошибкой трассы пишутся в JSONL
+TRACING_ENABLED = get_env_var('TRACING_ENABLED', 'true').lower() == 'true'
+TRACE_SLOW_MS = float(get_env_var('TRACE_SLOW_MS', '2000'))
+TRACE_SAMPLE_RATE = float(get_env_var('TRACE_SAMPLE_RATE', '0.001'))  # Доля остальных трасс
+TRACE_EXPORT_PATH = get_env_var('TRACE_EXPORT_PATH', './traces/traces.jsonl')
+TRACE_EXPORT_MAX_MB = float(get_env_var('TRACE_EXPORT_MAX_MB', '50'))
+TRACE_MAX_SPANS = int(get_env_var('TRACE_MAX_SPANS', '200'))  # Спанов на трассу
+
+# Остановка и перезапуск без простоя
+SHUTDOWN_DRAIN_TIMEOUT = float(get_env_var('SHUTDOWN_DRAIN_TIMEOUT', '25'))  # Секунды на завершение начатой работы
+# Новый экземпляр начинает polling только после того, как старый отпустит advisory-блокировку
+POLLING_LEASE_ENABLED = get_env_var('POLLING_LEASE_ENABLED', 'true').lower() == 'true'
+POLLING_LEASE_KEY = int(get_env_var('POLLING_LEASE_KEY', '770301'))  # Ключ pg_advisory_lock
+
+# Профилирование памяти (tracemalloc заметно замедляет выделение памяти, по умолчанию выключено)
+MEMORY_PROFILING_ENABLED = get_env_var('MEMORY_PROFILING_ENABLED', 'false').lower() == 'true'
+MEMORY_SNAPSHOT_INTERVAL = int(get_env_var('MEMORY_SNAPSHOT_INTERVAL', '900'))  # Секунды
+MEMORY_GROWTH_ALERT_MB = float(get_env_var('MEMORY_GROWTH_ALERT_MB', '50'))
+MEMORY_TRACE_FRAMES = int(get_env_var('MEMORY_TRACE_FRAMES', '5'))
@@ -0,0 +1,223 @@
+import os
+import json
+import zlib
+import gzip
+import time
+import asyncio
+import logging
+import datetime
+import asyncpg
+from app.config import ARCHIVE_PATH, HISTORY_RETENTION_DAYS
+from app.services.monitoring import monitoring
+from app.database.migrations import ACTIVITY_ROLLUP_SKIP_SETTING
+
+logger = logging.getLogger(__name__)
+
+SECONDS_PER_DAY = 86400
+
+# Колонки chat_history, которые попадают в архив и восстанавливаются из него
+ARCHIVE_COLUMNS = [
+    "id", "chat_id", "user_id", "message_id", "role",
+    "content", "timestamp", "reset_id", "tokens"
+]
+
+# Количество строк в одной пачке при восстановлении
+RESTORE_BATCH_SIZE = 5000
+
+def retention_cutoff(days=HISTORY_RETENTION_DAYS, now=None):
+    """
+    Возвращает границу хранения (unix time), выровненную по началу суток UTC,
+    чтобы каждый день архивировался целиком ровно один раз
+    """
+    now = time.time() if now is None else now
+    return (int(now) // SECONDS_PER_DAY - days) * SECONDS_PER_DAY
+
+def shard_path(archive_path, day):
+    """Путь к файлу архива за указанный день (номер дня от начала эпохи)"""
+    date = datetime.datetime.fromtimestamp(day * SECONDS_PER_DAY, tz=datetime.timezone.utc)
+    return os.path.join(
+        archive_path, "chat_history", f"{date:%Y}", f"{date:%m}",
+        f"chat_history_{date:%Y%m%d}.ndjson.gz"
+    )
+
+class GzipShardWriter:
+    """Потоково сжимает вывод COPY в gzip-файл"""
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "wb")
+        # wbits=31 - gzip-контейнер
+        self.compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+        self.raw_size = 0
+        self.rows = 0
+
+    async def write(self, chunk):
+        self.raw_size += len(chunk)
+        self.rows += chunk.count(b"\n")
+        data = self.compressor.compress(chunk)
+        if data:
+            await asyncio.to_thread(self.file.write, data)
+
+    async def close(self):
+        await asyncio.to_thread(self.file.write, self.compressor.flush())
+        await asyncio.to_thread(os.fsync, self.file.fileno())
+        self.file.close()
+
+    def discard(self):
+        if not self.file.closed:
+            self.file.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+class ChatArchive:
+    """Холодный архив истории чата в сжатых NDJSON-файлах, разбитых по дням"""
+
+    @staticmethod
+    async def _archive_day(conn, day, cutoff, archive_path):
+        """Выгружает строки за один день через COPY и удаляет их из таблицы"""
+        start = day * SECONDS_PER_DAY
+        end = min(start + SECONDS_PER_DAY, cutoff)
+        path = shard_path(archive_path, day)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if os.path.exists(path):
+            logger.warning(f"Архив {path} уже существует, строки за этот день будут дописаны в новый файл")
+            path = path.replace(".ndjson.gz", f"_{int(time.time())}.ndjson.gz")
+
+        writer = GzipShardWriter(path + ".part")
+        columns = ", ".join(ARCHIVE_COLUMNS)
+        try:
+            async with conn.transaction():
+                # row_to_json экранирует управляющие символы, поэтому CSV с
+                # непечатаемыми кавычкой и разделителем выводит JSON без изменений
+                monitoring.increment_db_operation()
+                await conn.copy_from_query(
+                    f"""
+                    SELECT row_to_json(t)::text FROM (
+                        SELECT {columns} FROM chat_history
+                        WHERE timestamp >= $1 AND timestamp < $2
+                        ORDER BY id
+                    ) t
+                    """,
+                    float(start), float(end),
+                    output=writer.write,
+                    format="csv", quote="\x01", delimiter="\x02"
+                )
+                await writer.close()
+                os.replace(writer.path, path)
+
+                monitoring.increment_db_operation()
+                await conn.execute(
+                    "DELETE FROM chat_history WHERE timestamp >= $1 AND timestamp < $2",
+                    float(start), float(end)
+                )
+        except BaseException:
+            writer.discard()
+            raise
+
+        return path, writer.rows, writer.raw_size
+
+    @staticmethod
+    async def archive_expired_messages(pool, days=HISTORY_RETENTION_DAYS, archive_path=ARCHIVE_PATH):
+        """
+        Архивирует сообщения старше указанного количества дней и удаляет их из таблицы.
+        Возвращает количество заархивированных строк или None при ошибке.
+        """
+        cutoff = retention_cutoff(days)
+        total_rows = 0
+        try:
+            async with pool.acquire(name="archive.expire") as conn:
+                monitoring.increment_db_operation()
+                day_rows = await conn.fetch(
+                    """
+                    SELECT DISTINCT floor(timestamp / $2)::bigint AS day
+                    FROM chat_history
+                    WHERE timestamp < $1
+                    ORDER BY day
+                    """,
+                    float(cutoff), SECONDS_PER_DAY
+                )
+                for row in day_rows:
+                    path, rows, raw_size = await ChatArchive._archive_day(
+                        conn, row['day'], cutoff, archive_path
+                    )
+                    compressed_size = os.path.getsize(path)
+                    total_rows += rows
+                    logger.info(
+                        f"Архив {path}: {rows} строк, "
+                        f"{raw_size / 1024:.1f} КБ -> {compressed_size / 1024:.1f} КБ"
+                    )
+            logger.info(f"Архивация истории завершена: {total_rows} строк за {len(day_rows)} дней")
+            return total_rows
+        except (asyncpg.PostgresError, OSError) as e:
+            logger.error(f"Ошибка при архивации истории чата: {e}")
+            monitoring.log_error(e, {"context": "archive_expired_messages"})
+            return None
+
+    @staticmethod
+    def _read_shard(path):
+        """Читает файл архива и возвращает список кортежей в порядке ARCHIVE_COLUMNS"""
+        records = []
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                row = json.loads(line)
+                records.append(tuple(row.get(column) for column in ARCHIVE_COLUMNS))
+        return records
+
+    @staticmethod
+    async def restore_archive(pool, path):
+        """
+        Загружает файл архива обратно в chat_history через COPY.
+        Уже существующие строки (по id) пропускаются.
+        """
+        try:
+            records = await asyncio.to_thread(ChatArchive._read_shard, path)
+            columns = ", ".join(ARCHIVE_COLUMNS)
+            async with pool.acquire(name="archive.restore") as conn:
+                async with conn.transaction():
+                    # Восстановленные строки уже учтены в chat_activity при первой вставке
+                    await conn.execute(f"SET LOCAL {ACTIVITY_ROLLUP_SKIP_SETTING} = 'on'")
+                    monitoring.increment_db_operation()
+                    await conn.execute(
+                        f"""
+                        CREATE TEMP TABLE chat_history_import ON COMMIT DROP AS
+                        SELECT {columns} FROM chat_history WITH NO DATA
+                        """
+                    )
+                    for i in range(0, len(records), RESTORE_BATCH_SIZE):
+                        monitoring.increment_db_operation()
+                        await conn.copy_records_to_table(
+                            "chat_history_import",
+                            records=records[i:i + RESTORE_BATCH_SIZE],
+                            columns=ARCHIVE_COLUMNS
+                        )
+                    monitoring.increment_db_operation()
+                    result = await conn.execute(
+                        f"""
+                        INSERT INTO chat_history ({columns})
+                        SELECT {columns} FROM chat_history_import
+                        ON CONFLICT (id) DO NOTHING
+                        """
+                    )
+            restored = int(result.split()[-1])
+            logger.info(f"Из архива {path} восстановлено {restored} из {len(records)} строк")
+            return restored
+        except (asyncpg.PostgresError, OSError, ValueError) as e:
+            logger.error(f"Ошибка восстановления архива {path}: {e}")
+            return None
+
+    @staticmethod
+    async def restore_range(pool, start_date, end_date, archive_path=ARCHIVE_PATH):
+        """Восстанавливает все файлы архива за период [start_date, end_date]"""
+        restored = 0
+        day = start_date
+        while day <= end_date:
+            directory = os.path.join(archive_path, "chat_history", f"{day:%Y}", f"{day:%m}")
+            prefix = f"chat_history_{day:%Y%m%d}"
+            if os.path.isdir(directory):
+                for name in sorted(os.listdir(directory)):
+                    if name.startswith(prefix) and name.endswith(".ndjson.gz"):
+                        count = await ChatArchive.restore_archive(pool, os.path.join(directory, name))
+                        restored += count or 0
+            day += datetime.timedelta(days=1)
+        return restored
@@ -1,60 +1,222 @@
 import os
+import time
+import zlib
 import asyncio
 import logging
 import datetime
-from app.config import BACKUP_PATH
+from urllib.parse import urlsplit, unquote
+from app.config import (
+    BACKUP_PATH, BACKUP_FORMAT, BACKUP_MAX_WRITE_RATE,
+    BACKUP_KEEP_DAILY, BACKUP_KEEP_WEEKLY
+)
 from app.services.monitoring import monitoring
 
 logger = logging.getLogger(__name__)
 
-async def backup_database(database_url, backup_path=BACKUP_PATH):
+# Размер блока, читаемого из stdout pg_dump
+CHUNK_SIZE = 256 * 1024
+
+# Расширения файлов бэкапа в зависимости от формата
+BACKUP_EXTENSIONS = {
+    "custom": ".dump",
+    "gzip": ".sql.gz",
+}
+
+def parse_database_url(database_url):
+    """
+    Извлекает параметры подключения из URL базы данных
+    """
+    parts = urlsplit(database_url)
+    return {
+        "host": parts.hostname or "localhost",
+        "port": str(parts.port or 5432),
+        "username": unquote(parts.username or ""),
+        "password": unquote(parts.password or ""),
+        "database": parts.path.lstrip("/"),
+    }
+
+def build_pg_dump_command(params, backup_format=BACKUP_FORMAT):
+    """
+    Формирует аргументы pg_dump (пароль передаётся через окружение, а не в командной строке)
+    """
+    cmd = [
+        "pg_dump",
+        "-h", params["host"],
+        "-p", params["port"],
+        "-U", params["username"],
+        "-d", params["database"],
+        "--no-password",
+    ]
+    if backup_format == "custom":
+        # Custom-формат сжимается самим pg_dump
+        cmd.append("--format=custom")
+    return cmd
+
+class WriteThrottle:
+    """Ограничивает скорость записи бэкапа на диск (байт в секунду)"""
+    def __init__(self, rate):
+        self.rate = rate
+        self.start_time = time.monotonic()
+        self.written = 0
+
+    async def consume(self, size):
+        self.written += size
+        if not self.rate:
+            return
+        # Сколько времени должна была занять запись при заданной скорости
+        expected = self.written / self.rate
+        elapsed = time.monotonic() - self.start_time
+        if expected > elapsed:
+            await asyncio.sleep(expected - elapsed)
+
+def select_backups_to_keep(backups, keep_daily=BACKUP_KEEP_DAILY, keep_weekly=BACKUP_KEEP_WEEKLY):
+    """
+    Возвращает множество файлов, которые нужно сохранить.
+    backups - список пар (datetime, путь). Сохраняется самая свежая копия
+    за каждый из последних keep_daily дней и за каждую из последних keep_weekly недель.
+    """
+    keep = set()
+    daily, weekly = {}, {}
+    for created, path in sorted(backups, reverse=True):
+        day = created.date()
+        week = created.isocalendar()[:2]
+        if day not in daily and len(daily) < keep_daily:
+            daily[day] = path
+        if week not in weekly and len(weekly) < keep_weekly:
+            weekly[week] = path
+    keep.update(daily.values())
+    keep.update(weekly.values())
+    return keep
+
+def list_backups(backup_path):
+    """Возвращает список готовых бэкапов в директории в виде пар (datetime, путь)"""
+    backups = []
+    for name in os.listdir(backup_path):
+        if not name.startswith("backup_") or name.endswith(".part"):
+            continue
+        stamp = name[len("backup_"):len("backup_") + 15]
+        try:
+            created = datetime.datetime.strptime(stamp, "%Y%m%d_%H%M%S")
+        except ValueError:
+            continue
+        backups.append((created, os.path.join(backup_path, name)))
+    return backups
+
+def rotate_backups(backup_path, keep_daily=BACKUP_KEEP_DAILY, keep_weekly=BACKUP_KEEP_WEEKLY):
     """
-    Создаёт резервную копию базы данных в виде SQL дампа
+    Удаляет старые бэкапы, оставляя ежедневные и еженедельные копии
     """
+    backups = list_backups(backup_path)
+    keep = select_backups_to_keep(backups, keep_daily, keep_weekly)
+    removed = []
+    for _, path in backups:
+        if path not in keep:
+            try:
+                os.remove(path)
+                removed.append(path)
+            except OSError as e:
+                logger.error(f"Не удалось удалить старый бэкап {path}: {e}")
+    if removed:
+        logger.info(f"Удалено старых бэкапов: {len(removed)}")
+    return removed
+
+async def _stream_to_file(stream, backup_file, backup_format, throttle):
+    """
+    Читает вывод pg_dump из пайпа и пишет его в файл (при необходимости сжимая gzip)
+    """
+    # wbits=31 - gzip-контейнер
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if backup_format == "gzip" else None
+    size = 0
+    with open(backup_file, "wb") as f:
+        while True:
+            chunk = await stream.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            if compressor:
+                chunk = await asyncio.to_thread(compressor.compress, chunk)
+            if chunk:
+                await asyncio.to_thread(f.write, chunk)
+                size += len(chunk)
+                await throttle.consume(len(chunk))
+        if compressor:
+            tail = compressor.flush()
+            await asyncio.to_thread(f.write, tail)
+            size += len(tail)
+    return size
+
+async def backup_database(database_url, backup_path=BACKUP_PATH, backup_format=BACKUP_FORMAT):
+    """
+    Создаёт сжатую резервную копию базы данных, потоково записывая вывод pg_dump в файл
+    """
+    part_file = None
     try:
         # Создаем директорию для бэкапов если её нет
         os.makedirs(backup_path, exist_ok=True)
-        
+
         # Формируем имя файла бэкапа с датой
         timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-        backup_file = os.path.join(backup_path, f"backup_{timestamp}.sql")
-        
-        # Извлекаем параметры подключения из URL
-        conn_params = database_url.replace("postgresql://", "").split("@")
-        user_pass = conn_params[0].split(":")
-        host_db = conn_params[1].split("/")
-        
-        username = user_pass[0]
-        password = user_pass[1] if len(user_pass) > 1 else ""
-        host = host_db[0].split(":")[0]  # Отделяем порт, если он есть
-        database = host_db[1].split("?")[0]  # Отбрасываем параметры
-        
-        # Подготавливаем команду для pg_dump
-        cmd = f"PGPASSWORD={password} pg_dump -h {host} -U {username} -d {database} > {backup_file}"
-        
+        extension = BACKUP_EXTENSIONS.get(backup_format, ".sql.gz")
+        backup_file = os.path.join(backup_path, f"backup_{timestamp}{extension}")
+        part_file = backup_file + ".part"
+
+        params = parse_database_url(database_url)
+        cmd = build_pg_dump_command(params, backup_format)
+        env = dict(os.environ, PGPASSWORD=params["password"])
+
         logger.info(f"Запуск резервного копирования в файл {backup_file}")
-        
-        # Выполняем команду
-        process = await asyncio.create_subprocess_shell(
-            cmd,
+        start_time = time.monotonic()
+
+        process = await asyncio.create_subprocess_exec(
+            *cmd,
             stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE
+            stderr=asyncio.subprocess.PIPE,
+            env=env
         )
-        
-        stdout, stderr = await process.communicate()
-        
+
+        try:
+            throttle = WriteThrottle(BACKUP_MAX_WRITE_RATE)
+            size, stderr = await asyncio.gather(
+                _stream_to_file(process.stdout, part_file, backup_format, throttle),
+                process.stderr.read()
+            )
+            await process.wait()
+        finally:
+            # Ошибка записи или отмена: pg_dump больше никто не читает, без этого
+            # он навсегда заблокируется на пайпе с открытым снимком БД
+            if process.returncode is None:
+                process.kill()
+                await process.wait()
+        duration = time.monotonic() - start_time
+
         if process.returncode == 0:
-            logger.info(f"Резервная копия БД успешно создана: {backup_file}")
+            os.replace(part_file, backup_file)
+            monitoring.record_backup(duration, size)
+            logger.info(
+                f"Резервная копия БД успешно создана: {backup_file} "
+                f"({size / 1024 / 1024:.2f} МБ за {duration:.1f}с)"
+            )
+            rotate_backups(backup_path)
             # Уведомляем мониторинг
-            await monitoring.notify_admin(f"✅ Резервная копия базы данных создана: {backup_file}")
+            await monitoring.notify_admin(
+                f"✅ Резервная копия базы данных создана: {backup_file} "
+                f"({size / 1024 / 1024:.2f} МБ за {duration:.1f}с)"
+            )
             return backup_file
         else:
+            os.remove(part_file)
             logger.error(f"Ошибка создания бэкапа: {stderr.decode()}")
             # Уведомляем мониторинг об ошибке
             await monitoring.notify_admin(f"❌ Ошибка создания резервной копии: {stderr.decode()}")
             return None
-            
+
     except Exception as e:
+        if part_file and os.path.exists(part_file):
+            os.remove(part_file)
         logger.error(f"Ошибка в процессе создания резервной копии: {e}")
         await monitoring.notify_admin(f"❌ Ошибка создания резервной копии: {e}")
-        return None
\ No newline at end of file
+        return None
+    except BaseException:
+        # Отмена (остановка бота): недописанный файл не оставляем
+        if part_file and os.path.exists(part_file):
+            os.remove(part_file)
+        raise
@@ -4,13 +4,166 @@ from app.services.monitoring import monitoring
 
 logger = logging.getLogger(__name__)
 
+# Размер пакета при заполнении новых колонок (строк по id)
+BACKFILL_BATCH_SIZE = 5000
+
+# Таймаут отдельных шагов онлайн-миграций, секунды (вместо DB_COMMAND_TIMEOUT пула)
+ONLINE_MIGRATION_TIMEOUT = 3600
+
+# День сообщения для агрегатов активности (по московскому времени, как и рассылки)
+ACTIVITY_DAY_SQL = "(to_timestamp({0}) AT TIME ZONE 'Europe/Moscow')::date"
+
+# Настройка транзакции, отключающая триггер агрегатов активности: восстановленные
+# из архива строки уже были учтены при первой вставке (ретенция агрегаты не трогает)
+ACTIVITY_ROLLUP_SKIP_SETTING = "app.skip_activity_rollup"
+
+ACTIVITY_ROLLUP_FUNCTION_SQL = f"""
+    CREATE OR REPLACE FUNCTION chat_activity_rollup() RETURNS trigger AS $$
+    BEGIN
+        IF current_setting('{ACTIVITY_ROLLUP_SKIP_SETTING}', true) = 'on' THEN
+            RETURN NULL;
+        END IF;
+        INSERT INTO chat_activity AS a (chat_id, day, user_id, messages, chars)
+        SELECT chat_id, {ACTIVITY_DAY_SQL.format('timestamp')}, user_id, count(*), sum(length(content))
+        FROM new_rows
+        WHERE role = 'user'
+        GROUP BY 1, 2, 3
+        ON CONFLICT (chat_id, day, user_id) DO UPDATE
+        SET messages = a.messages + EXCLUDED.messages, chars = a.chars + EXCLUDED.chars;
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql
+"""
+
+# Выражение полнотекстового индекса: русская и английская конфигурации
+SEARCH_VECTOR_SQL = "to_tsvector('russian', coalesce({0}, '')) || to_tsvector('english', coalesce({0}, ''))"
+
+async def create_index_concurrently(conn, name, definition):
+    """
+    Строит индекс без блокировки записи в таблицу.
+    Недостроенный (INVALID) индекс от прерванной попытки удаляется и строится заново.
+    """
+    valid = await conn.fetchval(
+        "SELECT i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid WHERE c.relname = $1",
+        name
+    )
+    if valid:
+        return
+    if valid is False:
+        logger.warning(f"Индекс {name} недостроен, пересоздаём")
+        await conn.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}", timeout=ONLINE_MIGRATION_TIMEOUT)
+    # CREATE INDEX CONCURRENTLY нельзя выполнять в транзакции, поэтому это отдельная команда
+    await conn.execute(f"CREATE INDEX CONCURRENTLY {name} ON {definition}", timeout=ONLINE_MIGRATION_TIMEOUT)
+
+async def add_search_vector(conn):
+    """
+    Онлайн-миграция полнотекстового поиска по chat_history:
+    колонка search_vector, триггер для новых строк, заполнение существующих
+    пакетами по id и GIN-индекс, построенный CONCURRENTLY.
+    Каждый шаг короткий и не блокирует запись надолго.
+    """
+    # Не ждём в очереди за долгими транзакциями с блокировкой таблицы
+    await conn.execute("SET lock_timeout = '5s'")
+    await conn.execute("SET statement_timeout = 0")
+    try:
+        # Колонка без значения по умолчанию добавляется без перезаписи таблицы
+        await conn.execute("ALTER TABLE chat_history ADD COLUMN IF NOT EXISTS search_vector tsvector")
+        await conn.execute(f"""
+            CREATE OR REPLACE FUNCTION chat_history_search_vector_update() RETURNS trigger AS $$
+            BEGIN
+                NEW.search_vector := {SEARCH_VECTOR_SQL.format('NEW.content')};
+                RETURN NEW;
+            END
+            $$ LANGUAGE plpgsql
+        """)
+        await conn.execute("DROP TRIGGER IF EXISTS trg_chat_history_search_vector ON chat_history")
+        await conn.execute("""
+            CREATE TRIGGER trg_chat_history_search_vector
+            BEFORE INSERT OR UPDATE OF content ON chat_history
+            FOR EACH ROW EXECUTE FUNCTION chat_history_search_vector_update()
+        """)
+
+        # Заполнение существующих строк пакетами по первичному ключу
+        low, high = await conn.fetchrow("SELECT coalesce(min(id), 0), coalesce(max(id), 0) FROM chat_history")
+        updated = 0
+        for start in range(low - 1, high, BACKFILL_BATCH_SIZE):
+            result = await conn.execute(
+                f"""
+                UPDATE chat_history SET search_vector = {SEARCH_VECTOR_SQL.format('content')}
+                WHERE id > $1 AND id <= $2 AND search_vector IS NULL
+                """,
+                start, start + BACKFILL_BATCH_SIZE, timeout=ONLINE_MIGRATION_TIMEOUT
+            )
+            updated += int(result.split()[-1])
+        logger.info(f"search_vector заполнен для {updated} сообщений")
+
+        await create_index_concurrently(conn, "idx_chat_history_search", "chat_history USING GIN (search_vector)")
+    finally:
+        await conn.execute("RESET lock_timeout")
+        await conn.execute("RESET statement_timeout")
+
+async def add_activity_rollup(conn):
+    """
+    Онлайн-миграция агрегатов активности: таблица chat_activity со счётчиками
+    сообщений по (чат, день, пользователь), триггер, дописывающий их при каждой
+    вставке в chat_history, и заполнение по существующим строкам пакетами по id.
+    Повторный запуск после сбоя пересчитывает агрегаты с нуля.
+    """
+    await conn.execute("SET lock_timeout = '5s'")
+    await conn.execute("SET statement_timeout = 0")
+    try:
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS chat_activity (
+                chat_id BIGINT NOT NULL,
+                day DATE NOT NULL,
+                user_id BIGINT NOT NULL,
+                messages INTEGER NOT NULL DEFAULT 0,
+                chars BIGINT NOT NULL DEFAULT 0,
+                PRIMARY KEY (chat_id, day, user_id)
+            )
+        """)
+        # Триггер уровня оператора: пакетная вставка обновляет каждую строку агрегата один раз
+        await conn.execute(ACTIVITY_ROLLUP_FUNCTION_SQL)
+
+        # Триггер и граница заполнения - в одной транзакции: CREATE TRIGGER ждёт
+        # завершения текущих вставок, поэтому строки до границы уже сохранены без
+        # триггера, а все следующие будут учтены им
+        async with conn.transaction():
+            await conn.execute("DROP TRIGGER IF EXISTS trg_chat_activity_rollup ON chat_history")
+            await conn.execute("""
+                CREATE TRIGGER trg_chat_activity_rollup
+                AFTER INSERT ON chat_history
+                REFERENCING NEW TABLE AS new_rows
+                FOR EACH STATEMENT EXECUTE FUNCTION chat_activity_rollup()
+            """)
+            await conn.execute("TRUNCATE chat_activity")
+            low, high = await conn.fetchrow("SELECT coalesce(min(id), 0), coalesce(max(id), 0) FROM chat_history")
+
+        for start in range(low - 1, high, BACKFILL_BATCH_SIZE):
+            await conn.execute(
+                f"""
+                INSERT INTO chat_activity AS a (chat_id, day, user_id, messages, chars)
+                SELECT chat_id, {ACTIVITY_DAY_SQL.format('timestamp')}, user_id, count(*), sum(length(content))
+                FROM chat_history
+                WHERE id > $1 AND id <= $2 AND role = 'user'
+                GROUP BY 1, 2, 3
+                ON CONFLICT (chat_id, day, user_id) DO UPDATE
+                SET messages = a.messages + EXCLUDED.messages, chars = a.chars + EXCLUDED.chars
+                """,
+                start, min(start + BACKFILL_BATCH_SIZE, high), timeout=ONLINE_MIGRATION_TIMEOUT
+            )
+        logger.info(f"Агрегаты активности заполнены по сообщениям с id до {high}")
+    finally:
+        await conn.execute("RESET lock_timeout")
+        await conn.execute("RESET statement_timeout")
+
 async def apply_migrations(pool):
     """
     Применяет необходимые миграции к базе данных
     """
     try:
         monitoring.increment_db_operation()
-        async with pool.acquire() as conn:
+        async with pool.acquire(name="migrations.apply") as conn:
             # Проверяем, есть ли таблица миграций
             exists = await conn.fetchval(
                 "SELECT EXISTS (SELECT FROM information_schema.tables WHERE table_name = 'migrations')"
@@ -41,6 +194,88 @@ async def apply_migrations(pool):
                 ("1.1", "Добавление поля tokens", """
                     ALTER TABLE chat_history ADD COLUMN IF NOT EXISTS tokens INTEGER DEFAULT 0;
                 """),
+                ("1.2", "Подписки на утреннюю рассылку", """
+                    CREATE TABLE IF NOT EXISTS digest_subscriptions (
+                        chat_id BIGINT PRIMARY KEY,
+                        cities JSONB NOT NULL DEFAULT '[]',
+                        send_time TIME NOT NULL DEFAULT '08:00',
+                        enabled BOOLEAN NOT NULL DEFAULT TRUE,
+                        updated_at TIMESTAMP DEFAULT NOW()
+                    );
+                    CREATE INDEX IF NOT EXISTS idx_digest_subscriptions_send_time
+                        ON digest_subscriptions (send_time) WHERE enabled;
+                    CREATE TABLE IF NOT EXISTS weather_cities (
+                        query TEXT PRIMARY KEY,
+                        city_id BIGINT NOT NULL
+                    );
+                """),
+                # Онлайн-миграции задаются функцией вместо SQL
+                ("1.3", "Полнотекстовый поиск по истории чата", add_search_vector),
+                ("1.4", "Сводки разговоров", """
+                    CREATE TABLE IF NOT EXISTS chat_summaries (
+                        chat_id BIGINT NOT NULL,
+                        reset_id INTEGER NOT NULL,
+                        summary TEXT NOT NULL,
+                        until_id INTEGER NOT NULL,
+                        updated_at TIMESTAMP DEFAULT NOW(),
+                        PRIMARY KEY (chat_id, reset_id)
+                    );
+                """),
+                ("1.5", "Настройки чатов с уведомлением об изменениях", """
+                    CREATE TABLE IF NOT EXISTS chat_config (
+                        chat_id BIGINT PRIMARY KEY,
+                        history_enabled BOOLEAN NOT NULL DEFAULT FALSE,
+                        ai_enabled BOOLEAN NOT NULL DEFAULT TRUE,
+                        reaction_user_ids BIGINT[] NOT NULL DEFAULT '{}',
+                        reaction_emoji TEXT,
+                        history_limit INTEGER,
+                        ai_rate_limit INTEGER NOT NULL DEFAULT 0,
+                        updated_at TIMESTAMP DEFAULT NOW()
+                    );
+                    CREATE OR REPLACE FUNCTION chat_config_notify() RETURNS trigger AS $$
+                    BEGIN
+                        PERFORM pg_notify('chat_config', COALESCE(NEW.chat_id, OLD.chat_id)::text);
+                        RETURN NULL;
+                    END
+                    $$ LANGUAGE plpgsql;
+                    DROP TRIGGER IF EXISTS trg_chat_config_notify ON chat_config;
+                    CREATE TRIGGER trg_chat_config_notify
+                        AFTER INSERT OR UPDATE OR DELETE ON chat_config
+                        FOR EACH ROW EXECUTE FUNCTION chat_config_notify();
+                """),
+                ("1.6", "Состояние и журнал плановых задач", """
+                    CREATE TABLE IF NOT EXISTS scheduled_jobs (
+                        name TEXT PRIMARY KEY,
+                        lease_owner TEXT,
+                        lease_until TIMESTAMPTZ,
+                        last_started_at TIMESTAMPTZ,
+                        last_finished_at TIMESTAMPTZ,
+                        last_success_at TIMESTAMPTZ,
+                        last_status TEXT,
+                        last_duration DOUBLE PRECISION,
+                        last_error TEXT
+                    );
+                    CREATE TABLE IF NOT EXISTS job_runs (
+                        id BIGSERIAL PRIMARY KEY,
+                        name TEXT NOT NULL,
+                        owner TEXT,
+                        reason TEXT,
+                        started_at TIMESTAMPTZ NOT NULL,
+                        duration DOUBLE PRECISION,
+                        status TEXT NOT NULL,
+                        error TEXT
+                    );
+                    CREATE INDEX IF NOT EXISTS idx_job_runs_name_started ON job_runs (name, started_at DESC);
+                """),
+                ("1.7", "Агрегаты активности чатов по дням", add_activity_rollup),
+                ("1.8", "Восстановление из архива без повторного учёта активности", ACTIVITY_ROLLUP_FUNCTION_SQL),
+                # Уже прошедшие сегодня рассылки отмечаются отправленными, чтобы не повторить их при обновлении
+                ("1.9", "Дата последней утренней рассылки", """
+                    ALTER TABLE digest_subscriptions ADD COLUMN IF NOT EXISTS last_sent_date DATE;
+                    UPDATE digest_subscriptions
+                    SET last_sent_date = (now() AT TIME ZONE 'Europe/Moscow')::date
+                    WHERE last_sent_date IS NULL AND send_time <= (now() AT TIME ZONE 'Europe/Moscow')::time;
+                """),
                 # Добавляйте новые миграции здесь
             ]
             
@@ -48,7 +283,10 @@ async def apply_migrations(pool):
             for version, description, sql in migrations:
                 if last_version is None or version > last_version:
                     logger.info(f"Применение миграции {version}: {description}")
-                    await conn.execute(sql)
+                    if callable(sql):
+                        await sql(conn)
+                    else:
+                        await conn.execute(sql)
                     await conn.execute(
                         "INSERT INTO migrations (version) VALUES ($1)",
                         version
@@ -1,3 +1,4 @@
+import json
 import logging
 import asyncpg
 from datetime import datetime
@@ -11,7 +12,7 @@ class ChatHistory:
     @staticmethod
     async def create_tables(pool):
         """Создает необходимые таблицы если они не существуют"""
-        async with pool.acquire() as conn:
+        async with pool.acquire(name="chat_history.create_tables") as conn:
             monitoring.increment_db_operation()
             await conn.execute("""
                 CREATE TABLE IF NOT EXISTS chat_history (
@@ -50,7 +51,7 @@ class ChatHistory:
                 reset_id = await ChatHistory.get_reset_id(pool, chat_id)
                 
             monitoring.increment_db_operation()
-            async with pool.acquire() as conn:
+            async with pool.acquire(name="chat_history.save_message") as conn:
                 await conn.execute(
                     """
                     INSERT INTO chat_history (chat_id, user_id, message_id, role, content, timestamp, reset_id)
@@ -58,7 +59,10 @@ class ChatHistory:
                     """,
                     chat_id, user_id, message_id, role, content, datetime.now().timestamp(), reset_id
                 )
-            logger.info(f"Сообщение сохранено: chat_id={chat_id}, user_id={user_id}, role={role}")
+            logger.info(
+                "Сообщение сохранено: chat_id=%s, user_id=%s, role=%s", chat_id, user_id, role,
+                extra={"chat_id": chat_id, "user_id": user_id}
+            )
             return True
         except asyncpg.PostgresError as e:
             logger.error(f"Ошибка PostgreSQL при сохранении сообщения: {e}")
@@ -68,22 +72,31 @@ class ChatHistory:
             return False
     
     @staticmethod
-    async def get_chat_history(pool, chat_id, limit=30):
-        """Получает историю чата для указанного chat_id"""
+    async def get_chat_history(pool, chat_id, limit=30, exclude_message_id=None, after_summary=False):
+        """
+        Получает историю чата для указанного chat_id.
+        exclude_message_id - сообщение, которое не нужно включать (текущий запрос,
+        который сохраняется параллельно и передаётся в AI отдельно).
+        after_summary - только сообщения, ещё не вошедшие в сводку разговора (chat_summaries)
+        """
         reset_id = await ChatHistory.get_reset_id(pool, chat_id)
         
         try:
             monitoring.increment_db_operation()
-            async with pool.acquire() as conn:
+            async with pool.acquire(name="chat_history.get_history") as conn:
                 rows = await conn.fetch(
                     """
                     SELECT role, content
                     FROM chat_history
                     WHERE chat_id = $1 AND reset_id = $2
+                      AND ($4::bigint IS NULL OR message_id IS DISTINCT FROM $4)
+                      AND (NOT $5 OR id > coalesce(
+                          (SELECT until_id FROM chat_summaries WHERE chat_id = $1 AND reset_id = $2), 0
+                      ))
                     ORDER BY timestamp DESC
                     LIMIT $3
                     """,
-                    chat_id, reset_id, limit
+                    chat_id, reset_id, limit, exclude_message_id, after_summary
                 )
                 return [{"role": row['role'], "content": row['content']} for row in reversed(rows)]
         except asyncpg.PostgresError as e:
@@ -93,12 +106,93 @@ class ChatHistory:
             logger.error(f"Ошибка при получении истории чата: {e}")
             return []
     
+    @staticmethod
+    async def search(pool, chat_id, query, limit=10, offset=0):
+        """
+        Полнотекстовый поиск по истории чата (GIN-индекс по search_vector).
+        Возвращает (всего найдено, [сообщения]) в порядке релевантности,
+        у каждого сообщения фрагмент с выделенными совпадениями
+        """
+        try:
+            monitoring.increment_db_operation()
+            async with pool.acquire(name="chat_history.search") as conn:
+                rows = await conn.fetch(
+                    """
+                    WITH q AS (
+                        SELECT websearch_to_tsquery('russian', $2) || websearch_to_tsquery('english', $2) AS query
+                    ), matches AS (
+                        SELECT h.id, h.user_id, h.role, h.content, h.timestamp,
+                               ts_rank_cd(h.search_vector, q.query) AS rank,
+                               count(*) OVER () AS total
+                        FROM chat_history h, q
+                        WHERE h.chat_id = $1 AND h.search_vector @@ q.query
+                        ORDER BY rank DESC, h.timestamp DESC
+                        LIMIT $3 OFFSET $4
+                    )
+                    SELECT m.id, m.user_id, m.role, m.timestamp, m.rank, m.total,
+                           ts_headline('russian', m.content, q.query,
+                                       'MaxFragments=1, MaxWords=25, MinWords=8, StartSel=«, StopSel=»') AS snippet
+                    FROM matches m, q
+                    ORDER BY m.rank DESC, m.timestamp DESC
+                    """,
+                    chat_id, query, limit, offset
+                )
+                total = rows[0]['total'] if rows else 0
+                return total, [
+                    {
+                        "user_id": row['user_id'],
+                        "role": row['role'],
+                        "timestamp": row['timestamp'],
+                        "snippet": row['snippet']
+                    }
+                    for row in rows
+                ]
+        except asyncpg.PostgresError as e:
+            logger.error(f"Ошибка полнотекстового поиска: {e}")
+            return 0, []
+
+    @staticmethod
+    async def get_relevant_messages(pool, chat_id, query, limit=5, recent_window=30):
+        """
+        Долговременная память: самые релевантные запросу сообщения чата,
+        не попавшие в последние recent_window сообщений текущего контекста.
+        Слова запроса объединяются через ИЛИ, ранжирование - ts_rank по GIN-индексу.
+        """
+        try:
+            monitoring.increment_db_operation()
+            async with pool.acquire(name="chat_history.relevant") as conn:
+                rows = await conn.fetch(
+                    """
+                    WITH q AS (
+                        SELECT NULLIF(replace(
+                            (plainto_tsquery('russian', $2) || plainto_tsquery('english', $2))::text, '&', '|'
+                        ), '')::tsquery AS query
+                    ), recent AS (
+                        SELECT id FROM chat_history
+                        WHERE chat_id = $1 AND reset_id = (SELECT reset_id FROM chat_reset_ids WHERE chat_id = $1)
+                        ORDER BY timestamp DESC
+                        LIMIT $4
+                    )
+                    SELECT h.role, h.content, h.timestamp
+                    FROM chat_history h, q
+                    WHERE h.chat_id = $1 AND h.search_vector @@ q.query
+                      AND h.id NOT IN (SELECT id FROM recent)
+                    ORDER BY ts_rank(h.search_vector, q.query) DESC, h.timestamp DESC
+                    LIMIT $3
+                    """,
+                    chat_id, query, limit, recent_window
+                )
+                return [{"role": row['role'], "content": row['content'], "timestamp": row['timestamp']} for row in rows]
+        except asyncpg.PostgresError as e:
+            logger.error(f"Ошибка поиска релевантных сообщений: {e}")
+            return []
+
     @staticmethod
     async def get_reset_id(pool, chat_id):
         """Получает текущий reset_id для чата"""
         try:
             monitoring.increment_db_operation()
-            async with pool.acquire() as conn:
+            async with pool.acquire(name="chat_history.get_reset_id") as conn:
                 reset_id = await conn.fetchval(
                     "SELECT reset_id FROM chat_reset_ids WHERE chat_id = $1",
                     chat_id
@@ -120,7 +214,7 @@ class ChatHistory:
         """Увеличивает reset_id на 1 для указанного чата"""
         try:
             monitoring.increment_db_operation()
-            async with pool.acquire() as conn:
+            async with pool.acquire(name="chat_history.increment_reset_id") as conn:
                 # Увеличиваем reset_id на 1, если запись существует, или создаём новую
                 await conn.execute(
                     """
@@ -141,17 +235,385 @@ class ChatHistory:
             return 0
     
     @staticmethod
-    async def cleanup_old_messages(pool, days=30):
-        """Удаляет сообщения старше указанного количества дней"""
+    async def cleanup_old_messages(pool, days=30, before=None):
+        """
+        Удаляет сообщения старше указанного количества дней
+        (или старше метки времени before, если она передана)
+        """
         try:
             monitoring.increment_db_operation()
-            async with pool.acquire() as conn:
-                await conn.execute(
-                    "DELETE FROM chat_history WHERE timestamp < EXTRACT(EPOCH FROM NOW() - INTERVAL '$1 days')",
-                    days
-                )
+            async with pool.acquire(name="chat_history.cleanup") as conn:
+                if before is not None:
+                    await conn.execute(
+                        "DELETE FROM chat_history WHERE timestamp < $1",
+                        float(before)
+                    )
+                else:
+                    await conn.execute(
+                        "DELETE FROM chat_history WHERE timestamp < EXTRACT(EPOCH FROM NOW() - make_interval(days => $1))",
+                        days
+                    )
                 logger.info(f"Очистка старых сообщений (старше {days} дней) завершена")
                 return True
         except asyncpg.PostgresError as e:
             logger.error(f"Ошибка PostgreSQL при очистке старых сообщений: {e}")
-            return False
\ No newline at end of file
+            return False
+
+
+class DigestSubscriptions:
+    """Класс для работы с подписками на утреннюю рассылку"""
+
+    @staticmethod
+    def _row_to_subscription(row):
+        return {
+            "chat_id": row['chat_id'],
+            "cities": json.loads(row['cities']),
+            "send_time": row['send_time']
+        }
+
+    @staticmethod
+    async def ensure_default(pool, chat_id, cities, send_time):
+        """Создает подписку по умолчанию, если подписок ещё нет"""
+        try:
+            monitoring.increment_db_operation()
+            async with pool.acquire(name="digest.ensure_default") as conn:
+                await conn.execute(
+                    """
+                    INSERT INTO digest_subscriptions (chat_id, cities, send_time)
+                    SELECT $1, $2::jsonb, $3
+                    WHERE NOT EXISTS (SELECT 1 FROM digest_subscriptions)
+                    """,
+                    chat_id, json.dumps(cities, ensure_ascii=False), send_time
+                )
+        except asyncpg.PostgresError as e:
+            logger.error(f"Ошибка создания подписки по умолчанию: {e}")
+
+    @staticmethod
+    async def claim_due(pool, today, earliest, latest):
+        """
+        Возвращает активные подписки со временем отправки в [earliest, latest],
+        которым сегодня ещё не отправляли, и отмечает их отправленными.
+        Отметка атомарна: опоздавший или повторный запуск не отправит рассылку дважды
+        """
+        try:
+            monitoring.increment_db_operation()
+            async with pool.acquire(name="digest.claim_due") as conn:
+                rows = await conn.fetch(
+                    """
+                    UPDATE digest_subscriptions
+                    SET last_sent_date = $1
+                    WHERE enabled AND send_time BETWEEN $2 AND $3
+                      AND (last_sent_date IS NULL OR last_sent_date < $1)
+                    RETURNING chat_id, cities, send_time
+                    """,
+                    today, earliest, latest
+                )
+                return [DigestSubscriptions._row_to_subscription(row) for row in rows]
+        except asyncpg.PostgresError as e:
+            logger.error(f"Ошибка получения подписок на рассылку: {e}")
+            return []
+
+    @staticmethod
+    async def release(pool, chat_ids, today):
+        """Снимает отметку о сегодняшней отправке: следующий запуск повторит рассылку"""
+        try:
+            monitoring.increment_db_operation()
+            async with pool.acquire(name="digest.release") as conn:
+                await conn.execute(
+                    """
+                    UPDATE digest_subscriptions SET last_sent_date = NULL
+                    WHERE chat_id = ANY($1::bigint[]) AND last_sent_date = $2
+                    """,
+                    list(chat_ids), today
+                )
+        except asyncpg.PostgresError as e:
+            logger.error(f"Ошибка снятия отметки о рассылке: {e}")
+
+    @staticmethod
+    async def upsert(pool, chat_id, cities, send_time, enabled=True):
+        """Создает или обновляет подписку чата"""
+        try:
+            monitoring.increment_db_operation()
+            async with pool.acquire(name="digest.upsert") as conn:
+                await conn.execute(
+                    """
+                    INSERT INTO digest_subscriptions (chat_id, cities, send_time, enabled)
+                    VALUES ($1, $2::jsonb, $3, $4)
+                    ON CONFLICT (chat_id) DO UPDATE
+                    SET cities = EXCLUDED.cities, send_time = EXCLUDED.send_time,
+                        enabled = EXCLUDED.enabled, updated_at = NOW()
+                    """,
+                    chat_id, json.dumps(cities, ensure_ascii=False), send_time, enabled
+                )
+                return True
+        except asyncpg.PostgresError as e:
+            logger.error(f"Ошибка сохранения подписки для чата {chat_id}: {e}")
+            return False
+
+    @staticmethod
+    async def get_city_ids(pool, queries):
+        """Возвращает сохранённые идентификаторы городов OpenWeather {query: city_id}"""
+        try:
+            monitoring.increment_db_operation()
+            async with pool.acquire(name="weather_cities.get") as conn:
+                rows = await conn.fetch(
+                    "SELECT query, city_id FROM weather_cities WHERE query = ANY($1::text[])",
+                    list(queries)
+                )
+                return {row['query']: row['city_id'] for row in rows}
+        except asyncpg.PostgresError as e:
+            logger.error(f"Ошибка получения идентификаторов городов: {e}")
+            return {}
+
+    @staticmethod
+    async def save_city_ids(pool, city_ids):
+        """Сохраняет идентификаторы городов OpenWeather"""
+        if not city_ids:
+            return
+        try:
+            monitoring.increment_db_operation()
+            async with pool.acquire(name="weather_cities.save") as conn:
+                await conn.executemany(
+                    """
+                    INSERT INTO weather_cities (query, city_id) VALUES ($1, $2)
+                    ON CONFLICT (query) DO UPDATE SET city_id = EXCLUDED.city_id
+                    """,
+                    list(city_ids.items())
+                )
+        except asyncpg.PostgresError as e:
+            logger.error(f"Ошибка сохранения идентификаторов городов: {e}")
+
+
+class ChatSummaries:
+    """Класс для работы со сводками разговоров (по chat_id и reset_id)"""
+
+    @staticmethod
+    async def get_current(pool, chat_id):
+        """Возвращает сводку текущего контекста чата или None"""
+        try:
+            monitoring.increment_db_operation()
+            async with pool.acquire(name="chat_summaries.get") as conn:
+                return await conn.fetchval(
+                    """
+                    SELECT s.summary
+                    FROM chat_summaries s
+                    JOIN chat_reset_ids r ON r.chat_id = s.chat_id AND r.reset_id = s.reset_id
+                    WHERE s.chat_id = $1
+                    """,
+                    chat_id
+                )
+        except asyncpg.PostgresError as e:
+            logger.error(f"Ошибка получения сводки разговора: {e}")
+            return None
+
+    @staticmethod
+    async def get_state(pool, chat_id, reset_id):
+        """Возвращает (сводка, id последнего учтённого сообщения)"""
+        monitoring.increment_db_operation()
+        async with pool.acquire(name="chat_summaries.get") as conn:
+            row = await conn.fetchrow(
+                "SELECT summary, until_id FROM chat_summaries WHERE chat_id = $1 AND reset_id = $2",
+                chat_id, reset_id
+            )
+            return (row['summary'], row['until_id']) if row else (None, 0)
+
+    @staticmethod
+    async def get_aged_out(pool, chat_id, reset_id, until_id, keep_recent, limit):
+        """
+        Сообщения, ещё не вошедшие в сводку и уже вышедшие из окна
+        последних keep_recent сообщений (в хронологическом порядке)
+        """
+        monitoring.increment_db_operation()
+        async with pool.acquire(name="chat_summaries.aged_out") as conn:
+            return await conn.fetch(
+                """
+                SELECT id, user_id, role, content
+                FROM (
+                    SELECT id, user_id, role, content, row_number() OVER (ORDER BY id DESC) AS age
+                    FROM chat_history
+                    WHERE chat_id = $1 AND reset_id = $2 AND id > $3
+                ) t
+                WHERE age > $4
+                ORDER BY id
+                LIMIT $5
+                """,
+                chat_id, reset_id, until_id, keep_recent, limit
+            )
+
+    @staticmethod
+    async def save(pool, chat_id, reset_id, summary, until_id):
+        """Сохраняет сводку; более старая сводка не перезаписывает более новую"""
+        monitoring.increment_db_operation()
+        async with pool.acquire(name="chat_summaries.save") as conn:
+            await conn.execute(
+                """
+                INSERT INTO chat_summaries (chat_id, reset_id, summary, until_id)
+                VALUES ($1, $2, $3, $4)
+                ON CONFLICT (chat_id, reset_id) DO UPDATE
+                SET summary = EXCLUDED.summary, until_id = EXCLUDED.until_id, updated_at = NOW()
+                WHERE chat_summaries.until_id < EXCLUDED.until_id
+                """,
+                chat_id, reset_id, summary, until_id
+            )
+
+
+class ChatConfigs:
+    """Класс для работы с настройками чатов (таблица chat_config)"""
+
+    COLUMNS = "chat_id, history_enabled, ai_enabled, reaction_user_ids, reaction_emoji, history_limit, ai_rate_limit"
+
+    @staticmethod
+    async def get_all(pool):
+        """Возвращает настройки всех чатов"""
+        monitoring.increment_db_operation()
+        async with pool.acquire(name="chat_config.get_all") as conn:
+            return await conn.fetch(f"SELECT {ChatConfigs.COLUMNS} FROM chat_config")
+
+    @staticmethod
+    async def get(pool, chat_id):
+        """Возвращает настройки чата или None"""
+        monitoring.increment_db_operation()
+        async with pool.acquire(name="chat_config.get") as conn:
+            return await conn.fetchrow(f"SELECT {ChatConfigs.COLUMNS} FROM chat_config WHERE chat_id = $1", chat_id)
+
+    @staticmethod
+    async def ensure_default(pool, chat_id, history_enabled, reaction_user_ids, reaction_emoji):
+        """Создает настройки чата, если их ещё нет (существующие не меняются)"""
+        try:
+            monitoring.increment_db_operation()
+            async with pool.acquire(name="chat_config.ensure_default") as conn:
+                await conn.execute(
+                    """
+                    INSERT INTO chat_config (chat_id, history_enabled, reaction_user_ids, reaction_emoji)
+                    VALUES ($1, $2, $3, $4)
+                    ON CONFLICT (chat_id) DO NOTHING
+                    """,
+                    chat_id, history_enabled, list(reaction_user_ids), reaction_emoji
+                )
+        except asyncpg.PostgresError as e:
+            logger.error(f"Ошибка создания настроек чата {chat_id}: {e}")
+
+
+class ChatActivity:
+    """
+    Класс для чтения агрегатов активности (таблица chat_activity).
+    Агрегаты дописывает триггер на chat_history, запросы читают только их,
+    поэтому их стоимость зависит от числа дней и участников, а не сообщений
+    """
+
+    # Сегодняшняя дата по московскому времени
+    TODAY_SQL = "(NOW() AT TIME ZONE 'Europe/Moscow')::date"
+
+    @staticmethod
+    async def get_top(pool, chat_id, days, limit=10):
+        """Самые активные участники чата за последние days дней"""
+        monitoring.increment_db_operation()
+        async with pool.acquire(name="chat_activity.top") as conn:
+            return await conn.fetch(
+                f"""
+                SELECT user_id, sum(messages)::bigint AS messages, sum(chars)::bigint AS chars, count(*) AS active_days
+                FROM chat_activity
+                WHERE chat_id = $1 AND day > {ChatActivity.TODAY_SQL} - $2::int
+                GROUP BY user_id
+                ORDER BY messages DESC, user_id
+                LIMIT $3
+                """,
+                chat_id, days, limit
+            )
+
+    @staticmethod
+    async def get_summary(pool, chat_id, days):
+        """Сообщения за сегодня и за days дней, число активных участников и самый активный день"""
+        monitoring.increment_db_operation()
+        async with pool.acquire(name="chat_activity.summary") as conn:
+            return await conn.fetchrow(
+                f"""
+                WITH daily AS (
+                    SELECT day, sum(messages)::bigint AS messages, count(*) AS users
+                    FROM chat_activity
+                    WHERE chat_id = $1 AND day > {ChatActivity.TODAY_SQL} - $2::int
+                    GROUP BY day
+                )
+                SELECT
+                    coalesce((SELECT messages FROM daily WHERE day = {ChatActivity.TODAY_SQL}), 0) AS today,
+                    coalesce((SELECT sum(messages) FROM daily), 0)::bigint AS messages,
+                    (SELECT count(DISTINCT user_id) FROM chat_activity
+                     WHERE chat_id = $1 AND day > {ChatActivity.TODAY_SQL} - $2::int) AS users,
+                    (SELECT day FROM daily ORDER BY messages DESC, day DESC LIMIT 1) AS busiest_day,
+                    (SELECT max(messages) FROM daily) AS busiest_messages
+                """,
+                chat_id, days
+            )
+
+
+class JobStore:
+    """Класс для хранения состояния плановых задач (аренда, последний запуск, журнал)"""
+
+    @staticmethod
+    async def acquire_lease(pool, name, owner, seconds):
+        """
+        Занимает задачу на seconds секунд. Возвращает False, если её уже выполняет
+        другой экземпляр бота (аренда ещё не истекла)
+        """
+        monitoring.increment_db_operation()
+        async with pool.acquire(name="jobs.lease") as conn:
+            acquired = await conn.fetchval(
+                """
+                INSERT INTO scheduled_jobs (name, lease_owner, lease_until, last_started_at)
+                VALUES ($1, $2, NOW() + make_interval(secs => $3), NOW())
+                ON CONFLICT (name) DO UPDATE
+                SET lease_owner = EXCLUDED.lease_owner, lease_until = EXCLUDED.lease_until,
+                    last_started_at = EXCLUDED.last_started_at
+                WHERE scheduled_jobs.lease_until IS NULL OR scheduled_jobs.lease_until < NOW()
+                   OR scheduled_jobs.lease_owner = EXCLUDED.lease_owner
+                RETURNING TRUE
+                """,
+                name, owner, float(seconds)
+            )
+            return bool(acquired)
+
+    @staticmethod
+    async def finish(pool, name, owner, reason, started_at, duration, status, error=None):
+        """Освобождает аренду, сохраняет итог запуска и добавляет запись в журнал"""
+        monitoring.increment_db_operation()
+        async with pool.acquire(name="jobs.finish") as conn:
+            async with conn.transaction():
+                await conn.execute(
+                    """
+                    INSERT INTO scheduled_jobs (name, last_started_at, last_finished_at, last_success_at,
+                                                last_status, last_duration, last_error)
+                    VALUES ($1, $2, NOW(), CASE WHEN $3 = 'ok' THEN NOW() END, $3, $4, $5)
+                    ON CONFLICT (name) DO UPDATE
+                    SET lease_owner = NULL, lease_until = NULL,
+                        last_finished_at = NOW(),
+                        last_success_at = CASE WHEN $3 = 'ok' THEN NOW() ELSE scheduled_jobs.last_success_at END,
+                        last_status = $3, last_duration = $4, last_error = $5
+                    WHERE scheduled_jobs.lease_owner IS NULL OR scheduled_jobs.lease_owner = $6
+                    """,
+                    name, started_at, status, duration, error, owner
+                )
+                await conn.execute(
+                    """
+                    INSERT INTO job_runs (name, owner, reason, started_at, duration, status, error)
+                    VALUES ($1, $2, $3, $4, $5, $6, $7)
+                    """,
+                    name, owner, reason, started_at, duration, status, error
+                )
+
+    @staticmethod
+    async def get_states(pool):
+        """Возвращает {name: время последнего успешного запуска}"""
+        monitoring.increment_db_operation()
+        async with pool.acquire(name="jobs.states") as conn:
+            rows = await conn.fetch("SELECT name, last_success_at FROM scheduled_jobs")
+            return {row['name']: row['last_success_at'] for row in rows}
+
+    @staticmethod
+    async def prune_runs(pool, days):
+        """Удаляет записи журнала старше days дней"""
+        monitoring.increment_db_operation()
+        async with pool.acquire(name="jobs.prune") as conn:
+            await conn.execute(
+                "DELETE FROM job_runs WHERE started_at < NOW() - make_interval(days => $1)",
+                days
+            )
@@ -0,0 +1,209 @@
+import re
+import time
+import logging
+import contextvars
+from collections import deque
+import asyncpg
+from app.services.tracing import record_span
+from app.config import (
+    DB_POOL_MIN_SIZE, DB_POOL_MAX_SIZE, DB_POOL_MAX_INACTIVE_LIFETIME, DB_COMMAND_TIMEOUT,
+    DB_STATEMENT_TIMEOUT_MS, DB_STATEMENT_CACHE_SIZE, DB_SLOW_QUERY_MS
+)
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин гистограмм задержки (мс)
+LATENCY_BUCKETS_MS = [1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 5000]
+
+# Сколько последних измерений хранить для перцентилей
+SAMPLE_WINDOW = 2000
+
+# Ожидание соединения короче этого в трассу не записывается (секунды)
+ACQUIRE_SPAN_MIN = 0.001
+
+# Имя запроса для телеметрии, задаётся в pool.acquire(name=...)
+current_query_name = contextvars.ContextVar("current_query_name", default=None)
+
+SQL_TARGET = re.compile(r"\b(?:FROM|INTO|UPDATE|TABLE)\s+(?:IF\s+(?:NOT\s+)?EXISTS\s+)?([\w.]+)", re.IGNORECASE)
+
+def query_name_from_sql(query):
+    """Имя запроса по тексту SQL: команда и первая таблица, например 'SELECT chat_history'"""
+    words = query.split(None, 1)
+    if not words:
+        return "unknown"
+    target = SQL_TARGET.search(query)
+    return f"{words[0].upper()} {target.group(1)}" if target else words[0].upper()
+
+class LatencyHistogram:
+    """Гистограмма задержек с перцентилями по последним измерениям"""
+    def __init__(self):
+        self.buckets = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self.samples = deque(maxlen=SAMPLE_WINDOW)
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds, failed=False):
+        ms = seconds * 1000
+        for i, bound in enumerate(LATENCY_BUCKETS_MS):
+            if ms <= bound:
+                self.buckets[i] += 1
+                break
+        else:
+            self.buckets[-1] += 1
+        self.samples.append(seconds)
+        self.count += 1
+        self.errors += bool(failed)
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def percentile(self, pct):
+        if not self.samples:
+            return 0.0
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(pct / 100 * len(ordered)))]
+
+    def get_stats(self):
+        """Счётчики и перцентили (мс)"""
+        labels = [f"<={bound}" for bound in LATENCY_BUCKETS_MS] + [f">{LATENCY_BUCKETS_MS[-1]}"]
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "avg_ms": round(self.total / self.count * 1000, 2) if self.count else 0.0,
+            "p50_ms": round(self.percentile(50) * 1000, 2),
+            "p99_ms": round(self.percentile(99) * 1000, 2),
+            "max_ms": round(self.max * 1000, 2),
+            "histogram": dict(zip(labels, self.buckets))
+        }
+
+class DbTelemetry:
+    """
+    Телеметрия базы данных: время ожидания соединения из пула
+    и задержка запросов по именам
+    """
+    def __init__(self, slow_query_ms=DB_SLOW_QUERY_MS):
+        self.slow_query = slow_query_ms / 1000
+        self.acquire = LatencyHistogram()
+        self.queries = {}  # Имя запроса -> LatencyHistogram
+        self.waiting = 0  # Задачи, ожидающие свободное соединение
+        self.max_waiting = 0
+
+    def record_acquire(self, wait):
+        self.acquire.record(wait)
+
+    def record_query(self, record):
+        """Колбэк asyncpg add_query_logger (вызывается в контексте задачи, выполнившей запрос)"""
+        name = current_query_name.get() or query_name_from_sql(record.query)
+        histogram = self.queries.get(name)
+        if histogram is None:
+            histogram = self.queries[name] = LatencyHistogram()
+        histogram.record(record.elapsed, record.exception is not None)
+        record_span(
+            f"db {name}", record.elapsed,
+            error=f"{type(record.exception).__name__}: {record.exception}" if record.exception else None
+        )
+        if record.elapsed > self.slow_query:
+            logger.warning(
+                "Медленный запрос %s: %.0f мс", name, record.elapsed * 1000,
+                extra={"query_name": name, "elapsed_ms": round(record.elapsed * 1000, 1)}
+            )
+
+    def get_stats(self):
+        return {
+            "acquire": self.acquire.get_stats(),
+            "waiting": self.waiting,
+            "max_waiting": self.max_waiting,
+            "queries": {name: histogram.get_stats() for name, histogram in self.queries.items()}
+        }
+
+# Глобальный экземпляр телеметрии базы данных
+db_telemetry = DbTelemetry()
+
+class _AcquireContext:
+    def __init__(self, pool, name, timeout):
+        self.pool = pool
+        self.name = name
+        self.timeout = timeout
+        self.connection = None
+        self.token = None
+
+    async def __aenter__(self):
+        telemetry = self.pool.telemetry
+        telemetry.waiting += 1
+        telemetry.max_waiting = max(telemetry.max_waiting, telemetry.waiting)
+        start = time.monotonic()
+        try:
+            self.connection = await self.pool.pool.acquire(timeout=self.timeout)
+        finally:
+            telemetry.waiting -= 1
+        wait = time.monotonic() - start
+        telemetry.record_acquire(wait)
+        # Ожидание соединения попадает в трассу, только если оно заметно
+        if wait >= ACQUIRE_SPAN_MIN:
+            record_span("db.acquire", wait, query=self.name)
+        if self.name:
+            self.token = current_query_name.set(self.name)
+        return self.connection
+
+    async def __aexit__(self, *exc_info):
+        if self.token is not None:
+            current_query_name.reset(self.token)
+        await self.pool.pool.release(self.connection)
+
+class InstrumentedPool:
+    """
+    Обёртка над asyncpg.Pool с тем же интерфейсом acquire():
+    замеряет ожидание соединения и именует запросы внутри блока
+        async with pool.acquire(name="chat_history.save") as conn: ...
+    """
+    def __init__(self, pool, telemetry=db_telemetry):
+        self.pool = pool
+        self.telemetry = telemetry
+
+    def acquire(self, name=None, timeout=None):
+        return _AcquireContext(self, name, timeout)
+
+    def __getattr__(self, attr):
+        # close(), execute(), fetch() и прочее - напрямую у asyncpg.Pool
+        return getattr(self.pool, attr)
+
+    def get_stats(self):
+        """Размер пула, свободные соединения и телеметрия"""
+        return dict(
+            self.telemetry.get_stats(),
+            size=self.pool.get_size(),
+            idle=self.pool.get_idle_size(),
+            min_size=self.pool.get_min_size(),
+            max_size=self.pool.get_max_size()
+        )
+
+async def create_db_pool(database_url, min_size=DB_POOL_MIN_SIZE, max_size=DB_POOL_MAX_SIZE,
+                         max_inactive_lifetime=DB_POOL_MAX_INACTIVE_LIFETIME, command_timeout=DB_COMMAND_TIMEOUT,
+                         statement_timeout_ms=DB_STATEMENT_TIMEOUT_MS, statement_cache_size=DB_STATEMENT_CACHE_SIZE,
+                         init=None, telemetry=db_telemetry):
+    """Создает пул соединений с настройками из конфигурации и телеметрией запросов"""
+    async def init_connection(conn):
+        conn.add_query_logger(telemetry.record_query)
+        if init:
+            await init(conn)
+
+    server_settings = {"application_name": "mranatoly_bot"}
+    if statement_timeout_ms:
+        server_settings["statement_timeout"] = str(statement_timeout_ms)
+
+    pool = await asyncpg.create_pool(
+        database_url,
+        min_size=min_size,
+        max_size=max_size,
+        max_inactive_connection_lifetime=max_inactive_lifetime,
+        command_timeout=command_timeout or None,
+        statement_cache_size=statement_cache_size,
+        server_settings=server_settings,
+        init=init_connection
+    )
+    logger.info(
+        f"Пул соединений создан: {min_size}-{max_size} соединений, "
+        f"таймаут команды {command_timeout}с, statement_timeout {statement_timeout_ms} мс"
+    )
+    return InstrumentedPool(pool, telemetry)
@@ -1,25 +1,73 @@
 import logging
+import asyncio
+from datetime import datetime
 from aiogram import types
 from aiogram.filters import Command
 from functools import partial
 from app.services.api import ApiClient
-from app.database.models import ChatHistory
-from app.config import CODE_VERSION, TARGET_CHAT_ID, TEAM_IDS
+from app.services.health import health_monitor
+from app.services.ai_router import ai_router
+from app.services.chat_config import chat_registry
+from app.services.messages import MOSCOW_TZ
+from app.services.quota import quota_budgeter, PRIORITY_OPTIONAL
+from app.services.memory import memory_profiler
+from app.services.tracing import tracer
+from app.database.models import ChatHistory, ChatActivity
+from app.database.pool import InstrumentedPool
+from app.config import CODE_VERSION, TEAM_IDS
 from app.services.monitoring import monitoring, monitor_function
 
 logger = logging.getLogger(__name__)
 
+# Результатов поиска на странице
+SEARCH_PAGE_SIZE = 5
+
+# /top: период по умолчанию и максимальный (дней), число участников в рейтинге
+TOP_DEFAULT_DAYS = 7
+TOP_MAX_DAYS = 365
+TOP_LIMIT = 10
+
+# /stats: сколько самых больших структур памяти показывать и предел длины
+# ответа (сообщение Telegram - не более 4096 символов)
+STATS_BREAKDOWN_TOP = 5
+STATS_MAX_LENGTH = 4000
+
+# Подписи проверок состояния в /test
+HEALTH_LABELS = {
+    "postgres": "🗃️ База данных",
+    "telegram": "🤖 Telegram",
+    "openweather": "🌤️ API погоды",
+    "currency_api": "💱 API валют",
+    "coingecko": "🪙 API криптовалют",
+    "api_football": "⚽ API-Football",
+}
+
+def parse_top_days(text):
+    """Разбирает '/top [дней]', возвращает число дней в пределах 1..TOP_MAX_DAYS"""
+    parts = (text or "").split()[1:]
+    if parts and parts[0].isdigit():
+        return min(max(1, int(parts[0])), TOP_MAX_DAYS)
+    return TOP_DEFAULT_DAYS
+
+def parse_search_args(text):
+    """Разбирает '/search [страница] запрос', возвращает (страница, запрос)"""
+    parts = (text or "").split(maxsplit=2)[1:]
+    if len(parts) == 2 and parts[0].isdigit():
+        return max(1, int(parts[0])), parts[1].strip()
+    return 1, " ".join(parts).strip()
+
 class CommandHandlers:
     def __init__(self, bot, db_pool):
         self.bot = bot
         self.db_pool = db_pool
+        self.job_runner = None  # Задаётся BotApp после создания планировщика
 
     @monitor_function
     async def command_start(self, message: types.Message):
         """Обработчик команды /start"""
         monitoring.increment_command()
         sent_message = await message.reply(f"Привет, я бот версии {CODE_VERSION}")
-        if message.chat.id == TARGET_CHAT_ID:
+        if chat_registry.get(message.chat.id).history_enabled:
             await ChatHistory.save_message(
                 self.db_pool, 
                 message.chat.id, 
@@ -34,7 +82,7 @@ class CommandHandlers:
         """Обработчик команды /version"""
         monitoring.increment_command()
         sent_message = await message.reply(f"Версия бота: {CODE_VERSION}")
-        if message.chat.id == TARGET_CHAT_ID:
+        if chat_registry.get(message.chat.id).history_enabled:
             await ChatHistory.save_message(
                 self.db_pool, 
                 message.chat.id, 
@@ -51,7 +99,7 @@ class CommandHandlers:
         chat_id = message.chat.id
         await ChatHistory.increment_reset_id(self.db_pool, chat_id)
         sent_message = await message.reply("Контекст для AI сброшен, мудила. Начинаем с чистого листа!")
-        if chat_id == TARGET_CHAT_ID:
+        if chat_registry.get(chat_id).history_enabled:
             await ChatHistory.save_message(
                 self.db_pool, 
                 chat_id, 
@@ -75,29 +123,103 @@ class CommandHandlers:
             f"🌐 API-запросов: {stats['api_request_count']}\n"
             f"🧠 AI-запросов: {stats['ai_request_count']}\n"
             f"🗄️ Операций с БД: {stats['db_operation_count']}\n"
-            f"❌ Ошибок: {stats['error_count']}\n\n"
-            f"🤖 Версия бота: {CODE_VERSION}"
+            f"❌ Ошибок: {stats['error_count']} (различных: {stats['distinct_errors']})\n"
         )
-        await message.reply(response)
+        lag = stats['loop_lag']
+        response += (
+            f"⏳ Задержка цикла: p50 {lag['p50_ms']} мс, p99 {lag['p99_ms']} мс, макс {lag['max_ms']} мс, "
+            f"блокировок: {lag['blocking_events']}\n"
+        )
+        if lag['last_blocking']:
+            response += f"   ⛔ {lag['last_blocking']['location']} ({lag['last_blocking']['stalled_ms']} мс)\n"
+        if isinstance(self.db_pool, InstrumentedPool):
+            pool = self.db_pool.get_stats()
+            acquire = pool['acquire']
+            response += (
+                f"🔌 Пул БД: {pool['size']}/{pool['max_size']} соединений, свободно {pool['idle']}, "
+                f"ожидание соединения p50 {acquire['p50_ms']} мс, p99 {acquire['p99_ms']} мс, "
+                f"макс. очередь {pool['max_waiting']}\n"
+            )
+            slowest = sorted(pool['queries'].items(), key=lambda item: item[1]['p99_ms'], reverse=True)
+            for name, query in slowest[:5]:
+                response += f"   • {name}: {query['count']} раз, p50 {query['p50_ms']} мс, p99 {query['p99_ms']} мс\n"
+        for name, provider in ai_router.get_stats().items():
+            cooldown = f", исключён ещё {provider['cooldown_s']} с" if provider['cooldown_s'] else ""
+            ewma = provider['ewma_ms'] if provider['ewma_ms'] is not None else "-"
+            response += (
+                f"🧠 AI {name} ({provider['model']}): EWMA {ewma} мс, "
+                f"запросов {provider['requests']}, ошибок {provider['errors']}, "
+                f"таймаутов {provider['timeouts']}, резервных {provider['fallbacks']}{cooldown}\n"
+            )
+        traces = tracer.get_stats()
+        if traces['enabled']:
+            response += (
+                f"🔎 Трассы: {traces['traces']}, медленных (>{traces['slow_ms']:.0f} мс) {traces['slow']}, "
+                f"записано {traces['exported']}\n"
+            )
+        registry = chat_registry.get_stats()
+        response += f"⚙️ Настроено чатов: {registry['chats']}, обновлений настроек: {registry['notifications']}\n"
+        try:
+            activity = await ChatActivity.get_summary(self.db_pool, message.chat.id, TOP_DEFAULT_DAYS)
+            if activity and activity['messages']:
+                response += (
+                    f"📈 Активность чата: сегодня {activity['today']} сообщ., "
+                    f"за {TOP_DEFAULT_DAYS} дн. {activity['messages']} от {activity['users']} участников, "
+                    f"пик {activity['busiest_day'].strftime('%d.%m')} ({activity['busiest_messages']})\n"
+                )
+        except Exception as e:
+            logger.error(f"Ошибка получения активности чата: {e}")
+        if self.job_runner:
+            for name, job in self.job_runner.get_stats().items():
+                if job['runs'] or job['skipped']:
+                    status = "выполняется" if job['running'] else job['last_status'] or "-"
+                    response += (
+                        f"🗓️ {name}: {status}, {job['last_duration_s']}с, "
+                        f"запусков {job['runs']}, ошибок {job['failures']}, пропущено {job['skipped']}\n"
+                    )
+        backup = stats['last_backup']
+        if backup:
+            response += (
+                f"💾 Последний бэкап: {backup['size_mb']} МБ за {backup['duration_s']}с "
+                f"({backup['throughput_mb_s']} МБ/с)\n"
+            )
+        for quota_key, quota in quota_budgeter.get_stats().items():
+            limit = quota['limit'] if quota['limit'] is not None else "?"
+            response += f"📉 Квота {quota_key}: {quota['remaining']}/{limit}"
+            if quota['reset_in_s'] is not None:
+                response += f", сброс через {quota['reset_in_s'] // 60} мин"
+            if quota['deferred']:
+                response += f", отложено запросов: {quota['deferred']}"
+            response += "\n"
+        memory = memory_profiler.get_stats()
+        if memory['enabled']:
+            response += f"🔬 tracemalloc: {memory['traced_mb']} МБ (пик {memory['peak_mb']} МБ)\n"
+        largest = sorted(memory['breakdown'].items(), key=lambda item: item[1][1], reverse=True)
+        for name, (count, size) in largest[:STATS_BREAKDOWN_TOP]:
+            response += f"   • {name}: {count} эл., ~{size / 1024:.1f} КБ\n"
+        for site in memory['top_sites']:
+            response += f"   ↑ {site}\n"
+        footer = f"\n🤖 Версия бота: {CODE_VERSION}"
+        await message.reply(response[:STATS_MAX_LENGTH - len(footer)] + footer)
 
     @monitor_function
     async def command_test(self, message: types.Message):
         """Тестовая команда для проверки работоспособности бота"""
         monitoring.increment_command()
         try:
-            # Тестируем базу данных
-            db_ok = await self.check_database_health()
-            
-            # Тестируем API-клиенты
-            weather_test = await ApiClient.get_weather("Minsk,BY")
-            currency_test = await ApiClient.get_currency_rates()
-            
-            response = (
-                f"🧪 Тест системы:\n\n"
-                f"🤖 Бот: Онлайн ✅\n"
-                f"🗃️ База данных: {'Работает ✅' if db_ok else 'Ошибка ❌'}\n"
-                f"🌤️ API погоды: {'Работает ✅' if 'Нет данных' not in weather_test else 'Ошибка ❌'}\n"
-                f"💱 API валют: {'Работает ✅' if all(currency_test) else 'Ошибка ❌'}\n\n"
+            # Результаты фоновых проверок: команда не обращается к внешним сервисам
+            response = "🧪 Тест системы:\n\n🤖 Бот: Онлайн ✅\n"
+            for name, probe in health_monitor.snapshot().items():
+                label = HEALTH_LABELS.get(name) or (f"🧠 AI {name[3:]}" if name.startswith("ai:") else name)
+                if probe['ok'] and not probe['stale']:
+                    status = f"Работает ✅ ({probe['latency_ms']} мс)"
+                elif probe['ok']:
+                    status = "Давно не проверялся ⚠️"
+                else:
+                    status = f"Ошибка ❌ ({probe['error']})"
+                response += f"{label}: {status}, {probe['age_s']} с назад\n"
+            response += (
+                f"\n🚦 Готовность: {'да ✅' if health_monitor.is_ready() else 'нет ❌'}\n"
                 f"📋 Версия: {CODE_VERSION}"
             )
             
@@ -106,20 +228,62 @@ class CommandHandlers:
             logger.error(f"Ошибка в команде /test: {e}")
             await message.reply(f"❌ Произошла ошибка: {e}")
 
-    async def check_database_health(self):
-        """Проверяет доступность базы данных и логирует результат"""
+    @monitor_function
+    async def command_search(self, message: types.Message):
+        """Обработчик команды /search для полнотекстового поиска по истории чата"""
+        monitoring.increment_command()
+        page, query = parse_search_args(message.text)
+        if not query:
+            await message.reply("Использование: /search [страница] запрос\nНапример: /search Салах гол")
+            return
+
+        total, results = await ChatHistory.search(
+            self.db_pool, message.chat.id, query,
+            limit=SEARCH_PAGE_SIZE, offset=(page - 1) * SEARCH_PAGE_SIZE
+        )
+        if not results:
+            await message.reply("Ничего не нашёл, мудила. Попробуй другие слова." if page == 1
+                                else "На этой странице уже ничего нет.")
+            return
+
+        pages = (total + SEARCH_PAGE_SIZE - 1) // SEARCH_PAGE_SIZE
+        response = f"🔎 Найдено: {total} (стр. {page}/{pages})\n\n"
+        for number, result in enumerate(results, start=(page - 1) * SEARCH_PAGE_SIZE + 1):
+            date = datetime.fromtimestamp(result['timestamp'], MOSCOW_TZ).strftime('%d.%m.%Y %H:%M')
+            author = "бот" if result['role'] == "assistant" else f"id{result['user_id']}"
+            response += f"{number}. {date}, {author}: {result['snippet']}\n\n"
+        if page < pages:
+            response += f"Дальше: /search {page + 1} {query}"
+        # Результаты поиска не сохраняются в историю, иначе они сами попадали бы в следующие поиски
+        await message.reply(response[:4000])
+
+    async def _member_name(self, chat_id, user_id):
+        """Имя участника для рейтинга (id, если Telegram не ответил)"""
         try:
-            async with self.db_pool.acquire() as conn:
-                result = await conn.fetchval("SELECT 1")
-                if result == 1:
-                    logger.info("Проверка базы данных: ОК")
-                    return True
-                else:
-                    logger.error(f"Проверка базы данных вернула неожиданный результат: {result}")
-                    return False
+            member = await self.bot.get_chat_member(chat_id, user_id)
+            return member.user.full_name
         except Exception as e:
-            logger.error(f"Ошибка при проверке базы данных: {e}")
-            return False
+            logger.debug(f"Не удалось получить участника {user_id}: {e}")
+            return f"id{user_id}"
+
+    @monitor_function
+    async def command_top(self, message: types.Message):
+        """Обработчик команды /top: самые активные участники чата за период"""
+        monitoring.increment_command()
+        days = parse_top_days(message.text)
+        rows = await ChatActivity.get_top(self.db_pool, message.chat.id, days, TOP_LIMIT)
+        if not rows:
+            await message.reply(f"За {days} дн. тут никто ничего не писал. Или история чата не ведётся.")
+            return
+
+        names = await asyncio.gather(*(self._member_name(message.chat.id, row['user_id']) for row in rows))
+        response = f"🏆 Самые активные за {days} дн.:\n\n"
+        for number, (row, name) in enumerate(zip(rows, names), start=1):
+            response += (
+                f"{number}. {name}: {row['messages']} сообщ., "
+                f"{row['chars']} симв., дней: {row['active_days']}\n"
+            )
+        await message.reply(response)
 
     @monitor_function
     async def command_team_matches(self, message: types.Message, team_name):
@@ -128,7 +292,7 @@ class CommandHandlers:
         team_id = TEAM_IDS.get(team_name)
         if not team_id:
             sent_message = await message.reply("Команда не найдена, мудила!")
-            if message.chat.id == TARGET_CHAT_ID:
+            if chat_registry.get(message.chat.id).history_enabled:
                 await ChatHistory.save_message(
                     self.db_pool, 
                     message.chat.id, 
@@ -142,7 +306,7 @@ class CommandHandlers:
         data = await ApiClient.get_team_matches(team_id)
         if not data or not data.get("response"):
             sent_message = await message.reply("Не удалось получить данные о матчах. Пиздец какой-то!")
-            if message.chat.id == TARGET_CHAT_ID:
+            if chat_registry.get(message.chat.id).history_enabled:
                 await ChatHistory.save_message(
                     self.db_pool, 
                     message.chat.id, 
@@ -165,9 +329,12 @@ class CommandHandlers:
                 if fixture["teams"]["home"]["id"] == team_id else \
                 ("🟢" if away_goals > home_goals else "🔴" if away_goals < home_goals else "🟡")
             
-            events_data = await ApiClient.get_match_events(fixture_id)
+            # События старых матчей - необязательные данные, при нехватке квоты их пропускаем
+            events_data = await ApiClient.get_match_events(fixture_id, priority=PRIORITY_OPTIONAL)
             goals_str = "Голы: "
-            if events_data and events_data.get("response"):
+            if events_data and events_data.get("quota_deferred"):
+                goals_str += "пропущено (бережём квоту API)"
+            elif events_data and events_data.get("response"):
                 goal_events = [e for e in events_data["response"] if e["type"] == "Goal"]
                 goals_str += ", ".join([f"{e['player']['name']} ({e['time']['elapsed']}')" for e in goal_events]) \
                     if goal_events else "Нет данных о голах"
@@ -177,7 +344,7 @@ class CommandHandlers:
             response += f"{result_icon} {date}: {home_team} {home_goals} - {away_goals} {away_team}\n{goals_str}\n\n"
         
         sent_message = await message.reply(response)
-        if message.chat.id == TARGET_CHAT_ID:
+        if chat_registry.get(message.chat.id).history_enabled:
             await ChatHistory.save_message(
                 self.db_pool, 
                 message.chat.id, 
@@ -1,14 +1,19 @@
 import logging
 import random
+import asyncio
+import weakref
 from aiogram import types
 from aiogram.types import ReactionTypeEmoji
 from app.services.ai import AiHandler
-from app.database.models import ChatHistory
+from app.database.models import ChatHistory, ChatSummaries
+from app.services.summaries import ConversationSummarizer
 from app.config import (
-    TARGET_USER_ID, TARGET_CHAT_ID, RESPONSES_SOSAL, 
-    RARE_RESPONSE_SOSAL, RESPONSE_LETAL, RESPONSES_SCAMIL, TARGET_REACTION
+    RESPONSES_SOSAL, RARE_RESPONSE_SOSAL, RESPONSE_LETAL, RESPONSES_SCAMIL,
+    AI_MEMORY_ENABLED, AI_MEMORY_TOP_K, AI_SUMMARY_ENABLED
 )
-from app.services.monitoring import monitoring, monitor_function
+from app.services.chat_config import chat_registry
+from app.services.monitoring import monitoring, monitor_function, RateLimiter
+from app.services.tracing import span, attach_task
 
 logger = logging.getLogger(__name__)
 
@@ -17,6 +22,18 @@ class MessageHandlers:
         self.bot = bot
         self.db_pool = db_pool
         self.bot_info = None
+        self.background_tasks = set()  # Фоновые этапы обработки (сохранение, реакции)
+        self.summarizer = ConversationSummarizer(db_pool) if AI_SUMMARY_ENABLED else None
+        self.ai_limiters = {}  # chat_id -> RateLimiter для чатов с ai_rate_limit
+        # Одна проба на все ограничители; weakref не удерживает обработчик в памяти
+        handlers = weakref.ref(self)
+
+        def limiter_timestamps():
+            owner = handlers()
+            limiters = owner.ai_limiters if owner else {}
+            return {chat_id: limiter.user_timestamps for chat_id, limiter in limiters.items()}
+
+        monitoring.register_size_probe("MessageHandlers.ai_limiters", limiter_timestamps)
     
     async def init_bot_info(self):
         """Инициализирует информацию о боте"""
@@ -25,7 +42,13 @@ class MessageHandlers:
     
     @monitor_function
     async def handle_message(self, message: types.Message):
-        """Основной обработчик всех входящих сообщений"""
+        """
+        Основной обработчик всех входящих сообщений.
+        Независимые этапы выполняются параллельно: сохранение сообщения и реакция
+        идут в фоне и не задерживают ответ, история чата запрашивается сразу,
+        как только понятно, что сообщение адресовано боту.
+        """
+        context_task = None
         try:
             if not message.from_user or not message.text:
                 return
@@ -39,25 +62,68 @@ class MessageHandlers:
             chat_id = message.chat.id
             user_id = message.from_user.id
             message_id = message.message_id
-            logger.info(f"Сообщение от {user_id} в чате {chat_id}: {message.text[:50]}...")
+            # Настройки чата берутся из памяти, без запроса к БД
+            chat_config = chat_registry.get(chat_id)
+            logger.info(
+                "Сообщение от %s в чате %s: %.50s...", user_id, chat_id, message.text,
+                extra={"chat_id": chat_id, "user_id": user_id}
+            )
+            
+            # Сохраняем сообщение в базу данных если нужно (в фоне)
+            user_saved = None
+            if chat_config.history_enabled:
+                user_saved = self._spawn(
+                    self._save_message_safe(chat_id, user_id, message_id, "user", message.text),
+                    "save_user_message"
+                )
             
-            # Сохраняем сообщение в базу данных если нужно
-            if chat_id == TARGET_CHAT_ID:
-                await self._save_message_safe(chat_id, user_id, message_id, "user", message.text)
+            # Обрабатываем реакции если нужно (в фоне)
+            if user_id in chat_config.reaction_user_ids:
+                self._spawn(self._process_reactions(message, chat_config.reaction_emoji), "set_reaction")
             
-            # Обрабатываем реакции если нужно
-            await self._process_reactions(message)
+            # Запрос к AI: контекст начинаем загружать до проверки шаблонов
+            mention = self._detect_mention(message) if chat_config.ai_enabled else None
+            if mention and mention[0]:
+                if not self._ai_allowed(chat_config, user_id):
+                    await message.reply(f"Охолони, не больше {chat_config.ai_rate_limit} вопросов в минуту.")
+                    return
+                context_task = asyncio.create_task(self._load_context(message, mention[0], chat_config))
             
             # Обрабатываем шаблонные ответы
-            if await self._process_template_responses(message):
+            if await self._process_template_responses(message, user_saved):
                 return
             
             # Проверяем, нужно ли обрабатывать как запрос к AI
-            await self._process_ai_request(message)
+            if mention:
+                await self._process_ai_request(message, *mention, context_task, user_saved)
             
         except Exception as e:
             logger.error(f"Ошибка при обработке сообщения: {e}")
             monitoring.log_error(e, {"message": message.text})
+        finally:
+            # Контекст не понадобился (шаблонный ответ или ошибка)
+            if context_task and not context_task.done():
+                context_task.cancel()
+
+    def _spawn(self, coro, name):
+        """Запускает этап в фоне; ответ пользователю его не ждёт, ошибки учитываются в мониторинге"""
+        task = asyncio.create_task(coro, name=name)
+        self.background_tasks.add(task)
+        task.add_done_callback(self._on_background_done)
+        attach_task(task)
+        return task
+
+    def _on_background_done(self, task):
+        self.background_tasks.discard(task)
+        if not task.cancelled() and task.exception():
+            monitoring.log_error(task.exception(), {"stage": task.get_name()})
+
+    async def drain(self, timeout=None):
+        """Ожидает завершения фоновых этапов (при остановке бота)"""
+        if self.background_tasks:
+            await asyncio.wait(list(self.background_tasks), timeout=timeout)
+        if self.summarizer:
+            await self.summarizer.drain(timeout=timeout)
 
     async def _save_message_safe(self, chat_id, user_id, message_id, role, content):
         """Безопасное сохранение сообщения с обработкой ошибок"""
@@ -68,67 +134,113 @@ class MessageHandlers:
         except Exception as e:
             logger.error(f"Ошибка при сохранении сообщения: {e}")
 
-    async def _process_reactions(self, message):
-        """Обрабатывает реакции на сообщения"""
-        if message.from_user.id == TARGET_USER_ID:
-            try:
-                await self.bot.set_message_reaction(
-                    chat_id=message.chat.id,
-                    message_id=message.message_id,
-                    reaction=[ReactionTypeEmoji(emoji=TARGET_REACTION)]
-                )
-            except Exception as e:
-                logger.error(f"Ошибка при установке реакции: {e}")
+    async def _save_reply_after(self, user_saved, chat_id, message_id, content):
+        # Ответ бота сохраняется после сообщения пользователя, чтобы не нарушить порядок истории
+        if user_saved is not None:
+            await asyncio.wait([user_saved])
+        await self._save_message_safe(chat_id, self.bot_info.id, message_id, "assistant", content)
+
+    def _save_reply(self, message, sent_message, content, user_saved=None):
+        """Сохраняет ответ бота в фоне"""
+        if chat_registry.get(message.chat.id).history_enabled:
+            self._spawn(
+                self._save_reply_after(user_saved, message.chat.id, sent_message.message_id, content),
+                "save_reply"
+            )
+
+    async def _process_reactions(self, message, emoji):
+        """Ставит реакцию на сообщение пользователя из reaction_user_ids чата"""
+        try:
+            await self.bot.set_message_reaction(
+                chat_id=message.chat.id,
+                message_id=message.message_id,
+                reaction=[ReactionTypeEmoji(emoji=emoji)]
+            )
+        except Exception as e:
+            logger.error(f"Ошибка при установке реакции: {e}")
+
+    def _ai_allowed(self, chat_config, user_id):
+        """Проверяет ограничение числа запросов к AI в минуту для чата (0 - без ограничения)"""
+        if not chat_config.ai_rate_limit:
+            return True
+        limiter = self.ai_limiters.get(chat_config.chat_id)
+        if limiter is None or limiter.rate_limit != chat_config.ai_rate_limit:
+            limiter = self.ai_limiters[chat_config.chat_id] = RateLimiter(chat_config.ai_rate_limit, 60)
+        return limiter.can_process(user_id)
 
-    async def _process_template_responses(self, message):
+    async def _process_template_responses(self, message, user_saved=None):
         """Обрабатывает шаблонные ответы на определенные сообщения"""
         message_text = message.text.lower()
         
         if message_text in ['сосал?', 'sosal?']:
             response = RARE_RESPONSE_SOSAL if random.random() < 0.1 else random.choice(RESPONSES_SOSAL)
-            sent_message = await message.reply(response)
-            if message.chat.id == TARGET_CHAT_ID:
-                await self._save_message_safe(message.chat.id, self.bot_info.id, sent_message.message_id, "assistant", response)
-            return True
-            
         elif message_text == 'летал?':
-            sent_message = await message.reply(RESPONSE_LETAL)
-            if message.chat.id == TARGET_CHAT_ID:
-                await self._save_message_safe(message.chat.id, self.bot_info.id, sent_message.message_id, "assistant", RESPONSE_LETAL)
-            return True
-            
+            response = RESPONSE_LETAL
         elif message_text == 'скамил?':
             response = random.choice(RESPONSES_SCAMIL)
-            sent_message = await message.reply(response)
-            if message.chat.id == TARGET_CHAT_ID:
-                await self._save_message_safe(message.chat.id, self.bot_info.id, sent_message.message_id, "assistant", response)
-            return True
+        else:
+            return False
             
-        return False
+        sent_message = await message.reply(response)
+        self._save_reply(message, sent_message, response, user_saved)
+        return True
 
-    async def _process_ai_request(self, message):
-        """Обрабатывает запросы к AI"""
+    def _detect_mention(self, message):
+        """
+        Проверяет, адресовано ли сообщение боту.
+        Возвращает (запрос, ответ_на_сообщение_бота) или None
+        """
         message_text = message.text.lower()
         bot_username = f"@{self.bot_info.username.lower()}"
         bot_id = self.bot_info.id
         
-        is_reply_to_bot = (message.reply_to_message and 
-                          message.reply_to_message.from_user and 
-                          message.reply_to_message.from_user.id == bot_id)
+        is_reply_to_bot = bool(message.reply_to_message and 
+                               message.reply_to_message.from_user and 
+                               message.reply_to_message.from_user.id == bot_id)
         is_tagged = bot_username in message_text
         
         if not (is_tagged or is_reply_to_bot):
-            return
+            return None
         
         query = message_text.replace(bot_username, "").strip() if is_tagged else message_text
+        return query, is_reply_to_bot
+
+    async def _load_context(self, message, query, chat_config):
+        """
+        Параллельно загружает последние сообщения (после сводки, если она ведётся),
+        сводку разговора и релевантные запросу старые сообщения.
+        Возвращает (история, память, сводка)
+        """
+        async def nothing(default):
+            return default
+
+        chat_id = message.chat.id
+        return tuple(await asyncio.gather(
+            ChatHistory.get_chat_history(
+                self.db_pool, chat_id, limit=chat_config.history_limit,
+                exclude_message_id=message.message_id, after_summary=self.summarizer is not None
+            ),
+            ChatHistory.get_relevant_messages(
+                self.db_pool, chat_id, query, limit=AI_MEMORY_TOP_K, recent_window=chat_config.history_limit
+            ) if AI_MEMORY_ENABLED else nothing([]),
+            ChatSummaries.get_current(self.db_pool, chat_id) if self.summarizer else nothing(None)
+        ))
+
+    async def _process_ai_request(self, message, query, is_reply_to_bot, context_task=None, user_saved=None):
+        """Обрабатывает запросы к AI"""
         if not query:
-            sent_message = await message.reply("И хуле ты мне пишешь пустоту, петушара?")
-            if message.chat.id == TARGET_CHAT_ID:
-                await self._save_message_safe(message.chat.id, bot_id, sent_message.message_id, "assistant", "И хуле ты мне пишешь пустоту, петушара?")
+            response = "И хуле ты мне пишешь пустоту, петушара?"
+            sent_message = await message.reply(response)
+            self._save_reply(message, sent_message, response, user_saved)
             return
         
-        # Получаем историю чата
-        chat_history = await ChatHistory.get_chat_history(self.db_pool, message.chat.id)
+        # Получаем историю чата и долговременную память (запросы уже выполняются с начала обработки)
+        if context_task is None:
+            context_task = asyncio.create_task(
+                self._load_context(message, query, chat_registry.get(message.chat.id))
+            )
+        with span("context.wait"):
+            chat_history, memory, summary = await context_task
         
         # Если это ответ на сообщение бота, добавляем это сообщение в историю
         if is_reply_to_bot and message.reply_to_message.text:
@@ -138,11 +250,15 @@ class MessageHandlers:
         monitoring.increment_ai_request()
         
         # Отправляем запрос к AI
-        ai_response = await AiHandler.get_ai_response(chat_history, query)
+        with span("ai.response"):
+            ai_response = await AiHandler.get_ai_response(chat_history, query, memory, summary)
         
         # Отправляем ответ
         sent_message = await message.reply(ai_response)
         
-        # Сохраняем ответ бота в историю чата
-        if message.chat.id == TARGET_CHAT_ID:
-            await self._save_message_safe(message.chat.id, bot_id, sent_message.message_id, "assistant", ai_response)
\ No newline at end of file
+        # Сохраняем ответ бота в историю чата (в фоне)
+        self._save_reply(message, sent_message, ai_response, user_saved)
+        
+        # Сворачиваем вышедшие из окна сообщения в сводку - вне пути ответа
+        if self.summarizer and chat_registry.get(message.chat.id).history_enabled:
+            self.summarizer.schedule(message.chat.id)
@@ -0,0 +1,118 @@
+import sys
+import json
+import queue
+import atexit
+import logging
+import logging.handlers
+from datetime import datetime, timezone
+from app.config import LOG_LEVEL, LOG_FORMAT, LOG_SAMPLE_RATES
+
+# Стандартные атрибуты LogRecord - всё остальное считается полями из extra
+RESERVED_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+class JsonFormatter(logging.Formatter):
+    """Форматирует запись в одну строку JSON"""
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in RESERVED_ATTRS and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class SamplingFilter(logging.Filter):
+    """
+    Пропускает каждую N-ю запись уровня INFO и ниже для логгеров из списка.
+    Предупреждения и ошибки не отбрасываются никогда.
+    """
+    def __init__(self, rates):
+        super().__init__()
+        # Логгер -> N (оставляем одну запись из N)
+        self.every = {name: max(1, round(1 / rate)) for name, rate in rates.items() if rate > 0}
+        self.dropped_all = {name for name, rate in rates.items() if rate <= 0}
+        self.counters = {}
+
+    def _rule(self, name):
+        # Правило для логгера или ближайшего родителя
+        while name:
+            if name in self.every or name in self.dropped_all:
+                return name
+            name = name.rpartition(".")[0]
+        return None
+
+    def filter(self, record):
+        if record.levelno > logging.INFO:
+            return True
+        rule = self._rule(record.name)
+        if rule is None:
+            return True
+        if rule in self.dropped_all:
+            return False
+        every = self.every[rule]
+        count = self.counters.get(rule, 0)
+        self.counters[rule] = count + 1
+        if count % every:
+            return False
+        record.sampled = every
+        return True
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Кладёт запись в очередь без форматирования: сообщение собирается
+    в потоке QueueListener, а не в цикле событий
+    """
+    def prepare(self, record):
+        return record
+
+def parse_sample_rates(value):
+    """Разбирает строку вида 'app.handlers.messages:0.1,aiogram.event:0.05'"""
+    rates = {}
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        name, _, rate = item.partition(":")
+        rates[name.strip()] = float(rate)
+    return rates
+
+_listener = None
+
+def setup_logging(level=LOG_LEVEL, log_format=LOG_FORMAT, sample_rates=LOG_SAMPLE_RATES):
+    """
+    Направляет все логи через очередь в фоновый поток вывода.
+    Возвращает QueueListener (останавливается автоматически при выходе).
+    """
+    global _listener
+    if _listener is not None:
+        return _listener
+
+    output = logging.StreamHandler(sys.stdout)
+    if log_format == "json":
+        output.setFormatter(JsonFormatter())
+    else:
+        output.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+
+    log_queue = queue.SimpleQueue()
+    handler = NonBlockingQueueHandler(log_queue)
+    handler.addFilter(SamplingFilter(parse_sample_rates(sample_rates)))
+
+    root = logging.getLogger()
+    for existing in root.handlers[:]:
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(level)
+
+    _listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+    return _listener
+
+def stop_logging():
+    """Дописывает оставшиеся записи и останавливает фоновый поток"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
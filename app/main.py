@@ -1,8 +1,10 @@
 import asyncio
 import logging
 import sys
+from app import runtime
+from app.log import setup_logging, stop_logging
 from app.bot import BotApp
-from app.config import CODE_VERSION
+from app.config import CODE_VERSION, FAST_RUNTIME
 
 logger = logging.getLogger(__name__)
 
@@ -20,4 +22,12 @@ async def main():
 
 if __name__ == "__main__":
     print(f"Старт приложения. Версия: {CODE_VERSION}")
-    asyncio.run(main())
\ No newline at end of file
+    # Логи пишутся фоновым потоком, чтобы вывод в stdout не блокировал цикл событий
+    setup_logging()
+    # uvloop и orjson подключаются до создания цикла событий и сессии бота
+    if FAST_RUNTIME:
+        runtime.install_fast_runtime()
+    try:
+        asyncio.run(main())
+    finally:
+        stop_logging()
\ No newline at end of file
@@ -0,0 +1,44 @@
+import json
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Функции (де)сериализации JSON, используемые сессией aiogram и ApiGateway.
+# По умолчанию - стандартная библиотека, install_fast_runtime() подменяет их на orjson.
+json_loads = json.loads
+json_dumps = json.dumps
+
+# Что удалось включить в быстром режиме
+enabled = {"uvloop": False, "orjson": False}
+
+def install_fast_runtime():
+    """
+    Включает uvloop и orjson, если они установлены.
+    Без них бот продолжает работать на стандартном asyncio и json.
+    Вызывается до создания цикла событий и BotApp.
+    """
+    global json_loads, json_dumps
+
+    try:
+        import uvloop
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+        enabled["uvloop"] = True
+    except ImportError:
+        logger.info("uvloop не установлен, используется стандартный цикл asyncio")
+
+    try:
+        import orjson
+
+        def orjson_dumps(obj, **kwargs):
+            # aiogram и aiohttp ожидают str
+            return orjson.dumps(obj).decode()
+
+        json_loads = orjson.loads
+        json_dumps = orjson_dumps
+        enabled["orjson"] = True
+    except ImportError:
+        logger.info("orjson не установлен, используется стандартный json")
+
+    logger.info(f"Быстрый режим выполнения: {enabled}")
+    return dict(enabled)
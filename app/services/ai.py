@@ -1,41 +1,82 @@
 import logging
-from openai import AsyncOpenAI
-from app.config import DEEPSEEK_API_KEY, AI_SYSTEM_PROMPT, MAX_TOKENS, AI_TEMPERATURE
+from datetime import datetime
+from app.config import (
+    AI_SYSTEM_PROMPT, MAX_TOKENS, AI_TEMPERATURE, AI_MEMORY_SNIPPET_CHARS, AI_SUMMARY_MAX_TOKENS
+)
+from app.services.ai_router import ai_router
 
 logger = logging.getLogger(__name__)
 
-# Настройка клиента DeepSeek
-deepseek_client = AsyncOpenAI(api_key=DEEPSEEK_API_KEY, base_url="https://api.deepseek.com")
+def format_memory(memory, snippet_chars=AI_MEMORY_SNIPPET_CHARS):
+    """Сжатое системное сообщение со старыми релевантными сообщениями чата"""
+    lines = ["Старые сообщения этого чата, которые могут относиться к вопросу:"]
+    for item in sorted(memory, key=lambda item: item["timestamp"] or 0):
+        date = datetime.fromtimestamp(item["timestamp"]).strftime('%Y-%m-%d') if item["timestamp"] else "?"
+        author = "ты" if item["role"] == "assistant" else "участник"
+        content = " ".join(item["content"].split())
+        if len(content) > snippet_chars:
+            content = content[:snippet_chars - 1] + "…"
+        lines.append(f"[{date}] {author}: {content}")
+    return {"role": "system", "content": "\n".join(lines)}
+
+SUMMARY_PROMPT = (
+    "Ты ведёшь краткое содержание разговора в Telegram-группе. Обнови сводку с учётом новых сообщений: "
+    "сохрани темы, факты, договорённости, мнения участников и обещания бота, убери повторы и мелочи. "
+    "Пиши по-русски, сжато, не длиннее 15 предложений. Ответь только текстом новой сводки."
+)
 
 # Класс для работы с AI
 class AiHandler:
     @staticmethod
-    async def get_ai_response(chat_history, query):
-        """Получает ответ от AI на основе истории чата и запроса"""
+    async def get_ai_response(chat_history, query, memory=None, summary=None):
+        """
+        Получает ответ от AI на основе истории чата и запроса.
+        memory - релевантные старые сообщения вне окна истории (долговременная память),
+        summary - сводка более ранней части разговора
+        """
         try:
-            messages = [
-                {"role": "system", "content": AI_SYSTEM_PROMPT}
-            ] + chat_history + [{"role": "user", "content": query}]
-            
-            logger.info(f"Отправка запроса к AI: {query[:50]}...")
+            messages = [{"role": "system", "content": AI_SYSTEM_PROMPT}]
+            if summary:
+                messages.append({"role": "system", "content": f"Краткое содержание разговора до этого момента:\n{summary}"})
+            if memory:
+                messages.append(format_memory(memory))
+            messages += chat_history + [{"role": "user", "content": query}]
             
-            # Можно добавить повторные попытки здесь, если API нестабильно
-            for attempt in range(3):
-                try:
-                    response = await deepseek_client.chat.completions.create(
-                        model="deepseek-chat",
-                        messages=messages,
-                        max_tokens=MAX_TOKENS,
-                        temperature=AI_TEMPERATURE
-                    )
-                    return response.choices[0].message.content
-                except Exception as e:
-                    logger.warning(f"Попытка {attempt+1}/3 запроса к AI не удалась: {e}")
-                    if attempt == 2:  # последняя попытка
-                        raise
+            logger.info(
+                "Отправка запроса к AI: %.50s...", query,
+                extra={"history_len": len(chat_history), "memory_len": len(memory or [])}
+            )
             
-            # Этот код не должен выполняться, но для полноты:
-            return "Ошибка получения ответа от AI"
+            # Повторы и переключение между провайдерами - в маршрутизаторе
+            return await ai_router.complete(messages, MAX_TOKENS, AI_TEMPERATURE)
         except Exception as e:
             logger.error(f"Ошибка при получении ответа от AI: {e}")
-            return f"Ошибка, ёбана: {str(e)}"
\ No newline at end of file
+            return f"Ошибка, ёбана: {str(e)}"
+
+    @staticmethod
+    async def summarize(previous_summary, rows):
+        """
+        Дополняет сводку разговора новыми сообщениями.
+        rows - записи chat_history (user_id, role, content) в хронологическом порядке.
+        Возвращает текст новой сводки или None при ошибке
+        """
+        lines = [
+            f"{'бот' if row['role'] == 'assistant' else 'id' + str(row['user_id'])}: {' '.join(row['content'].split())}"
+            for row in rows
+        ]
+        prompt = (
+            f"Текущая сводка:\n{previous_summary or '(пока пусто)'}\n\n"
+            f"Новые сообщения:\n" + "\n".join(lines)
+        )
+        try:
+            content = await ai_router.complete(
+                [
+                    {"role": "system", "content": SUMMARY_PROMPT},
+                    {"role": "user", "content": prompt}
+                ],
+                AI_SUMMARY_MAX_TOKENS, 0.3
+            )
+            return (content or "").strip() or None
+        except Exception as e:
+            logger.warning(f"Не удалось обновить сводку разговора: {e}")
+            return None
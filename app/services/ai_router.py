@@ -0,0 +1,179 @@
+import os
+import time
+import random
+import asyncio
+import logging
+import openai
+from openai import AsyncOpenAI
+from app.config import (
+    AI_PROVIDERS, DEEPSEEK_API_KEY, DEEPSEEK_BASE_URL, DEEPSEEK_MODEL, AI_REQUEST_TIMEOUT,
+    AI_MAX_ATTEMPTS, AI_EWMA_ALPHA, AI_PRIORITY_PENALTY, AI_PROVIDER_COOLDOWN, AI_EXPLORE_RATE
+)
+from app.services.tracing import span
+
+logger = logging.getLogger(__name__)
+
+# Максимальная пауза провайдера после серии сбоев (секунды)
+COOLDOWN_MAX = 600
+
+# Ошибки, которые говорят о проблемах провайдера, а не запроса:
+# после них провайдер на время исключается из маршрутизации
+PROVIDER_ERRORS = (
+    asyncio.TimeoutError, openai.APITimeoutError, openai.APIConnectionError,
+    openai.RateLimitError, openai.InternalServerError
+)
+
+class AiUnavailableError(Exception):
+    """Ни один AI-провайдер не ответил"""
+
+class AiProvider:
+    """OpenAI-совместимый провайдер: модель, лимиты, приоритет и статистика задержки"""
+    def __init__(self, name, base_url, api_key, model, priority=0, max_concurrency=10,
+                 max_tokens=None, timeout=AI_REQUEST_TIMEOUT, client=None):
+        self.name = name
+        self.model = model
+        self.priority = priority
+        self.max_concurrency = max_concurrency
+        self.max_tokens = max_tokens
+        self.timeout = timeout
+        # Повторы выполняет маршрутизатор, переключаясь на другого провайдера
+        self.client = client or AsyncOpenAI(api_key=api_key, base_url=base_url, max_retries=0, timeout=timeout)
+        self.ewma = None  # Сглаженная задержка успешных ответов (секунды)
+        self.inflight = 0
+        self.failures = 0  # Сбоев подряд
+        self.cooldown_until = 0.0
+        self.stats = {"requests": 0, "errors": 0, "timeouts": 0, "fallbacks": 0, "last_error": None}
+
+    def available(self, now):
+        return now >= self.cooldown_until and self.inflight < self.max_concurrency
+
+    def score(self):
+        """Ожидаемая задержка с поправкой на приоритет; новый провайдер сначала пробуется"""
+        return (self.ewma or 0.0) + self.priority * AI_PRIORITY_PENALTY
+
+    def record_latency(self, seconds, alpha=AI_EWMA_ALPHA):
+        self.ewma = seconds if self.ewma is None else alpha * seconds + (1 - alpha) * self.ewma
+
+    def record_success(self, seconds):
+        self.record_latency(seconds)
+        self.failures = 0
+        self.cooldown_until = 0.0
+
+    def record_failure(self, error, provider_fault):
+        self.stats["errors"] += 1
+        self.stats["last_error"] = f"{type(error).__name__}: {error}"
+        if isinstance(error, (asyncio.TimeoutError, openai.APITimeoutError)):
+            self.stats["timeouts"] += 1
+            # Таймаут - это задержка не меньше лимита, она тоже попадает в EWMA
+            self.record_latency(self.timeout)
+        if provider_fault:
+            self.failures += 1
+            cooldown = min(AI_PROVIDER_COOLDOWN * 2 ** (self.failures - 1), COOLDOWN_MAX)
+            self.cooldown_until = time.monotonic() + cooldown
+            logger.warning(f"AI-провайдер {self.name} исключён на {cooldown:.0f} с: {self.stats['last_error']}")
+
+    def get_stats(self):
+        return dict(
+            self.stats,
+            model=self.model,
+            priority=self.priority,
+            ewma_ms=round(self.ewma * 1000) if self.ewma is not None else None,
+            inflight=self.inflight,
+            cooldown_s=max(0, round(self.cooldown_until - time.monotonic()))
+        )
+
+class AiRouter:
+    """
+    Маршрутизация запросов к AI между провайдерами: запрос уходит провайдеру
+    с наименьшей ожидаемой задержкой (EWMA с поправкой на приоритет), при ошибке
+    или таймауте - следующему. Сбоящий провайдер исключается на растущее время,
+    небольшая доля запросов уходит к другим провайдерам, чтобы их EWMA не устаревала.
+    """
+    def __init__(self, providers, max_attempts=AI_MAX_ATTEMPTS, explore_rate=AI_EXPLORE_RATE):
+        self.providers = providers
+        self.max_attempts = max_attempts
+        self.explore_rate = explore_rate
+
+    def order(self):
+        """Провайдеры в порядке попыток"""
+        now = time.monotonic()
+        ready = sorted((p for p in self.providers if p.available(now)), key=lambda p: p.score())
+        if len(ready) > 1 and random.random() < self.explore_rate:
+            explored = random.choice(ready[1:])
+            ready.remove(explored)
+            ready.insert(0, explored)
+        # Исключённые и загруженные - в конце: лучше попробовать их, чем не ответить совсем
+        rest = sorted((p for p in self.providers if p not in ready), key=lambda p: (p.cooldown_until, p.score()))
+        return ready + rest
+
+    async def _call(self, provider, messages, max_tokens, temperature):
+        if provider.max_tokens:
+            max_tokens = min(max_tokens, provider.max_tokens)
+        provider.inflight += 1
+        provider.stats["requests"] += 1
+        try:
+            with span(f"ai {provider.name}", model=provider.model):
+                response = await asyncio.wait_for(
+                    provider.client.chat.completions.create(
+                        model=provider.model, messages=messages, max_tokens=max_tokens, temperature=temperature
+                    ),
+                    provider.timeout
+                )
+        finally:
+            provider.inflight -= 1
+        return response.choices[0].message.content
+
+    async def complete(self, messages, max_tokens, temperature):
+        """Возвращает текст ответа первого успешно ответившего провайдера"""
+        order = self.order()
+        last_error = None
+        for attempt in range(self.max_attempts):
+            provider = order[attempt % len(order)]
+            if attempt:
+                provider.stats["fallbacks"] += 1
+            start = time.monotonic()
+            try:
+                content = await self._call(provider, messages, max_tokens, temperature)
+            except Exception as e:
+                last_error = e
+                provider.record_failure(e, isinstance(e, PROVIDER_ERRORS))
+                logger.warning(
+                    f"Попытка {attempt + 1}/{self.max_attempts} запроса к AI ({provider.name}) не удалась: "
+                    f"{provider.stats['last_error']}"
+                )
+                continue
+            provider.record_success(time.monotonic() - start)
+            return content
+        raise AiUnavailableError(f"AI-провайдеры не ответили: {last_error}") from last_error
+
+    def get_stats(self):
+        return {provider.name: provider.get_stats() for provider in self.providers}
+
+def build_providers(specs=AI_PROVIDERS):
+    """
+    Провайдеры из AI_PROVIDERS; без настройки - один DeepSeek.
+    Ключ задаётся в api_key или именем переменной окружения в api_key_env
+    """
+    if not specs:
+        return [AiProvider("deepseek", DEEPSEEK_BASE_URL, DEEPSEEK_API_KEY, DEEPSEEK_MODEL)]
+    providers = []
+    for spec in specs:
+        spec = dict(spec)
+        api_key_env = spec.pop("api_key_env", None)
+        if api_key_env:
+            spec["api_key"] = os.getenv(api_key_env)
+        if not spec.get("api_key"):
+            logger.error(f"AI-провайдер {spec.get('name')} пропущен: не задан ключ API")
+            continue
+        try:
+            providers.append(AiProvider(**spec))
+        except TypeError as e:
+            logger.error(f"Некорректная настройка AI-провайдера {spec.get('name')}: {e}")
+    if not providers:
+        logger.error("Ни один AI-провайдер из AI_PROVIDERS не настроен, используется DeepSeek")
+        return build_providers([])
+    logger.info(f"AI-провайдеры: {', '.join(p.name for p in providers)}")
+    return providers
+
+# Глобальный маршрутизатор запросов к AI
+ai_router = AiRouter(build_providers())
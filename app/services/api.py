@@ -6,9 +6,22 @@ from app.config import (
     OPENWEATHER_API_KEY, 
     RAPIDAPI_KEY
 )
+from app import runtime
+from app.services.monitoring import monitoring
+from app.services.tracing import span
+from app.services.quota import (
+    quota_budgeter, QuotaExceededError,
+    PRIORITY_USER, PRIORITY_BACKGROUND
+)
 
 logger = logging.getLogger(__name__)
 
+# Максимальное число городов в одном запросе к /group OpenWeather
+WEATHER_GROUP_SIZE = 20
+
+# Ключ учёта квоты RapidAPI: показывается в /stats, поэтому не содержит частей ключа API
+RAPIDAPI_QUOTA_KEY = "rapidapi"
+
 async def retry_async(func, *args, max_retries=3, retry_delay=1, **kwargs):
     """
     Выполняет асинхронную функцию с повторными попытками при неудаче
@@ -38,40 +51,59 @@ class ApiGateway:
         self.error_count = 0
         
     async def request(self, method, url, headers=None, params=None, data=None, 
-                     cache_key=None, cache_ttl=300):
+                     cache_key=None, cache_ttl=300, quota_key=None, priority=PRIORITY_USER):
         """
-        Выполняет HTTP-запрос с поддержкой кэширования и повторных попыток
+        Выполняет HTTP-запрос с поддержкой кэширования и повторных попыток.
+        Для API с квотой (quota_key) TTL кэша растягивается по мере её расхода,
+        а низкоприоритетные запросы откладываются.
         """
         self.request_count += 1
         
         # Проверяем кэш если нужно
+        cache_ttl = quota_budgeter.scale_ttl(quota_key, cache_ttl)
         if cache_key and cache_key in self.cache:
             cache_time, cache_data = self.cache[cache_key]
             if time.time() - cache_time < cache_ttl:
-                logger.debug(f"Возврат кэшированного ответа для {cache_key}")
+                logger.debug("Возврат кэшированного ответа для %s", cache_key)
                 return cache_data
         
+        # Бережём квоту для пользовательских команд
+        if not quota_budgeter.allow(quota_key, priority):
+            if cache_key and cache_key in self.cache:
+                logger.info(f"Квота {quota_key} на исходе, возвращаем устаревший кэш для {cache_key}")
+                return self.cache[cache_key][1]
+            raise QuotaExceededError(f"Запрос {priority} к {url} отложен: квота {quota_key} на исходе")
+        
         # Выполняем запрос с повторными попытками
         try:
             async with aiohttp.ClientSession() as session:
                 for attempt in range(3):
                     try:
-                        async with session.request(
-                            method=method, 
-                            url=url, 
-                            headers=headers, 
-                            params=params, 
-                            json=data,
-                            timeout=10
-                        ) as response:
-                            response.raise_for_status()
-                            result = await response.json()
+                        with span(f"http {method} {url.split('/')[2]}", attempt=attempt + 1):
+                            async with session.request(
+                                method=method, 
+                                url=url, 
+                                headers=headers, 
+                                params=params, 
+                                json=data,
+                                timeout=10
+                            ) as response:
+                                if quota_key:
+                                    quota_budgeter.update(quota_key, response.headers)
+                                    if response.status == 429:
+                                        retry_after = response.headers.get("Retry-After")
+                                        quota_budgeter.mark_exhausted(
+                                            quota_key, int(retry_after) if retry_after and retry_after.isdigit() else None
+                                        )
+                                        raise QuotaExceededError(f"Квота {quota_key} исчерпана")
+                                response.raise_for_status()
+                                result = await response.json(loads=runtime.json_loads)
                             
-                            # Сохраняем в кэш если нужно
-                            if cache_key:
-                                self.cache[cache_key] = (time.time(), result)
+                                # Сохраняем в кэш если нужно
+                                if cache_key:
+                                    self.cache[cache_key] = (time.time(), result)
                             
-                            return result
+                                return result
                     except (aiohttp.ClientError, asyncio.TimeoutError) as e:
                         if attempt == 2:  # последняя попытка
                             raise
@@ -85,6 +117,7 @@ class ApiGateway:
 
 # Глобальный экземпляр API шлюза
 api_gateway = ApiGateway()
+monitoring.register_size_probe("ApiGateway.cache", lambda: api_gateway.cache)
 
 class ApiClient:
     @staticmethod
@@ -114,7 +147,65 @@ class ApiClient:
             return "Нет данных"
 
     @staticmethod
-    async def get_currency_rates():
+    async def get_city_id(city):
+        """Возвращает идентификатор города OpenWeather по строке запроса вида 'Minsk,BY'"""
+        url = "http://api.openweathermap.org/data/2.5/weather"
+        params = {"q": city, "appid": OPENWEATHER_API_KEY}
+        cache_key = f"city_id_{city}"
+
+        try:
+            data = await api_gateway.request(
+                method="GET",
+                url=url,
+                params=params,
+                cache_key=cache_key,
+                cache_ttl=7 * 86400  # Идентификаторы городов не меняются
+            )
+            return data['id']
+        except Exception as e:
+            logger.error(f"Ошибка получения идентификатора города {city}: {e}")
+            return None
+
+    @staticmethod
+    async def get_weather_group(city_ids):
+        """
+        Получает погоду сразу для нескольких городов через групповой эндпоинт OpenWeather.
+        Возвращает словарь {city_id: "температура, описание"}.
+        """
+        url = "http://api.openweathermap.org/data/2.5/group"
+        ids = sorted(set(city_ids))
+
+        async def fetch_chunk(chunk):
+            id_list = ",".join(str(city_id) for city_id in chunk)
+            params = {
+                "id": id_list,
+                "appid": OPENWEATHER_API_KEY,
+                "units": "metric",
+                "lang": "ru"
+            }
+            try:
+                return await api_gateway.request(
+                    method="GET",
+                    url=url,
+                    params=params,
+                    cache_key=f"weather_group_{id_list}",
+                    cache_ttl=1800  # 30 минут
+                )
+            except Exception as e:
+                logger.error(f"Ошибка группового запроса погоды для {id_list}: {e}")
+                return None
+
+        chunks = [ids[i:i + WEATHER_GROUP_SIZE] for i in range(0, len(ids), WEATHER_GROUP_SIZE)]
+        results = await asyncio.gather(*(fetch_chunk(chunk) for chunk in chunks))
+
+        weather = {}
+        for data in results:
+            for item in (data or {}).get('list', []):
+                weather[item['id']] = f"{item['main']['temp']}°C, {item['weather'][0]['description']}"
+        return weather
+
+    @staticmethod
+    async def get_currency_rates(cache_ttl=3600):
         url = "https://cdn.jsdelivr.net/npm/@fawazahmed0/currency-api@latest/v1/currencies/usd.json"
         cache_key = "currency_rates"
         
@@ -123,7 +214,7 @@ class ApiClient:
                 method="GET", 
                 url=url,
                 cache_key=cache_key,
-                cache_ttl=3600  # 1 час
+                cache_ttl=cache_ttl  # По умолчанию 1 час
             )
             usd_byn = data['usd'].get('byn', 0)
             usd_rub = data['usd'].get('rub', 0)
@@ -133,7 +224,7 @@ class ApiClient:
             return 0, 0
 
     @staticmethod
-    async def get_crypto_prices():
+    async def get_crypto_prices(cache_ttl=3600):
         url = "https://api.coingecko.com/api/v3/simple/price?ids=bitcoin,worldcoin&vs_currencies=usd"
         cache_key = "crypto_prices"
         
@@ -142,7 +233,7 @@ class ApiClient:
                 method="GET", 
                 url=url,
                 cache_key=cache_key,
-                cache_ttl=3600  # 1 час
+                cache_ttl=cache_ttl  # По умолчанию 1 час
             )
             btc_price = data.get('bitcoin', {}).get('usd', 0)
             wld_price = data.get('worldcoin', {}).get('usd', 0)
@@ -152,7 +243,7 @@ class ApiClient:
             return 0, 0
 
     @staticmethod
-    async def get_team_matches(team_id):
+    async def get_team_matches(team_id, priority=PRIORITY_USER):
         url = f"https://api-football-v1.p.rapidapi.com/v3/fixtures"
         headers = {"X-RapidAPI-Key": RAPIDAPI_KEY, "X-RapidAPI-Host": "api-football-v1.p.rapidapi.com"}
         params = {"team": team_id, "last": "5"}
@@ -165,14 +256,16 @@ class ApiClient:
                 headers=headers,
                 params=params,
                 cache_key=cache_key,
-                cache_ttl=7200  # 2 часа
+                cache_ttl=7200,  # 2 часа
+                quota_key=RAPIDAPI_QUOTA_KEY,
+                priority=priority
             )
         except Exception as e:
             logger.error(f"Ошибка API-Football для команды {team_id}: {e}")
             return None
 
     @staticmethod
-    async def get_match_events(fixture_id):
+    async def get_match_events(fixture_id, priority=PRIORITY_USER):
         url = f"https://api-football-v1.p.rapidapi.com/v3/fixtures/events"
         headers = {"X-RapidAPI-Key": RAPIDAPI_KEY, "X-RapidAPI-Host": "api-football-v1.p.rapidapi.com"}
         params = {"fixture": fixture_id}
@@ -185,10 +278,65 @@ class ApiClient:
                 headers=headers,
                 params=params,
                 cache_key=cache_key,
-                cache_ttl=3600  # 1 час
+                cache_ttl=3600,  # 1 час
+                quota_key=RAPIDAPI_QUOTA_KEY,
+                priority=priority
             )
-            logger.info(f"События для матча {fixture_id}: получено")
+            logger.info("События для матча %s: получено", fixture_id, extra={"fixture_id": fixture_id})
             return data
+        except QuotaExceededError as e:
+            logger.info(f"События матча {fixture_id} не запрошены: {e}")
+            return {"response": [], "quota_deferred": True}
         except Exception as e:
             logger.error(f"Ошибка API-Football для событий матча {fixture_id}: {e}")
-            return None
\ No newline at end of file
+            return None
+
+    @staticmethod
+    async def get_next_fixtures(team_id, count=2, priority=PRIORITY_BACKGROUND):
+        """Ближайшие матчи команды"""
+        url = "https://api-football-v1.p.rapidapi.com/v3/fixtures"
+        headers = {"X-RapidAPI-Key": RAPIDAPI_KEY, "X-RapidAPI-Host": "api-football-v1.p.rapidapi.com"}
+        params = {"team": team_id, "next": str(count)}
+        cache_key = f"next_fixtures_{team_id}_{count}"
+
+        try:
+            return await api_gateway.request(
+                method="GET",
+                url=url,
+                headers=headers,
+                params=params,
+                cache_key=cache_key,
+                cache_ttl=6 * 3600,  # 6 часов
+                quota_key=RAPIDAPI_QUOTA_KEY,
+                priority=priority
+            )
+        except Exception as e:
+            logger.error(f"Ошибка API-Football для расписания команды {team_id}: {e}")
+            return None
+
+    @staticmethod
+    async def get_fixtures_by_ids(fixture_ids, cache_ttl=30, priority=PRIORITY_BACKGROUND):
+        """
+        Состояние нескольких матчей (вместе с событиями) одним запросом.
+        API-Football принимает до 20 идентификаторов за раз.
+        """
+        url = "https://api-football-v1.p.rapidapi.com/v3/fixtures"
+        headers = {"X-RapidAPI-Key": RAPIDAPI_KEY, "X-RapidAPI-Host": "api-football-v1.p.rapidapi.com"}
+        ids = "-".join(str(fixture_id) for fixture_id in sorted(fixture_ids))
+        params = {"ids": ids}
+        cache_key = f"fixtures_{ids}"
+
+        try:
+            return await api_gateway.request(
+                method="GET",
+                url=url,
+                headers=headers,
+                params=params,
+                cache_key=cache_key,
+                cache_ttl=cache_ttl,
+                quota_key=RAPIDAPI_QUOTA_KEY,
+                priority=priority
+            )
+        except Exception as e:
+            logger.error(f"Ошибка API-Football для матчей {ids}: {e}")
+            return None
@@ -0,0 +1,156 @@
+import asyncio
+import logging
+from collections import namedtuple
+import asyncpg
+from app.config import CHAT_HISTORY_LIMIT, TARGET_REACTION, TARGET_USER_ID
+from app.database.models import ChatConfigs
+
+logger = logging.getLogger(__name__)
+
+# Канал LISTEN/NOTIFY, в который триггер chat_config отправляет chat_id изменённой строки
+CHAT_CONFIG_CHANNEL = "chat_config"
+
+# Пауза перед переподключением слушателя (секунды, удваивается до максимума)
+RECONNECT_DELAY = 1
+RECONNECT_DELAY_MAX = 60
+
+# Неизменяемые настройки чата
+ChatConfig = namedtuple("ChatConfig", [
+    "chat_id", "history_enabled", "ai_enabled", "reaction_user_ids",
+    "reaction_emoji", "history_limit", "ai_rate_limit",
+])
+
+def default_config(chat_id):
+    """
+    Настройки чата, которого нет в chat_config: AI включён, история выключена,
+    реакция на TARGET_USER_ID ставится, как и до появления настроек чатов
+    """
+    return ChatConfig(chat_id, False, True, frozenset({TARGET_USER_ID}), TARGET_REACTION, CHAT_HISTORY_LIMIT, 0)
+
+def config_from_row(row):
+    return ChatConfig(
+        chat_id=row['chat_id'],
+        history_enabled=row['history_enabled'],
+        ai_enabled=row['ai_enabled'],
+        reaction_user_ids=frozenset(row['reaction_user_ids'] or ()),
+        reaction_emoji=row['reaction_emoji'] or TARGET_REACTION,
+        history_limit=row['history_limit'] or CHAT_HISTORY_LIMIT,
+        ai_rate_limit=row['ai_rate_limit'] or 0
+    )
+
+class ChatConfigRegistry:
+    """
+    Настройки чатов в памяти процесса: обработчики читают их без запросов к БД.
+    Изменения в chat_config приходят через LISTEN/NOTIFY на отдельном соединении;
+    после переподключения настройки перечитываются целиком, чтобы не потерять
+    уведомления, отправленные, пока соединения не было.
+    """
+    def __init__(self):
+        self.configs = {}  # chat_id -> ChatConfig
+        self.pool = None
+        self.database_url = None
+        self.task = None
+        self.reloads = {}  # chat_id -> задача перечитывания настроек
+        self.pending = set()  # Чаты, изменённые во время перечитывания
+        self.stats = {"full_reloads": 0, "notifications": 0, "reconnects": 0}
+
+    def get(self, chat_id):
+        """Настройки чата (O(1), без await)"""
+        config = self.configs.get(chat_id)
+        return config if config is not None else default_config(chat_id)
+
+    async def load(self, pool):
+        """Перечитывает настройки всех чатов"""
+        rows = await ChatConfigs.get_all(pool)
+        self.configs = {row['chat_id']: config_from_row(row) for row in rows}
+        self.stats["full_reloads"] += 1
+        logger.info(f"Загружены настройки {len(self.configs)} чатов")
+
+    async def reload_chat(self, chat_id):
+        """Перечитывает настройки одного чата после уведомления"""
+        try:
+            row = await ChatConfigs.get(self.pool, chat_id)
+        except Exception as e:
+            logger.error(f"Не удалось перечитать настройки чата {chat_id}: {e}")
+            return
+        if row is None:
+            self.configs.pop(chat_id, None)
+        else:
+            self.configs[chat_id] = config_from_row(row)
+        logger.info(f"Настройки чата {chat_id} обновлены")
+
+    def _on_notify(self, connection, pid, channel, payload):
+        self.stats["notifications"] += 1
+        try:
+            chat_id = int(payload)
+        except ValueError:
+            logger.warning(f"Некорректное уведомление {channel}: {payload!r}")
+            return
+        # Перечитывания одного чата не выполняются параллельно: иначе более старое
+        # чтение может завершиться последним и оставить устаревшие настройки.
+        # Уведомления во время перечитывания схлопываются в одно повторное чтение
+        if chat_id in self.reloads:
+            self.pending.add(chat_id)
+            return
+        self.reloads[chat_id] = asyncio.get_running_loop().create_task(self._reload_loop(chat_id))
+
+    async def _reload_loop(self, chat_id):
+        try:
+            while True:
+                self.pending.discard(chat_id)
+                await self.reload_chat(chat_id)
+                if chat_id not in self.pending:
+                    return
+        finally:
+            self.reloads.pop(chat_id, None)
+
+    async def _listen(self):
+        delay = RECONNECT_DELAY
+        first = True
+        while True:
+            conn = None
+            try:
+                conn = await asyncpg.connect(self.database_url)
+                lost = asyncio.Event()
+                conn.add_termination_listener(lambda _: lost.set())
+                await conn.add_listener(CHAT_CONFIG_CHANNEL, self._on_notify)
+                # Изменения, сделанные до подписки (или пока соединения не было),
+                # компенсируются полной перезагрузкой
+                await self.load(self.pool)
+                if not first:
+                    self.stats["reconnects"] += 1
+                first = False
+                delay = RECONNECT_DELAY
+                await lost.wait()
+                logger.warning("Соединение LISTEN chat_config потеряно, переподключаемся")
+            except Exception as e:
+                logger.error(f"Ошибка слушателя настроек чатов: {e}")
+            finally:
+                if conn and not conn.is_closed():
+                    conn.terminate()
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, RECONNECT_DELAY_MAX)
+
+    async def start(self, pool, database_url):
+        """Загружает настройки и подписывается на изменения"""
+        self.pool = pool
+        self.database_url = database_url
+        await self.load(pool)
+        if not self.task or self.task.done():
+            self.task = asyncio.create_task(self._listen())
+
+    async def stop(self):
+        if self.task and not self.task.done():
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+        for task in list(self.reloads.values()):
+            task.cancel()
+
+    def get_stats(self):
+        return dict(self.stats, chats=len(self.configs))
+
+# Глобальный реестр настроек чатов
+chat_registry = ChatConfigRegistry()
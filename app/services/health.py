@@ -0,0 +1,224 @@
+import time
+import random
+import asyncio
+import logging
+from collections import namedtuple
+import aiohttp
+from aiohttp import web
+from app import runtime
+from app.config import (
+    HEALTH_PROBE_INTERVAL, HEALTH_UPSTREAM_INTERVAL, HEALTH_PROBE_TIMEOUT,
+    OPENWEATHER_API_KEY, RAPIDAPI_KEY
+)
+from app.services.monitoring import monitoring
+
+logger = logging.getLogger(__name__)
+
+# Как часто проверять, не пора ли запустить пробы (секунды)
+HEALTH_TICK = 1
+# Результат старше STALE_INTERVALS интервалов пробы считается устаревшим
+STALE_INTERVALS = 3
+
+# Результат последней проверки зависимости
+ProbeResult = namedtuple("ProbeResult", ["ok", "latency_ms", "checked_at", "error", "failures"])
+
+class HealthMonitor:
+    """
+    Фоновые проверки зависимостей (PostgreSQL, Telegram, AI-провайдеры, HTTP API)
+    с таймаутами. Результаты кэшируются: /test, /healthz и /readyz
+    отвечают мгновенно и не обращаются к внешним сервисам.
+    Готовность (readiness) - бот запущен, не останавливается и все
+    критичные зависимости отвечают.
+    """
+    def __init__(self, tick=HEALTH_TICK):
+        self.tick = tick
+        self.probes = {}  # Имя -> параметры пробы
+        self.results = {}  # Имя -> ProbeResult
+        self.ready = False
+        self.heartbeat = None
+        self.task = None
+        self.running = {}  # Имя -> задача выполняющейся пробы
+        self.runner = None
+
+    def add(self, name, check, critical=False, interval=HEALTH_PROBE_INTERVAL, timeout=HEALTH_PROBE_TIMEOUT):
+        """
+        Регистрирует пробу. check - корутинная функция без аргументов,
+        исключение или таймаут означают недоступность зависимости.
+        critical - влияет на готовность бота
+        """
+        self.probes[name] = {
+            "check": check, "critical": critical, "interval": interval,
+            "timeout": timeout, "due": 0.0
+        }
+
+    async def run_probe(self, name):
+        """Выполняет одну пробу и сохраняет результат"""
+        probe = self.probes[name]
+        previous = self.results.get(name)
+        start = time.monotonic()
+        error = None
+        try:
+            await asyncio.wait_for(probe["check"](), probe["timeout"])
+        except asyncio.TimeoutError:
+            error = f"таймаут {probe['timeout']} с"
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+        latency_ms = round((time.monotonic() - start) * 1000, 1)
+        failures = 0 if error is None else (previous.failures if previous else 0) + 1
+        result = ProbeResult(error is None, latency_ms, time.time(), error, failures)
+        self.results[name] = result
+
+        # Логируем и сообщаем администратору только смену состояния
+        if previous is None or previous.ok != result.ok:
+            if result.ok:
+                logger.info(f"Проверка {name}: ОК ({latency_ms} мс)")
+                if previous is not None and probe["critical"]:
+                    await monitoring.notify_admin(f"✅ {name} снова доступен")
+            else:
+                logger.error(f"Проверка {name} не пройдена: {error}")
+                if probe["critical"]:
+                    await monitoring.notify_admin(f"❌ {name} недоступен: {error}")
+        return result
+
+    async def run_all(self):
+        """Выполняет все пробы сразу (при старте)"""
+        await asyncio.gather(*(self.run_probe(name) for name in self.probes))
+
+    def _spawn(self, name):
+        async def run():
+            try:
+                await self.run_probe(name)
+            except Exception as e:
+                logger.error(f"Ошибка пробы {name}: {e}")
+            finally:
+                self.running.pop(name, None)
+
+        self.running[name] = asyncio.create_task(run(), name=f"health:{name}")
+
+    async def _run(self):
+        while True:
+            now = time.monotonic()
+            self.heartbeat = now
+            for name, probe in self.probes.items():
+                # Медленная проба не задерживает остальные и не запускается повторно
+                if name in self.running or now < probe["due"]:
+                    continue
+                probe["due"] = now + probe["interval"] * random.uniform(0.9, 1.1)
+                self._spawn(name)
+            await asyncio.sleep(self.tick)
+
+    def start(self):
+        if not self.task or self.task.done():
+            self.heartbeat = time.monotonic()
+            self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        self.ready = False
+        if self.task and not self.task.done():
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+        for task in list(self.running.values()):
+            task.cancel()
+        await self.stop_http()
+
+    def is_stale(self, name, result):
+        return time.time() - result.checked_at > self.probes[name]["interval"] * STALE_INTERVALS
+
+    def is_live(self):
+        """Цикл событий и фоновые проверки работают"""
+        return (self.task is not None and not self.task.done()
+                and time.monotonic() - self.heartbeat < self.tick * 10 + 5)
+
+    def is_ready(self):
+        """Бот готов обрабатывать обновления"""
+        if not self.ready or not self.is_live():
+            return False
+        for name, probe in self.probes.items():
+            if not probe["critical"]:
+                continue
+            result = self.results.get(name)
+            if result is None or not result.ok or self.is_stale(name, result):
+                return False
+        return True
+
+    def snapshot(self):
+        """Кэшированные результаты проб"""
+        now = time.time()
+        return {
+            name: {
+                "ok": result.ok,
+                "critical": self.probes[name]["critical"],
+                "latency_ms": result.latency_ms,
+                "age_s": int(now - result.checked_at),
+                "stale": self.is_stale(name, result),
+                "error": result.error,
+                "failures": result.failures
+            }
+            for name, result in self.results.items()
+        }
+
+    async def handle_live(self, request):
+        live = self.is_live()
+        return web.json_response({"live": live}, status=200 if live else 503, dumps=runtime.json_dumps)
+
+    async def handle_ready(self, request):
+        ready = self.is_ready()
+        return web.json_response(
+            {"ready": ready, "probes": self.snapshot()}, status=200 if ready else 503, dumps=runtime.json_dumps
+        )
+
+    async def start_http(self, host, port):
+        """Запускает HTTP-эндпоинты /healthz (liveness) и /readyz (readiness)"""
+        app = web.Application()
+        app.router.add_get("/healthz", self.handle_live)
+        app.router.add_get("/readyz", self.handle_ready)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, host, port).start()
+        logger.info(f"Эндпоинты проверки состояния: http://{host}:{port}/healthz, /readyz")
+
+    async def stop_http(self):
+        if self.runner:
+            await self.runner.cleanup()
+            self.runner = None
+
+async def probe_postgres(pool):
+    """Соединение из пула и SELECT 1"""
+    async with pool.acquire(name="health.postgres", timeout=HEALTH_PROBE_TIMEOUT) as conn:
+        if await conn.fetchval("SELECT 1") != 1:
+            raise RuntimeError("SELECT 1 вернул неожиданный результат")
+
+async def probe_ai_provider(provider):
+    """Список моделей: проверяет доступность и ключ API провайдера без расхода токенов"""
+    await provider.client.models.list()
+
+async def probe_http(url, params=None, headers=None):
+    """Один запрос без повторов и кэша: недоступность видна сразу"""
+    timeout = aiohttp.ClientTimeout(total=HEALTH_PROBE_TIMEOUT)
+    async with aiohttp.ClientSession(timeout=timeout) as session:
+        async with session.get(url, params=params, headers=headers) as response:
+            response.raise_for_status()
+
+def register_upstream_probes(monitor, interval=HEALTH_UPSTREAM_INTERVAL):
+    """
+    Пробы внешних HTTP API. Используются самые дешёвые эндпоинты:
+    /status API-Football и /ping CoinGecko не расходуют квоту
+    """
+    monitor.add("openweather", lambda: probe_http(
+        "http://api.openweathermap.org/data/2.5/weather",
+        params={"q": "Minsk,BY", "appid": OPENWEATHER_API_KEY}
+    ), interval=interval)
+    monitor.add("currency_api", lambda: probe_http(
+        "https://cdn.jsdelivr.net/npm/@fawazahmed0/currency-api@latest/v1/currencies/usd.min.json"
+    ), interval=interval)
+    monitor.add("coingecko", lambda: probe_http("https://api.coingecko.com/api/v3/ping"), interval=interval)
+    monitor.add("api_football", lambda: probe_http(
+        "https://api-football-v1.p.rapidapi.com/v3/status",
+        headers={"X-RapidAPI-Key": RAPIDAPI_KEY, "X-RapidAPI-Host": "api-football-v1.p.rapidapi.com"}
+    ), interval=interval)
+
+# Глобальный экземпляр проверок состояния
+health_monitor = HealthMonitor()
@@ -0,0 +1,182 @@
+import os
+import time
+import random
+import inspect
+import socket
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+from app.config import MAINTENANCE_JITTER, MAINTENANCE_MAX_DEFER
+from app.database.models import JobStore
+from app.database.pool import db_telemetry
+from app.services.monitoring import monitoring
+
+logger = logging.getLogger(__name__)
+
+# Как часто проверять, освободился ли пул БД, перед тяжёлой задачей (секунды)
+QUIET_CHECK_INTERVAL = 5
+
+class JobRunner:
+    """
+    Обёртка над APScheduler для плановых задач бота.
+    - Задача не запускается повторно, пока не закончился предыдущий запуск
+      (в процессе) и пока её выполняет другой экземпляр бота (аренда в scheduled_jobs).
+    - Пропущенные запуски объединяются (coalesce); запуск, опоздавший дольше
+      misfire_grace_time, пропускается. Для задач с catch_up запуск, пропущенный
+      пока бот не работал, выполняется один раз после старта.
+    - Тяжёлые задачи сдвигаются на случайное время и ждут, пока пул БД не будет занят
+      живыми запросами.
+    - Длительность и итог каждого запуска сохраняются в job_runs и показываются в /stats.
+    """
+    def __init__(self, scheduler, db_pool, owner=None):
+        self.scheduler = scheduler
+        self.db_pool = db_pool
+        self.owner = owner or f"{socket.gethostname()}:{os.getpid()}"
+        self.jobs = {}  # Имя -> параметры задачи
+        self.running = {}  # Имя -> задача asyncio текущего запуска
+        self.executing = set()  # Задачи, которые уже выполняют func (а не ждут сдвига или аренды)
+        self.stats = {}  # Имя -> статистика запусков
+
+    def add(self, name, func, trigger, args=(), heavy=False, shared=True, persist=True,
+            catch_up=False, lease=600, misfire_grace_time=60):
+        """
+        Регистрирует задачу (func - корутинная или обычная функция).
+        heavy - сдвиг на случайное время до MAINTENANCE_JITTER и ожидание разгрузки БД,
+        shared - одновременно выполняется только одним экземпляром бота,
+        persist - сохранять каждый запуск в БД (для частых лёгких задач можно отключить),
+        catch_up - выполнить один раз после старта, если плановый запуск был пропущен,
+        lease - на сколько секунд задача занимается (должно превышать её длительность)
+        """
+        self.jobs[name] = {
+            "func": func, "args": args, "trigger": trigger, "heavy": heavy, "shared": shared,
+            "persist": persist, "catch_up": catch_up, "lease": lease
+        }
+        self.stats[name] = {
+            "runs": 0, "failures": 0, "skipped": 0, "last_status": None,
+            "last_duration_s": None, "last_started": None, "last_error": None
+        }
+        self.scheduler.add_job(
+            self.run, trigger=trigger, args=[name], id=name, name=name,
+            max_instances=1, coalesce=True, misfire_grace_time=misfire_grace_time,
+            replace_existing=True
+        )
+
+    async def _acquire(self, name, job):
+        if not job["shared"]:
+            return True
+        try:
+            return await JobStore.acquire_lease(self.db_pool, name, self.owner, job["lease"])
+        except Exception as e:
+            # Без БД аренду не проверить; задача выполняется, как в одиночном режиме
+            logger.warning(f"Не удалось занять задачу {name}: {e}")
+            return True
+
+    async def _wait_for_quiet(self, name):
+        """Ждёт, пока живые запросы не перестанут ждать соединений из пула (не дольше MAINTENANCE_MAX_DEFER)"""
+        deadline = time.monotonic() + MAINTENANCE_MAX_DEFER
+        while db_telemetry.waiting and time.monotonic() < deadline:
+            await asyncio.sleep(QUIET_CHECK_INTERVAL)
+        if db_telemetry.waiting:
+            logger.warning(f"Задача {name} запускается, хотя пул БД по-прежнему занят")
+
+    async def run(self, name, reason="schedule"):
+        """Выполняет задачу с защитой от наложения запусков и учётом результата"""
+        job = self.jobs[name]
+        stats = self.stats[name]
+        if name in self.running:
+            stats["skipped"] += 1
+            logger.warning(f"Задача {name} ещё выполняется, запуск пропущен")
+            return
+        self.running[name] = asyncio.current_task()
+        try:
+            if job["heavy"] and reason == "schedule" and MAINTENANCE_JITTER:
+                await asyncio.sleep(random.uniform(0, MAINTENANCE_JITTER))
+            if not await self._acquire(name, job):
+                stats["skipped"] += 1
+                logger.info(f"Задачу {name} выполняет другой экземпляр бота")
+                return
+            if job["heavy"]:
+                await self._wait_for_quiet(name)
+
+            started_at = datetime.now(timezone.utc)
+            start = time.monotonic()
+            status, error = "ok", None
+            self.executing.add(name)
+            try:
+                if inspect.iscoroutinefunction(job["func"]):
+                    await job["func"](*job["args"])
+                else:
+                    # Синхронные задачи, как и в APScheduler, выполняются в пуле потоков
+                    await asyncio.to_thread(job["func"], *job["args"])
+            except Exception as e:
+                status, error = "error", f"{type(e).__name__}: {e}"
+                monitoring.log_error(e, {"job": name, "reason": reason})
+            finally:
+                self.executing.discard(name)
+            duration = time.monotonic() - start
+
+            stats["runs"] += 1
+            stats["failures"] += status != "ok"
+            stats.update(last_status=status, last_duration_s=round(duration, 2),
+                         last_started=started_at.timestamp(), last_error=error)
+            logger.info(
+                "Задача %s: %s за %.2f с", name, status, duration,
+                extra={"job": name, "status": status, "duration_s": round(duration, 3), "reason": reason}
+            )
+            if job["persist"]:
+                try:
+                    await JobStore.finish(
+                        self.db_pool, name, self.owner, reason, started_at, duration, status, error
+                    )
+                except Exception as e:
+                    logger.warning(f"Не удалось сохранить результат задачи {name}: {e}")
+        finally:
+            self.running.pop(name, None)
+
+    async def catch_up(self):
+        """Запускает задачи с catch_up, плановый запуск которых пришёлся на время простоя"""
+        try:
+            last_success = await JobStore.get_states(self.db_pool)
+        except Exception as e:
+            logger.error(f"Не удалось получить состояние плановых задач: {e}")
+            return
+        now = datetime.now(timezone.utc)
+        for name, job in self.jobs.items():
+            last = last_success.get(name)
+            if not job["catch_up"] or last is None:
+                continue
+            missed = job["trigger"].get_next_fire_time(None, last + timedelta(seconds=1))
+            if missed and missed < now:
+                delay = random.uniform(0, MAINTENANCE_JITTER) if job["heavy"] else 0
+                logger.info(f"Задача {name} пропущена во время простоя ({missed}), запуск через {delay:.0f} с")
+                self.scheduler.add_job(
+                    self.run, trigger="date", run_date=now + timedelta(seconds=delay),
+                    args=[name, "catch_up"], id=f"{name}:catch_up", replace_existing=True
+                )
+
+    async def drain(self, timeout=None):
+        """
+        Ожидает задачи, которые уже выполняются, и отменяет те, что ещё ждут
+        случайного сдвига или разгрузки БД (при остановке бота)
+        """
+        for name, task in list(self.running.items()):
+            if name not in self.executing:
+                task.cancel()
+        running = dict(self.running)
+        if not running:
+            return
+        await asyncio.wait(running.values(), timeout=timeout)
+        for name, task in running.items():
+            if not task.done():
+                logger.warning(f"Задача {name} не завершилась за время остановки, отменяем")
+                task.cancel()
+
+    def get_stats(self):
+        """Статистика запусков и время следующего запуска каждой задачи"""
+        result = {}
+        for name, stats in self.stats.items():
+            job = self.scheduler.get_job(name)
+            next_run = job.next_run_time if job else None
+            result[name] = dict(stats, running=name in self.running,
+                                next_run=next_run.timestamp() if next_run else None)
+        return result
@@ -0,0 +1,152 @@
+import time
+import asyncio
+import logging
+import asyncpg
+from aiogram import BaseMiddleware
+from app.config import POLLING_LEASE_KEY
+
+logger = logging.getLogger(__name__)
+
+# Как часто проверять, отпустил ли предыдущий экземпляр право на polling (секунды)
+LEASE_RETRY_INTERVAL = 1
+# Как часто напоминать в логе, что экземпляр всё ещё ждёт (секунды)
+LEASE_WAIT_LOG_INTERVAL = 30
+
+class UpdateTracker(BaseMiddleware):
+    """
+    Внешний middleware для dp.update: считает обновления, которые сейчас
+    обрабатываются, и запоминает последний полученный update_id
+    """
+    def __init__(self):
+        self.inflight = 0
+        self.last_update_id = None
+        self.idle = asyncio.Event()
+        self.idle.set()
+
+    async def __call__(self, handler, event, data):
+        self.inflight += 1
+        self.idle.clear()
+        if self.last_update_id is None or event.update_id > self.last_update_id:
+            self.last_update_id = event.update_id
+        try:
+            return await handler(event, data)
+        finally:
+            self.inflight -= 1
+            if not self.inflight:
+                self.idle.set()
+
+    async def wait_idle(self, timeout):
+        """Ждёт завершения начатых обработчиков. Возвращает False, если время вышло"""
+        try:
+            await asyncio.wait_for(self.idle.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    async def confirm(self, bot, allowed_updates=None):
+        """
+        Подтверждает Telegram получение обновлений до last_update_id включительно.
+        Без этого следующий экземпляр бота получит их повторно. Обновление,
+        которое вернёт этот вызов, не подтверждается и достанется следующему экземпляру.
+        """
+        if self.last_update_id is None:
+            return
+        try:
+            await bot.get_updates(
+                offset=self.last_update_id + 1, limit=1, timeout=0, allowed_updates=allowed_updates
+            )
+        except Exception as e:
+            logger.error(f"Не удалось подтвердить полученные обновления: {e}")
+
+class PollingLease:
+    """
+    Право получать обновления Telegram: advisory-блокировка PostgreSQL
+    на отдельном соединении (не из пула). Новый экземпляр готовится
+    (пул, миграции, настройки) и ждёт блокировку, старый отпускает её
+    сразу после остановки polling, до ожидания своих обработчиков,
+    поэтому два экземпляра никогда не опрашивают Telegram одновременно.
+    """
+    def __init__(self, database_url, key=POLLING_LEASE_KEY, on_lost=None):
+        self.database_url = database_url
+        self.key = key
+        self.on_lost = on_lost  # Корутина, вызываемая, если блокировку перехватил другой экземпляр
+        self.conn = None
+        self.recover_task = None
+
+    async def _connect_and_lock(self, wait):
+        conn = await asyncpg.connect(self.database_url)
+        try:
+            started = time.monotonic()
+            logged = None
+            while not await conn.fetchval("SELECT pg_try_advisory_lock($1)", self.key):
+                if not wait:
+                    await conn.close()
+                    return None
+                if logged is None or time.monotonic() - logged >= LEASE_WAIT_LOG_INTERVAL:
+                    logger.info("Ожидаем, пока предыдущий экземпляр бота остановит polling")
+                    logged = time.monotonic()
+                await asyncio.sleep(LEASE_RETRY_INTERVAL)
+            if logged is not None:
+                logger.info(f"Polling передан этому экземпляру через {time.monotonic() - started:.1f} с")
+            return conn
+        except BaseException:
+            conn.terminate()
+            raise
+
+    async def acquire(self):
+        """Ждёт, пока предыдущий экземпляр отпустит блокировку"""
+        delay = LEASE_RETRY_INTERVAL
+        while True:
+            try:
+                self.conn = await self._connect_and_lock(wait=True)
+                break
+            except (OSError, asyncpg.PostgresError) as e:
+                logger.error(f"Не удалось занять право на polling: {e}")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, LEASE_WAIT_LOG_INTERVAL)
+        self.conn.add_termination_listener(self._on_terminated)
+
+    def _on_terminated(self, conn):
+        # Соединение потеряно - блокировка снята сервером
+        logger.warning("Соединение с блокировкой polling потеряно")
+        self.conn = None
+        self.recover_task = asyncio.get_running_loop().create_task(self._recover())
+
+    async def _recover(self):
+        """Возвращает блокировку после обрыва или останавливает polling, если её занял другой экземпляр"""
+        delay = LEASE_RETRY_INTERVAL
+        while True:
+            try:
+                conn = await self._connect_and_lock(wait=False)
+                break
+            except (OSError, asyncpg.PostgresError) as e:
+                logger.error(f"Не удалось восстановить блокировку polling: {e}")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, LEASE_WAIT_LOG_INTERVAL)
+        if conn is None:
+            logger.warning("Polling перешёл к другому экземпляру бота, останавливаемся")
+            if self.on_lost:
+                try:
+                    await self.on_lost()
+                except Exception as e:
+                    logger.error(f"Не удалось остановить polling: {e}")
+            return
+        self.conn = conn
+        self.conn.add_termination_listener(self._on_terminated)
+        logger.info("Блокировка polling восстановлена")
+
+    async def release(self):
+        """Отпускает блокировку: следующий экземпляр сразу начинает polling"""
+        if self.recover_task and not self.recover_task.done():
+            self.recover_task.cancel()
+        conn, self.conn = self.conn, None
+        if conn is None or conn.is_closed():
+            return
+        conn.remove_termination_listener(self._on_terminated)
+        try:
+            await asyncio.wait_for(conn.close(), 5)
+        except Exception as e:
+            # Сессия завершится на сервере, блокировка снимется вместе с ней
+            logger.warning(f"Соединение с блокировкой polling закрыто с ошибкой: {e}")
+            conn.terminate()
+        logger.info("Право на polling передано")
@@ -0,0 +1,154 @@
+import sys
+import time
+import asyncio
+import logging
+import threading
+import traceback
+from collections import deque
+from app.config import LOOP_LAG_INTERVAL, LOOP_LAG_THRESHOLD_MS, LOOP_DEBUG_WINDOW
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин гистограммы задержки цикла (мс)
+LAG_BUCKETS_MS = [1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500]
+
+# Сколько последних измерений хранить для перцентилей
+LAG_WINDOW = 4000
+
+# Сколько последних блокировок со стеком хранить
+BLOCKING_EVENTS_LIMIT = 20
+
+class LoopLagMonitor:
+    """
+    Измеряет задержку планирования цикла событий и ловит блокирующие вызовы.
+    Задержка - насколько позже запланированного просыпается asyncio.sleep.
+    Сторожевой поток снимает стек цикла, если тот не отвечает дольше порога;
+    при превышении порога на время включается отладочный режим asyncio
+    с логированием медленных колбэков.
+    """
+    def __init__(self, interval=LOOP_LAG_INTERVAL, threshold_ms=LOOP_LAG_THRESHOLD_MS,
+                 debug_window=LOOP_DEBUG_WINDOW):
+        self.interval = interval
+        self.threshold = threshold_ms / 1000
+        self.debug_window = debug_window
+        self.histogram = [0] * (len(LAG_BUCKETS_MS) + 1)
+        self.samples = deque(maxlen=LAG_WINDOW)
+        self.max_lag = 0.0
+        self.blocking_events = deque(maxlen=BLOCKING_EVENTS_LIMIT)
+        self.blocking_count = 0
+        self.heartbeat = time.monotonic()
+        self.loop = None
+        self.loop_thread_id = None
+        self.debug_until = 0
+        self.task = None
+        self.watchdog = None
+        self.stopping = threading.Event()
+
+    def record(self, lag):
+        """Добавляет измерение задержки (секунды)"""
+        lag_ms = lag * 1000
+        for i, bound in enumerate(LAG_BUCKETS_MS):
+            if lag_ms <= bound:
+                self.histogram[i] += 1
+                break
+        else:
+            self.histogram[-1] += 1
+        self.samples.append(lag)
+        self.max_lag = max(self.max_lag, lag)
+
+    def _enable_slow_callback_debug(self):
+        """Временно включает отладочный режим asyncio: он логирует колбэки дольше порога"""
+        now = time.monotonic()
+        if self.debug_until < now:
+            logger.warning(
+                "Задержка цикла событий превысила %d мс, включено логирование медленных колбэков на %d с",
+                self.threshold * 1000, self.debug_window
+            )
+            self.loop.slow_callback_duration = self.threshold
+            self.loop.set_debug(True)
+        self.debug_until = now + self.debug_window
+
+    async def _sample(self):
+        while True:
+            start = self.loop.time()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, self.loop.time() - start - self.interval)
+            self.heartbeat = time.monotonic()
+            self.record(lag)
+            if lag > self.threshold:
+                self._enable_slow_callback_debug()
+            elif self.debug_until and time.monotonic() > self.debug_until:
+                self.debug_until = 0
+                self.loop.set_debug(False)
+
+    def _watch(self):
+        """Сторожевой поток: снимает стек цикла событий, пока тот заблокирован"""
+        reported_heartbeat = None
+        while not self.stopping.wait(self.threshold / 2):
+            stalled = time.monotonic() - self.heartbeat - self.interval
+            if stalled <= self.threshold or reported_heartbeat == self.heartbeat:
+                continue
+            frame = sys._current_frames().get(self.loop_thread_id)
+            if frame is None:
+                continue
+            # Одна запись на одну блокировку
+            reported_heartbeat = self.heartbeat
+            self.blocking_count += 1
+            stack = traceback.format_stack(frame, limit=15)
+            self.blocking_events.append({
+                "time": time.time(),
+                "stalled_ms": round(stalled * 1000, 1),
+                "location": stack[-1].strip().splitlines()[0] if stack else "unknown",
+                "stack": "".join(stack)
+            })
+            logger.warning(
+                "Цикл событий заблокирован более %.0f мс:\n%s", stalled * 1000, "".join(stack)
+            )
+
+    def start(self):
+        """Запускает измерение задержки и сторожевой поток"""
+        self.loop = asyncio.get_running_loop()
+        self.loop_thread_id = threading.get_ident()
+        self.heartbeat = time.monotonic()
+        if not self.task or self.task.done():
+            self.task = asyncio.create_task(self._sample())
+        if not self.watchdog or not self.watchdog.is_alive():
+            self.stopping.clear()
+            self.watchdog = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+            self.watchdog.start()
+
+    async def stop(self):
+        """Останавливает измерения"""
+        self.stopping.set()
+        if self.task and not self.task.done():
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+        if self.loop and self.debug_until:
+            self.loop.set_debug(False)
+            self.debug_until = 0
+
+    def percentile(self, pct):
+        if not self.samples:
+            return 0.0
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(pct / 100 * len(ordered)))]
+
+    def get_stats(self):
+        """Перцентили задержки (мс), гистограмма и последние блокировки"""
+        buckets = [f"<={bound}" for bound in LAG_BUCKETS_MS] + [f">{LAG_BUCKETS_MS[-1]}"]
+        last = self.blocking_events[-1] if self.blocking_events else None
+        return {
+            "p50_ms": round(self.percentile(50) * 1000, 2),
+            "p99_ms": round(self.percentile(99) * 1000, 2),
+            "max_ms": round(self.max_lag * 1000, 2),
+            "histogram": dict(zip(buckets, self.histogram)),
+            "blocking_events": self.blocking_count,
+            "last_blocking": last and {k: last[k] for k in ("time", "stalled_ms", "location")},
+            "slow_callback_debug": bool(self.debug_until)
+        }
+
+# Глобальный экземпляр монитора цикла событий
+loop_monitor = LoopLagMonitor()
@@ -0,0 +1,113 @@
+import time
+import random
+import asyncio
+import logging
+from collections import namedtuple
+from app.services.api import ApiClient
+from app.config import MARKET_REFRESH_INTERVAL, MARKET_REFRESH_JITTER
+
+logger = logging.getLogger(__name__)
+
+# Неизменяемый снимок рыночных данных. *_updated - время последнего успешного обновления (unix time)
+MarketSnapshot = namedtuple("MarketSnapshot", [
+    "usd_byn", "usd_rub", "currency_updated",
+    "btc_usd", "wld_usd", "crypto_updated",
+])
+
+EMPTY_SNAPSHOT = MarketSnapshot(0, 0, None, 0, 0, None)
+
+class MarketDataService:
+    """
+    Фоновое обновление курсов валют и цен криптовалют.
+    Читатели получают готовый снимок без ожидания сети.
+    """
+    def __init__(self, interval=MARKET_REFRESH_INTERVAL, jitter=MARKET_REFRESH_JITTER):
+        self.interval = interval
+        self.jitter = jitter
+        self.snapshot = EMPTY_SNAPSHOT
+        self.refresh_count = 0
+        self.failure_count = 0
+        self.task = None
+
+    def get(self):
+        """Возвращает текущий снимок (O(1), без await)"""
+        return self.snapshot
+
+    def currency_rates(self):
+        """Возвращает (USD/BYN, USD/RUB) из снимка"""
+        snapshot = self.snapshot
+        return snapshot.usd_byn, snapshot.usd_rub
+
+    def crypto_prices(self):
+        """Возвращает (BTC, WLD) в USD из снимка"""
+        snapshot = self.snapshot
+        return snapshot.btc_usd, snapshot.wld_usd
+
+    def is_ready(self):
+        """Есть ли в снимке хотя бы одно успешное обновление обеих групп данных"""
+        snapshot = self.snapshot
+        return snapshot.currency_updated is not None and snapshot.crypto_updated is not None
+
+    async def refresh(self):
+        """Обновляет снимок, сохраняя последние удачные значения при ошибках"""
+        (usd_byn, usd_rub), (btc_usd, wld_usd) = await asyncio.gather(
+            ApiClient.get_currency_rates(cache_ttl=0),
+            ApiClient.get_crypto_prices(cache_ttl=0)
+        )
+        now = time.time()
+        current = self.snapshot
+        updates = {}
+
+        # ApiClient возвращает нули при ошибке - такие значения не перезаписывают старые
+        if usd_byn and usd_rub:
+            updates.update(usd_byn=usd_byn, usd_rub=usd_rub, currency_updated=now)
+        if btc_usd and wld_usd:
+            updates.update(btc_usd=btc_usd, wld_usd=wld_usd, crypto_updated=now)
+
+        self.refresh_count += 1
+        if len(updates) < 6:
+            self.failure_count += 1
+            logger.warning("Не удалось обновить часть рыночных данных, используются последние значения")
+
+        if updates:
+            # Публикуем новый снимок одной операцией присваивания
+            self.snapshot = current._replace(**updates)
+        return self.snapshot
+
+    async def _run(self):
+        while True:
+            try:
+                await self.refresh()
+            except Exception as e:
+                self.failure_count += 1
+                logger.error(f"Ошибка обновления рыночных данных: {e}")
+            # Случайный сдвиг, чтобы не попадать в пики нагрузки на внешние API
+            await asyncio.sleep(self.interval + random.uniform(-self.jitter, self.jitter))
+
+    def start(self):
+        """Запускает фоновое обновление"""
+        if not self.task or self.task.done():
+            self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Останавливает фоновое обновление"""
+        if self.task and not self.task.done():
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+
+    def get_stats(self):
+        """Возвращает возраст данных и счетчики обновлений"""
+        now = time.time()
+        snapshot = self.snapshot
+        return {
+            "currency_age_s": int(now - snapshot.currency_updated) if snapshot.currency_updated else None,
+            "crypto_age_s": int(now - snapshot.crypto_updated) if snapshot.crypto_updated else None,
+            "refresh_count": self.refresh_count,
+            "failure_count": self.failure_count
+        }
+
+# Глобальный экземпляр сервиса рыночных данных
+market_data = MarketDataService()
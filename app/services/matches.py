@@ -0,0 +1,182 @@
+import time
+import asyncio
+import logging
+from datetime import datetime
+from app.services.api import ApiClient
+from app.config import (
+    CHAT_ID, TEAM_IDS, MATCH_LIVE_POLL_INTERVAL, MATCH_IDLE_POLL_INTERVAL
+)
+
+logger = logging.getLogger(__name__)
+
+# Окно отслеживания матча относительно начала (секунды)
+WINDOW_BEFORE_KICKOFF = 10 * 60
+WINDOW_AFTER_KICKOFF = 3 * 3600
+
+# Как часто обновлять расписание матчей (секунды)
+SCHEDULE_REFRESH_INTERVAL = 6 * 3600
+
+# Максимальное число матчей в одном запросе ids=
+FIXTURES_BATCH_SIZE = 20
+
+# Статусы завершенных матчей API-Football
+FINISHED_STATUSES = {"FT", "AET", "PEN", "PST", "CANC", "ABD", "AWD", "WO"}
+
+def goal_key(event):
+    """Уникальный ключ гола для сравнения снимков событий"""
+    return (
+        event["team"]["id"],
+        (event.get("player") or {}).get("id") or (event.get("player") or {}).get("name"),
+        event["time"]["elapsed"],
+        event["time"].get("extra"),
+        event.get("detail"),
+    )
+
+def extract_goals(events):
+    """Возвращает голы из списка событий матча (без незабитых пенальти)"""
+    return [
+        e for e in events or []
+        if e.get("type") == "Goal" and e.get("detail") != "Missed Penalty"
+    ]
+
+def format_goal(fixture, event):
+    """Формирует текст уведомления о голе"""
+    home = fixture["teams"]["home"]["name"]
+    away = fixture["teams"]["away"]["name"]
+    home_goals = fixture["goals"]["home"] or 0
+    away_goals = fixture["goals"]["away"] or 0
+    minute = f"{event['time']['elapsed']}'"
+    if event["time"].get("extra"):
+        minute = f"{event['time']['elapsed']}+{event['time']['extra']}'"
+    player = (event.get("player") or {}).get("name") or "Неизвестный"
+    detail = ""
+    if event.get("detail") == "Own Goal":
+        detail = " (автогол)"
+    elif event.get("detail") == "Penalty":
+        detail = " (пенальти)"
+    return (
+        f"⚽ ГОООЛ! {home} {home_goals} - {away_goals} {away}\n"
+        f"{player}{detail}, {minute} ({event['team']['name']})"
+    )
+
+class MatchTracker:
+    """
+    Отслеживает матчи команд из TEAM_IDS и отправляет в чат только новые голы.
+    Вне матчей трекер почти не делает запросов.
+    """
+    def __init__(self, bot, chat_id=CHAT_ID, team_ids=None):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.team_ids = sorted(set((team_ids or TEAM_IDS).values()))
+        self.fixtures = {}  # fixture_id -> {"kickoff": ts, "goals": set() | None}
+        self.schedule_updated = 0
+        self.task = None
+        self.poll_count = 0
+
+    async def refresh_schedule(self, now=None):
+        """Обновляет список ближайших матчей отслеживаемых команд"""
+        now = time.time() if now is None else now
+        results = await asyncio.gather(
+            *(ApiClient.get_next_fixtures(team_id) for team_id in self.team_ids)
+        )
+        for data in results:
+            for item in (data or {}).get("response", []):
+                fixture_id = item["fixture"]["id"]
+                kickoff = item["fixture"].get("timestamp") or datetime.fromisoformat(
+                    item["fixture"]["date"]
+                ).timestamp()
+                tracked = self.fixtures.setdefault(fixture_id, {"kickoff": kickoff, "goals": None})
+                # Матч могли перенести
+                tracked["kickoff"] = kickoff
+        self.schedule_updated = now
+
+    def _in_window(self, fixture, now):
+        return fixture["kickoff"] - WINDOW_BEFORE_KICKOFF <= now <= fixture["kickoff"] + WINDOW_AFTER_KICKOFF
+
+    async def _notify(self, text):
+        try:
+            await self.bot.send_message(chat_id=self.chat_id, text=text)
+        except Exception as e:
+            logger.error(f"Ошибка отправки уведомления о голе: {e}")
+
+    async def process_fixture(self, item):
+        """Сравнивает события матча с предыдущим снимком и уведомляет о новых голах"""
+        fixture_id = item["fixture"]["id"]
+        tracked = self.fixtures.get(fixture_id)
+        if tracked is None:
+            return
+
+        goals = extract_goals(item.get("events"))
+        keys = {goal_key(event) for event in goals}
+        if tracked["goals"] is None:
+            # Первый снимок матча - запоминаем без уведомлений
+            tracked["goals"] = keys
+        else:
+            for event in goals:
+                key = goal_key(event)
+                if key not in tracked["goals"]:
+                    tracked["goals"].add(key)
+                    await self._notify(format_goal(item, event))
+
+        status = item["fixture"].get("status", {}).get("short")
+        if status in FINISHED_STATUSES:
+            logger.info(f"Матч {fixture_id} завершен ({status}), отслеживание прекращено")
+            del self.fixtures[fixture_id]
+
+    async def poll(self, fixture_ids):
+        """Запрашивает состояние активных матчей пачками"""
+        ids = sorted(fixture_ids)
+        batches = [ids[i:i + FIXTURES_BATCH_SIZE] for i in range(0, len(ids), FIXTURES_BATCH_SIZE)]
+        results = await asyncio.gather(
+            *(ApiClient.get_fixtures_by_ids(batch) for batch in batches)
+        )
+        self.poll_count += len(batches)
+        for data in results:
+            for item in (data or {}).get("response", []):
+                await self.process_fixture(item)
+
+    async def tick(self, now=None):
+        """Один шаг трекера. Возвращает задержку до следующего шага в секундах"""
+        now = time.time() if now is None else now
+        if now - self.schedule_updated >= SCHEDULE_REFRESH_INTERVAL:
+            await self.refresh_schedule(now)
+
+        # Матчи, окно которых давно закончилось, больше не отслеживаем
+        for fixture_id in [
+            fid for fid, f in self.fixtures.items()
+            if now > f["kickoff"] + WINDOW_AFTER_KICKOFF
+        ]:
+            del self.fixtures[fixture_id]
+
+        active = [fid for fid, f in self.fixtures.items() if self._in_window(f, now)]
+        if active:
+            await self.poll(active)
+            return MATCH_LIVE_POLL_INTERVAL
+
+        # Спим до начала ближайшего окна, но не дольше интервала простоя
+        upcoming = [f["kickoff"] - WINDOW_BEFORE_KICKOFF for f in self.fixtures.values()]
+        until_next = min(upcoming) - now if upcoming else MATCH_IDLE_POLL_INTERVAL
+        return max(1, min(until_next, MATCH_IDLE_POLL_INTERVAL))
+
+    async def _run(self):
+        while True:
+            try:
+                delay = await self.tick()
+            except Exception as e:
+                logger.error(f"Ошибка трекера матчей: {e}")
+                delay = MATCH_LIVE_POLL_INTERVAL
+            await asyncio.sleep(delay)
+
+    def start(self):
+        """Запускает фоновое отслеживание матчей"""
+        if not self.task or self.task.done():
+            self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Останавливает отслеживание матчей"""
+        if self.task and not self.task.done():
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
@@ -0,0 +1,181 @@
+import sys
+import time
+import asyncio
+import itertools
+import logging
+import tracemalloc
+from app.config import MEMORY_SNAPSHOT_INTERVAL, MEMORY_GROWTH_ALERT_MB, MEMORY_TRACE_FRAMES
+from app.services.monitoring import monitoring
+
+logger = logging.getLogger(__name__)
+
+# Сколько мест выделения памяти показывать в отчёте
+TOP_SITES = 10
+
+# Служебные выделения, которые не интересны при поиске утечек
+SNAPSHOT_FILTERS = [
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    tracemalloc.Filter(False, "<unknown>"),
+]
+
+# Ограничения обхода в approx_size: выполняется в цикле событий, поэтому
+# для больших структур размер занижается, а не считается долго
+APPROX_MAX_DEPTH = 20
+APPROX_MAX_OBJECTS = 100_000
+
+# Как долго /stats показывает уже посчитанные размеры структур (секунды)
+BREAKDOWN_MAX_AGE = 60
+
+def approx_size(obj, max_depth=APPROX_MAX_DEPTH, max_objects=APPROX_MAX_OBJECTS):
+    """
+    Приблизительный размер объекта вместе с вложенными контейнерами (байты).
+    Обход без рекурсии, не глубже max_depth и не больше max_objects объектов
+    """
+    seen = set()
+    stack = [(obj, 0)]
+    size = 0
+    while stack and len(seen) < max_objects:
+        item, depth = stack.pop()
+        if id(item) in seen:
+            continue
+        seen.add(id(item))
+        size += sys.getsizeof(item)
+        if depth >= max_depth:
+            continue
+        if isinstance(item, dict):
+            children = itertools.chain.from_iterable(item.items())
+        elif isinstance(item, (list, tuple, set, frozenset)):
+            children = iter(item)
+        else:
+            continue
+        budget = max_objects - len(seen) - len(stack)
+        stack.extend((child, depth + 1) for child in itertools.islice(children, max(budget, 0)))
+    return size
+
+class MemoryProfiler:
+    """
+    Периодические снимки tracemalloc: рост по местам выделения памяти
+    и оповещение администратора при превышении порога
+    """
+    def __init__(self, interval=MEMORY_SNAPSHOT_INTERVAL, alert_mb=MEMORY_GROWTH_ALERT_MB,
+                 frames=MEMORY_TRACE_FRAMES):
+        self.interval = interval
+        self.alert_bytes = alert_mb * 1024 * 1024
+        self.frames = frames
+        self.baseline = None
+        self.previous = None
+        self.alert_reference = 0  # Объём отслеживаемой памяти на момент последнего оповещения
+        self.last_report = []
+        self.breakdown = {}
+        self.breakdown_at = None
+        self.task = None
+
+    def get_breakdown(self, max_age=0):
+        """
+        Размеры структур, зарегистрированных через monitoring.register_size_probe:
+        {имя: (элементов, байт)}. Результат не старше max_age секунд берётся из кэша
+        """
+        if self.breakdown_at is not None and time.monotonic() - self.breakdown_at < max_age:
+            return self.breakdown
+        breakdown = {}
+        for name, probe in list(monitoring.size_probes.items()):
+            try:
+                obj = probe()
+                count = len(obj) if hasattr(obj, "__len__") else None
+                breakdown[name] = (count, approx_size(obj))
+            except Exception as e:
+                logger.warning(f"Ошибка пробы памяти {name}: {e}")
+        self.breakdown = breakdown
+        self.breakdown_at = time.monotonic()
+        return breakdown
+
+    def _take_snapshot(self):
+        return tracemalloc.take_snapshot().filter_traces(SNAPSHOT_FILTERS)
+
+    @staticmethod
+    def _format_site(stat):
+        frame = stat.traceback[0]
+        return f"{frame.filename}:{frame.lineno} +{stat.size_diff / 1024:.1f} КБ ({stat.count_diff:+d} блоков)"
+
+    async def check(self):
+        """Снимает снимок, сравнивает с предыдущим и при необходимости оповещает админа"""
+        # Снимок и сравнение - тяжёлые синхронные операции, выполняем их вне цикла событий
+        snapshot = await asyncio.to_thread(self._take_snapshot)
+        if self.baseline is None:
+            self.baseline = self.previous = snapshot
+            self.alert_reference = tracemalloc.get_traced_memory()[0]
+            return []
+
+        diff = await asyncio.to_thread(snapshot.compare_to, self.previous, "lineno")
+        self.previous = snapshot
+        growing = [stat for stat in diff if stat.size_diff > 0][:TOP_SITES]
+        self.last_report = [self._format_site(stat) for stat in growing]
+
+        current, peak = tracemalloc.get_traced_memory()
+        logger.info(
+            f"tracemalloc: {current / 1024 / 1024:.2f} МБ (пик {peak / 1024 / 1024:.2f} МБ), "
+            f"растущие места: {'; '.join(self.last_report[:3]) or 'нет'}"
+        )
+
+        growth = current - self.alert_reference
+        if growth > self.alert_bytes:
+            self.alert_reference = current
+            await self._alert(growth, snapshot)
+        return self.last_report
+
+    async def _alert(self, growth, snapshot):
+        """Оповещает админа о росте памяти с указанием мест выделения с начала работы"""
+        diff = await asyncio.to_thread(snapshot.compare_to, self.baseline, "traceback")
+        lines = [f"⚠️ Рост памяти на {growth / 1024 / 1024:.1f} МБ. Основные места с момента запуска:"]
+        for stat in [s for s in diff if s.size_diff > 0][:5]:
+            lines.append(self._format_site(stat))
+            # Несколько ближайших кадров стека помогают найти владельца памяти
+            for frame in list(stat.traceback)[1:3]:
+                lines.append(f"    ← {frame.filename}:{frame.lineno}")
+        for name, (count, size) in self.get_breakdown().items():
+            lines.append(f"{name}: {count} эл., ~{size / 1024:.1f} КБ")
+        await monitoring.notify_admin("\n".join(lines)[:4000])
+
+    async def _run(self):
+        while True:
+            try:
+                await self.check()
+            except Exception as e:
+                logger.error(f"Ошибка профилирования памяти: {e}")
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        """Включает tracemalloc и периодические снимки"""
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+        if not self.task or self.task.done():
+            self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Останавливает снимки и tracemalloc"""
+        if self.task and not self.task.done():
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+    def get_stats(self):
+        """Состояние профилировщика для /stats"""
+        stats = {
+            "enabled": tracemalloc.is_tracing(),
+            "breakdown": self.get_breakdown(max_age=BREAKDOWN_MAX_AGE),
+            "top_sites": self.last_report[:3]
+        }
+        if stats["enabled"]:
+            current, peak = tracemalloc.get_traced_memory()
+            stats["traced_mb"] = round(current / 1024 / 1024, 2)
+            stats["peak_mb"] = round(peak / 1024 / 1024, 2)
+        return stats
+
+# Глобальный экземпляр профилировщика памяти
+memory_profiler = MemoryProfiler()
@@ -1,12 +1,30 @@
+import time
 import logging
 import asyncio
-from datetime import datetime
+from datetime import datetime, time as dt_time, timedelta
+import pytz
 from aiogram import Bot
+from aiogram.exceptions import TelegramRetryAfter
 from app.services.api import ApiClient
-from app.config import CHAT_ID
+from app.services.market import market_data
+from app.database.models import DigestSubscriptions
+from app.config import CHAT_ID, DIGEST_SEND_CONCURRENCY, DIGEST_SEND_RATE, DIGEST_CATCH_UP_MINUTES
 
 logger = logging.getLogger(__name__)
 
+MOSCOW_TZ = pytz.timezone('Europe/Moscow')
+
+# Подписка по умолчанию для CHAT_ID
+DEFAULT_DIGEST_CITIES = [
+    {"name": "Минск", "query": "Minsk,BY"},
+    {"name": "Жлобин", "query": "Zhlobin,BY"},
+    {"name": "Гомель", "query": "Gomel,BY"},
+    {"name": "Житковичи", "query": "Zhitkovichi,BY"},
+    {"name": "Шри-Ланка", "query": "Colombo,LK"},
+    {"name": "Ноябрьск", "query": "Noyabrsk,RU"},
+]
+DEFAULT_DIGEST_TIME = "08:00"
+
 def split_long_message(text, max_length=4096):
     """Разделяет длинное сообщение на части для отправки в Telegram."""
     if len(text) <= max_length:
@@ -26,66 +44,157 @@ async def send_long_message(bot, chat_id, text, **kwargs):
         sent_messages.append(sent)
     return sent_messages
 
+class SendRateLimiter:
+    """Ограничивает частоту отправки сообщений (не более rate в секунду)"""
+    def __init__(self, rate):
+        self.interval = 1 / rate if rate else 0
+        self.next_slot = 0
+        self.lock = asyncio.Lock()
+
+    async def wait(self):
+        async with self.lock:
+            now = time.monotonic()
+            delay = self.next_slot - now
+            self.next_slot = max(now, self.next_slot) + self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+def render_digest(cities, weather, currency, crypto):
+    """Формирует текст утреннего сообщения из общего снимка данных"""
+    usd_byn_rate, usd_rub_rate = currency
+    btc_price_usd, wld_price_usd = crypto
+
+    # Рассчитываем цены в BYN
+    btc_price_byn = float(btc_price_usd) * float(usd_byn_rate) if btc_price_usd and usd_byn_rate else 0
+    wld_price_byn = float(wld_price_usd) * float(usd_byn_rate) if wld_price_usd and usd_byn_rate else 0
+
+    return (
+        "Родные мои, всем доброе утро и хорошего дня! ❤️\n\n"
+        "*Положняк по погоде:*\n"
+        + "\n".join(f"🌥 *{city['name']}*: {weather.get(city['query'], 'Нет данных')}"
+                  for city in cities) + "\n\n"
+        "*Положняк по курсам:*\n"
+        f"💵 *USD/BYN*: {usd_byn_rate:.2f} BYN\n"
+        f"💵 *USD/RUB*: {usd_rub_rate:.2f} RUB\n"
+        f"₿ *BTC*: ${btc_price_usd:,.2f} USD | {btc_price_byn:,.2f} BYN\n"
+        f"🌍 *WLD*: ${wld_price_usd:.2f} USD | {wld_price_byn:.2f} BYN"
+    )
+
 class MorningMessageSender:
-    def __init__(self, bot):
+    def __init__(self, bot, db_pool):
         self.bot = bot
+        self.db_pool = db_pool
+        self.rate_limiter = SendRateLimiter(DIGEST_SEND_RATE)
+        self.send_semaphore = asyncio.Semaphore(DIGEST_SEND_CONCURRENCY)
 
-    async def send_morning_message(self):
-        logger.info("Подготовка утреннего сообщения")
-        try:
-            cities = {
-                "Минск": "Minsk,BY", "Жлобин": "Zhlobin,BY", "Гомель": "Gomel,BY",
-                "Житковичи": "Zhitkovichi,BY", "Шри-Ланка": "Colombo,LK", "Ноябрьск": "Noyabrsk,RU"
-            }
-            
-            # Параллельно выполняем все запросы к API
-            weather_tasks = [ApiClient.get_weather(code) for code in cities.values()]
-            currency_task = ApiClient.get_currency_rates()
-            crypto_task = ApiClient.get_crypto_prices()
-            
-            # Собираем результаты
-            results = await asyncio.gather(
-                *weather_tasks,
-                currency_task,
-                crypto_task,
-                return_exceptions=True
-            )
-            
-            # Обрабатываем результаты
-            weather_results = results[:len(cities)]
-            usd_byn_rate, usd_rub_rate = results[len(cities)]
-            btc_price_usd, wld_price_usd = results[len(cities) + 1]
-            
-            weather_data = dict(zip(cities.keys(), weather_results))
-            
-            # Рассчитываем цены в BYN
-            btc_price_byn = float(btc_price_usd) * float(usd_byn_rate) if btc_price_usd and usd_byn_rate else 0
-            wld_price_byn = float(wld_price_usd) * float(usd_byn_rate) if wld_price_usd and usd_byn_rate else 0
-            
-            # Формируем сообщение
-            message = (
-                "Родные мои, всем доброе утро и хорошего дня! ❤️\n\n"
-                "*Положняк по погоде:*\n"
-                + "\n".join(f"🌥 *{city}*: {data if not isinstance(data, Exception) else 'Нет данных'}" 
-                          for city, data in weather_data.items()) + "\n\n"
-                "*Положняк по курсам:*\n"
-                f"💵 *USD/BYN*: {usd_byn_rate:.2f} BYN\n"
-                f"💵 *USD/RUB*: {usd_rub_rate:.2f} RUB\n"
-                f"₿ *BTC*: ${btc_price_usd:,.2f} USD | {btc_price_byn:,.2f} BYN\n"
-                f"🌍 *WLD*: ${wld_price_usd:.2f} USD | {wld_price_byn:.2f} BYN"
-            )
-            
-            # Отправляем сообщение
-            sent_message = await self.bot.send_message(
-                chat_id=CHAT_ID, 
-                text=message, 
-                parse_mode="MARKDOWN"
+    async def ensure_default_subscription(self):
+        """Создает подписку для CHAT_ID, если подписок ещё нет"""
+        await DigestSubscriptions.ensure_default(
+            self.db_pool, CHAT_ID, DEFAULT_DIGEST_CITIES,
+            datetime.strptime(DEFAULT_DIGEST_TIME, "%H:%M").time()
+        )
+
+    async def _resolve_city_ids(self, queries):
+        """Возвращает идентификаторы OpenWeather для городов, запрашивая только неизвестные"""
+        city_ids = await DigestSubscriptions.get_city_ids(self.db_pool, queries)
+        missing = [query for query in queries if query not in city_ids]
+        if missing:
+            resolved = await asyncio.gather(*(ApiClient.get_city_id(query) for query in missing))
+            new_ids = {query: city_id for query, city_id in zip(missing, resolved) if city_id}
+            await DigestSubscriptions.save_city_ids(self.db_pool, new_ids)
+            city_ids.update(new_ids)
+        return city_ids
+
+    async def fetch_snapshot(self, queries):
+        """
+        Получает погоду для всех уникальных городов одним набором групповых запросов,
+        а также курсы валют и цены криптовалют
+        """
+        city_ids = await self._resolve_city_ids(queries)
+        if market_data.is_ready():
+            # Курсы берём из фонового снимка без обращения к внешним API
+            weather_by_id = await ApiClient.get_weather_group(city_ids.values())
+            currency, crypto = market_data.currency_rates(), market_data.crypto_prices()
+        else:
+            weather_by_id, currency, crypto = await asyncio.gather(
+                ApiClient.get_weather_group(city_ids.values()),
+                ApiClient.get_currency_rates(),
+                ApiClient.get_crypto_prices()
             )
-            
-            logger.info("Утреннее сообщение отправлено")
+        weather = {
+            query: weather_by_id[city_id]
+            for query, city_id in city_ids.items()
+            if city_id in weather_by_id
+        }
+        return weather, currency, crypto
+
+    async def _send_digest(self, chat_id, text):
+        """Отправляет рассылку в чат с учетом ограничения частоты"""
+        async with self.send_semaphore:
+            for attempt in range(2):
+                await self.rate_limiter.wait()
+                try:
+                    return await self.bot.send_message(
+                        chat_id=chat_id,
+                        text=text,
+                        parse_mode="MARKDOWN"
+                    )
+                except TelegramRetryAfter as e:
+                    logger.warning(f"Flood control при рассылке в чат {chat_id}, ждём {e.retry_after}с")
+                    await asyncio.sleep(e.retry_after)
+                except Exception as e:
+                    logger.error(f"Ошибка отправки утреннего сообщения в чат {chat_id}: {e}")
+                    return None
+            return None
+
+    async def send_morning_message(self, now=None):
+        """
+        Отправляет утренние сообщения подписчикам, чьё время отправки уже наступило
+        (не раньше чем DIGEST_CATCH_UP_MINUTES назад), а сегодняшняя рассылка ещё не ушла.
+        Запуск с опозданием или пропущенная при перезапуске минута не теряют рассылку,
+        неудавшаяся отправка повторяется следующим запуском
+        """
+        if now is None:
+            now = datetime.now(MOSCOW_TZ)
+        window_start = now - timedelta(minutes=DIGEST_CATCH_UP_MINUTES)
+        earliest = window_start.time() if window_start.date() == now.date() else dt_time.min
+        unsent = set()  # Отмеченные отправленными чаты, которым рассылка ещё не ушла
+
+        async def send(sub, text):
+            sent_message = await self._send_digest(sub['chat_id'], text)
+            if sent_message:
+                unsent.discard(sub['chat_id'])
             return sent_message
-            
+
+        try:
+            subscriptions = await DigestSubscriptions.claim_due(self.db_pool, now.date(), earliest, now.time())
+            if not subscriptions:
+                return []
+            unsent.update(sub['chat_id'] for sub in subscriptions)
+
+            logger.info(f"Подготовка утреннего сообщения для {len(subscriptions)} чатов")
+
+            # Каждый город запрашивается один раз для всех подписок
+            queries = sorted({city['query'] for sub in subscriptions for city in sub['cities']})
+            weather, currency, crypto = await self.fetch_snapshot(queries)
+
+            sent_messages = await asyncio.gather(*(
+                send(sub, render_digest(sub['cities'], weather, currency, crypto))
+                for sub in subscriptions
+            ))
+
+            logger.info(
+                f"Утреннее сообщение отправлено в {sum(1 for m in sent_messages if m)} "
+                f"из {len(subscriptions)} чатов"
+            )
+            return sent_messages
+
         except Exception as e:
             logger.error(f"Ошибка при отправке утреннего сообщения: {e}")
             # Можно добавить оповещение администратора
-            return None
\ No newline at end of file
+            return None
+        finally:
+            # Ошибка отправки, сбой получения данных или остановка бота посреди рассылки
+            if unsent:
+                logger.warning(f"Утреннее сообщение не доставлено в {len(unsent)} чатов, будет повторено")
+                await DigestSubscriptions.release(self.db_pool, unsent, now.date())
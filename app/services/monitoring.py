@@ -3,28 +3,69 @@ import logging
 import asyncio
 import traceback
 import os
+import reprlib
 import psutil
+from collections import OrderedDict
 from functools import wraps
 from datetime import datetime
+from aiogram.types import Message
+from app.services.loop_monitor import loop_monitor
 
 logger = logging.getLogger(__name__)
 
+# Максимальное число различных ошибок (отпечатков) в таблице
+ERROR_TABLE_SIZE = 200
+# Не более ERROR_ALERTS_PER_WINDOW мгновенных оповещений за ERROR_ALERT_WINDOW секунд,
+# остальное попадает в периодическую сводку
+ERROR_ALERTS_PER_WINDOW = 5
+ERROR_ALERT_WINDOW = 60
+# Интервал сводки повторяющихся ошибок (секунды)
+ERROR_DIGEST_INTERVAL = 600
+
+def error_fingerprint(error):
+    """
+    Отпечаток ошибки: тип исключения и место возникновения
+    (самый глубокий кадр кода приложения)
+    """
+    site = app_site = None
+    for frame, lineno in traceback.walk_tb(error.__traceback__):
+        code = frame.f_code
+        site = f"{os.path.basename(code.co_filename)}:{lineno}:{code.co_name}"
+        if f"{os.sep}app{os.sep}" in code.co_filename:
+            app_site = site
+    return f"{type(error).__name__}@{app_site or site or 'unknown'}"
+
 class BotMonitoring:
     def __init__(self, bot=None, admin_chat_id=None):
         self.bot = bot
         self.admin_chat_id = admin_chat_id
         self.error_count = 0
         self.last_errors = []  # Хранить последние N ошибок
+        self.errors = OrderedDict()  # Отпечаток -> сведения об ошибке (LRU, не более ERROR_TABLE_SIZE)
+        self.alert_times = []  # Время последних мгновенных оповещений
         self.start_time = time.time()
         self.message_count = 0
         self.command_count = 0
         self.api_request_count = 0
         self.ai_request_count = 0
         self.db_operation_count = 0
+        self.last_backup = None  # Сведения о последнем бэкапе
+        self.size_probes = {}  # Подсистема -> функция, возвращающая структуру для оценки размера
+        self.register_size_probe("BotMonitoring.last_errors", lambda: self.last_errors)
+        self.register_size_probe("BotMonitoring.errors", lambda: self.errors)
         
-    def set_bot(self, bot):
-        """Устанавливает бота для отправки уведомлений"""
+    def register_size_probe(self, name, probe):
+        """
+        Регистрирует пробу размера подсистемы для профилировщика памяти.
+        probe() возвращает структуру данных, размер которой оценивается по запросу
+        """
+        self.size_probes[name] = probe
+        
+    def set_bot(self, bot, admin_chat_id=None):
+        """Устанавливает бота и чат администратора для отправки уведомлений"""
         self.bot = bot
+        if admin_chat_id is not None:
+            self.admin_chat_id = admin_chat_id
         
     async def notify_admin(self, message):
         """Отправляет оповещение администратору"""
@@ -35,34 +76,128 @@ class BotMonitoring:
                 logger.error(f"Не удалось отправить уведомление админу: {e}")
     
     def log_error(self, error, context=None):
-        """Логирует ошибку и уведомляет админа если нужно"""
+        """
+        Учитывает ошибку по отпечатку (тип + место возникновения).
+        Первое появление логируется с трассировкой и сразу отправляется админу,
+        повторы только подсчитываются и попадают в периодическую сводку.
+        """
         self.error_count += 1
-        error_msg = f"❌ Ошибка: {type(error).__name__}: {error}"
-        if context:
-            error_msg += f"\nКонтекст: {context}"
-        
-        # Добавляем трассировку
-        error_trace = traceback.format_exc()
-        error_msg += f"\n\nТрассировка:\n{error_trace}"
-        
-        # Логируем
-        logger.error(error_msg)
-        
+        now = time.time()
+        fingerprint = error_fingerprint(error)
+
+        record = self.errors.get(fingerprint)
+        if record is None:
+            # Трассировка сохраняется без форматирования и без ссылок на кадры стека
+            record = {
+                "fingerprint": fingerprint,
+                "type": type(error).__name__,
+                "message": str(error),
+                "context": context,
+                "traceback": traceback.TracebackException.from_exception(error, lookup_lines=False),
+                "first_seen": now,
+                "last_seen": now,
+                "count": 0,
+                "pending": 0,  # Повторы, ещё не попавшие в сводку
+            }
+            self.errors[fingerprint] = record
+            if len(self.errors) > ERROR_TABLE_SIZE:
+                self.errors.popitem(last=False)
+        else:
+            self.errors.move_to_end(fingerprint)
+            record["last_seen"] = now
+            record["message"] = str(error)
+
+        record["count"] += 1
+        count = record["count"]
+
         # Храним в списке последних ошибок
-        self.last_errors.append({
-            "time": time.time(),
-            "error": str(error),
-            "traceback": error_trace
-        })
+        self.last_errors.append({"time": now, "error": record["message"], "fingerprint": fingerprint})
         # Ограничиваем список последних ошибок
         if len(self.last_errors) > 10:
             self.last_errors.pop(0)
-        
-        # Уведомляем админа асинхронно
+
+        if count == 1:
+            logger.error("❌ Ошибка %s: %s (контекст: %s)", fingerprint, error, context, exc_info=error)
+            if self._alert_allowed(now):
+                self._schedule_notification(self._format_error(record))
+                return
+        elif count & (count - 1) == 0:
+            # Повторы логируются на 2, 4, 8, ... раз
+            logger.error("Повтор ошибки %s (%d раз): %s", fingerprint, count, error)
+
+        record["pending"] += 1
+
+    def _alert_allowed(self, now):
+        """Ограничение частоты мгновенных оповещений о новых ошибках"""
+        while self.alert_times and now - self.alert_times[0] > ERROR_ALERT_WINDOW:
+            self.alert_times.pop(0)
+        if len(self.alert_times) >= ERROR_ALERTS_PER_WINDOW:
+            return False
+        self.alert_times.append(now)
+        return True
+
+    def _schedule_notification(self, message):
         if self.bot and self.admin_chat_id:
-            # Ограничиваем длину сообщения для Telegram
-            short_msg = error_msg[:3900] + "..." if len(error_msg) > 4000 else error_msg
-            asyncio.create_task(self.notify_admin(short_msg))
+            try:
+                asyncio.get_running_loop().create_task(self.notify_admin(message))
+            except RuntimeError:
+                # Нет запущенного цикла событий - уведомление отправит сводка
+                pass
+
+    @staticmethod
+    def _format_error(record):
+        """Форматирует сообщение о новой ошибке (трассировка форматируется только здесь)"""
+        error_msg = f"❌ Ошибка: {record['type']}: {record['message']}\nОтпечаток: {record['fingerprint']}"
+        if record["context"]:
+            error_msg += f"\nКонтекст: {record['context']}"
+        error_trace = "".join(record["traceback"].format())
+        error_msg += f"\n\nТрассировка:\n{error_trace}"
+        # Ограничиваем длину сообщения для Telegram
+        return error_msg[:3900] + "..." if len(error_msg) > 4000 else error_msg
+
+    def get_error_traceback(self, fingerprint):
+        """Возвращает отформатированную трассировку первого появления ошибки"""
+        record = self.errors.get(fingerprint)
+        return "".join(record["traceback"].format()) if record else None
+
+    def build_error_digest(self):
+        """Формирует сводку ошибок, накопившихся с прошлой сводки, и сбрасывает счётчики"""
+        pending = [record for record in self.errors.values() if record["pending"]]
+        if not pending:
+            return None
+        pending.sort(key=lambda record: record["pending"], reverse=True)
+        lines = [f"🔁 Сводка ошибок за {ERROR_DIGEST_INTERVAL // 60} мин:"]
+        for record in pending[:20]:
+            lines.append(
+                f"• {record['fingerprint']}: {record['pending']} раз "
+                f"(всего {record['count']}), последняя: {record['message'][:200]}"
+            )
+            record["pending"] = 0
+        if len(pending) > 20:
+            lines.append(f"... и ещё {len(pending) - 20} видов ошибок")
+            for record in pending[20:]:
+                record["pending"] = 0
+        return "\n".join(lines)[:4000]
+
+    async def send_error_digest(self):
+        """Отправляет администратору сводку повторяющихся ошибок"""
+        digest = self.build_error_digest()
+        if digest:
+            await self.notify_admin(digest)
+        
+    def record_backup(self, duration, size):
+        """Сохраняет длительность, размер и скорость последнего бэкапа"""
+        throughput = size / duration if duration > 0 else 0
+        self.last_backup = {
+            "time": time.time(),
+            "duration_s": round(duration, 1),
+            "size_mb": round(size / 1024 / 1024, 2),
+            "throughput_mb_s": round(throughput / 1024 / 1024, 2)
+        }
+        logger.info(
+            f"Бэкап: {self.last_backup['size_mb']} МБ за {self.last_backup['duration_s']}с "
+            f"({self.last_backup['throughput_mb_s']} МБ/с)"
+        )
         
     def log_memory_usage(self):
         """Логирует текущее использование памяти процессом"""
@@ -88,7 +223,10 @@ class BotMonitoring:
             "ai_request_count": self.ai_request_count,
             "db_operation_count": self.db_operation_count,
             "error_count": self.error_count,
-            "last_errors": self.last_errors
+            "last_errors": self.last_errors,
+            "distinct_errors": len(self.errors),
+            "loop_lag": loop_monitor.get_stats(),
+            "last_backup": self.last_backup
         }
         
     def increment_message(self):
@@ -114,6 +252,21 @@ class BotMonitoring:
 # Создаем глобальный экземпляр мониторинга
 monitoring = BotMonitoring()
 
+# Ограниченное представление аргументов в контексте ошибок
+CONTEXT_REPR = reprlib.Repr()
+CONTEXT_REPR.maxstring = 100
+CONTEXT_REPR.maxother = 100
+
+def describe_arg(arg):
+    """
+    Короткое описание аргумента для контекста ошибки. Контекст хранится в таблице
+    ошибок, поэтому сами объекты (сообщения со ссылками на бота и сессию) не сохраняются
+    """
+    if isinstance(arg, Message):
+        user_id = arg.from_user.id if arg.from_user else None
+        return f"Message(chat_id={arg.chat.id}, user_id={user_id}, text={CONTEXT_REPR.repr(arg.text or '')})"
+    return CONTEXT_REPR.repr(arg)
+
 def monitor_function(func):
     """Декоратор для мониторинга выполнения функций"""
     @wraps(func)
@@ -131,8 +284,8 @@ def monitor_function(func):
             execution_time = time.time() - start_time
             context = {
                 "function": function_name,
-                "args": str(args),
-                "kwargs": str(kwargs),
+                "args": [describe_arg(arg) for arg in args],
+                "kwargs": {name: describe_arg(value) for name, value in kwargs.items()},
                 "execution_time": f"{execution_time:.2f}s"
             }
             monitoring.log_error(e, context)
@@ -0,0 +1,121 @@
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Приоритеты запросов к платным API
+PRIORITY_USER = "user"              # Ответ на команду пользователя
+PRIORITY_BACKGROUND = "background"  # Фоновые задачи (трекер матчей, расписание)
+PRIORITY_OPTIONAL = "optional"      # Необязательные данные (события старых матчей)
+
+# Доля дневной квоты, ниже которой запросы данного приоритета откладываются
+PRIORITY_RESERVE = {
+    PRIORITY_USER: 0.0,
+    PRIORITY_BACKGROUND: 0.1,
+    PRIORITY_OPTIONAL: 0.3,
+}
+
+# (доля оставшейся квоты, множитель TTL кэша) - от большей доли к меньшей
+TTL_MULTIPLIERS = [
+    (0.5, 1),
+    (0.2, 2),
+    (0.1, 4),
+    (0.05, 8),
+]
+
+# Через сколько секунд повторить запрос к исчерпанной квоте, если API не сообщил время сброса:
+# без этого пользовательские команды блокировались бы до перезапуска (заголовки обновляет только ответ)
+UNKNOWN_RESET_RETRY = 60
+
+class QuotaExceededError(Exception):
+    """Запрос отложен, чтобы сохранить квоту API для пользовательских команд"""
+
+class QuotaBudgeter:
+    """
+    Отслеживает остаток квоты по заголовкам x-ratelimit-* для каждого API-ключа,
+    растягивает TTL кэша и откладывает необязательные запросы по мере её исчерпания
+    """
+    def __init__(self):
+        self.budgets = {}  # quota_key -> {"limit", "remaining", "reset_at", "updated", "deferred"}
+
+    def update(self, quota_key, headers):
+        """Обновляет состояние квоты по заголовкам ответа"""
+        limit = headers.get("x-ratelimit-requests-limit")
+        remaining = headers.get("x-ratelimit-requests-remaining")
+        reset = headers.get("x-ratelimit-requests-reset")
+        if remaining is None:
+            return
+        budget = self.budgets.setdefault(quota_key, {"deferred": 0})
+        try:
+            budget["remaining"] = int(remaining)
+            if limit is not None:
+                budget["limit"] = int(limit)
+            if reset is not None:
+                # RapidAPI передаёт число секунд до сброса квоты
+                budget["reset_at"] = time.time() + int(reset)
+            elif budget["remaining"] <= 0 and budget.get("reset_at", 0) <= time.time():
+                budget["reset_at"] = time.time() + UNKNOWN_RESET_RETRY
+        except ValueError:
+            logger.warning(f"Некорректные заголовки квоты для {quota_key}: {remaining}/{limit}/{reset}")
+            return
+        budget["updated"] = time.time()
+
+    def mark_exhausted(self, quota_key, retry_after=None):
+        """Отмечает квоту исчерпанной (ответ 429)"""
+        budget = self.budgets.setdefault(quota_key, {"deferred": 0})
+        budget["remaining"] = 0
+        budget["updated"] = time.time()
+        budget["reset_at"] = time.time() + (retry_after or UNKNOWN_RESET_RETRY)
+
+    def remaining_fraction(self, quota_key):
+        """Доля оставшейся квоты (1.0 если данных ещё нет или квота сброшена)"""
+        budget = self.budgets.get(quota_key)
+        if not budget or "remaining" not in budget:
+            return 1.0
+        if budget.get("reset_at") and time.time() >= budget["reset_at"]:
+            return 1.0
+        limit = budget.get("limit")
+        if not limit:
+            return 1.0 if budget["remaining"] > 0 else 0.0
+        return max(0.0, min(1.0, budget["remaining"] / limit))
+
+    def scale_ttl(self, quota_key, cache_ttl):
+        """Возвращает TTL кэша с учётом оставшейся квоты"""
+        if not quota_key:
+            return cache_ttl
+        fraction = self.remaining_fraction(quota_key)
+        for threshold, multiplier in TTL_MULTIPLIERS:
+            if fraction >= threshold:
+                return cache_ttl * multiplier
+        # Квота почти исчерпана - кэш не устаревает
+        return float("inf")
+
+    def allow(self, quota_key, priority=PRIORITY_USER):
+        """Можно ли выполнить запрос данного приоритета"""
+        if not quota_key:
+            return True
+        fraction = self.remaining_fraction(quota_key)
+        reserve = PRIORITY_RESERVE.get(priority, 0.0)
+        if fraction > reserve:
+            return True
+        budget = self.budgets.setdefault(quota_key, {"deferred": 0})
+        budget["deferred"] += 1
+        return False
+
+    def get_stats(self):
+        """Состояние квот для /stats"""
+        now = time.time()
+        stats = {}
+        for quota_key, budget in self.budgets.items():
+            reset_at = budget.get("reset_at")
+            stats[quota_key] = {
+                "remaining": budget.get("remaining"),
+                "limit": budget.get("limit"),
+                "reset_in_s": int(reset_at - now) if reset_at and reset_at > now else None,
+                "fraction": round(self.remaining_fraction(quota_key), 3),
+                "deferred": budget.get("deferred", 0)
+            }
+        return stats
+
+# Глобальный экземпляр учёта квот
+quota_budgeter = QuotaBudgeter()
@@ -0,0 +1,83 @@
+import asyncio
+import logging
+from app.config import (
+    AI_SUMMARY_RECENT_WINDOW, AI_SUMMARY_MIN_BATCH, AI_SUMMARY_BATCH_MAX, AI_SUMMARY_CONCURRENCY
+)
+from app.database.models import ChatHistory, ChatSummaries
+from app.services.ai import AiHandler
+from app.services.monitoring import monitoring
+from app.services.tracing import create_detached_task
+
+logger = logging.getLogger(__name__)
+
+class ConversationSummarizer:
+    """
+    Фоновое сворачивание старых сообщений в сводку разговора.
+    Сообщения, вышедшие из окна последних recent_window, пакетами дописываются
+    в сводку (chat_id, reset_id); одновременно работает не более concurrency сводок,
+    на каждый чат - не более одной задачи.
+    """
+    def __init__(self, db_pool, recent_window=AI_SUMMARY_RECENT_WINDOW, min_batch=AI_SUMMARY_MIN_BATCH,
+                 batch_max=AI_SUMMARY_BATCH_MAX, concurrency=AI_SUMMARY_CONCURRENCY):
+        self.db_pool = db_pool
+        self.recent_window = recent_window
+        self.min_batch = min_batch
+        self.batch_max = batch_max
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.tasks = {}  # chat_id -> задача сворачивания
+        self.stats = {"runs": 0, "folded_messages": 0, "errors": 0}
+
+    def schedule(self, chat_id):
+        """Запускает сворачивание для чата, если оно ещё не выполняется"""
+        task = self.tasks.get(chat_id)
+        if task and not task.done():
+            return task
+        task = create_detached_task(self._run(chat_id), name=f"summarize:{chat_id}")
+        self.tasks[chat_id] = task
+
+        def forget(done):
+            if self.tasks.get(chat_id) is done:
+                del self.tasks[chat_id]
+
+        task.add_done_callback(forget)
+        return task
+
+    async def _run(self, chat_id):
+        async with self.semaphore:
+            try:
+                # Пока накопилось достаточно старых сообщений, сворачиваем их пакетами
+                while await self.fold(chat_id):
+                    pass
+            except Exception as e:
+                self.stats["errors"] += 1
+                monitoring.log_error(e, {"stage": "summarize", "chat_id": chat_id})
+
+    async def fold(self, chat_id):
+        """Дописывает в сводку один пакет сообщений. Возвращает True, если сводка обновлена"""
+        reset_id = await ChatHistory.get_reset_id(self.db_pool, chat_id)
+        summary, until_id = await ChatSummaries.get_state(self.db_pool, chat_id, reset_id)
+        rows = await ChatSummaries.get_aged_out(
+            self.db_pool, chat_id, reset_id, until_id, self.recent_window, self.batch_max
+        )
+        if len(rows) < self.min_batch:
+            return False
+
+        new_summary = await AiHandler.summarize(summary, rows)
+        if not new_summary:
+            return False
+        await ChatSummaries.save(self.db_pool, chat_id, reset_id, new_summary, rows[-1]['id'])
+        self.stats["runs"] += 1
+        self.stats["folded_messages"] += len(rows)
+        logger.info(
+            "Сводка чата %s обновлена: +%d сообщений", chat_id, len(rows),
+            extra={"chat_id": chat_id, "reset_id": reset_id}
+        )
+        return len(rows) == self.batch_max
+
+    async def drain(self, timeout=None):
+        """Ожидает завершения текущих сворачиваний"""
+        if self.tasks:
+            await asyncio.wait(list(self.tasks.values()), timeout=timeout)
+
+    def get_stats(self):
+        return dict(self.stats, active=len(self.tasks))
@@ -0,0 +1,268 @@
+import os
+import json
+import time
+import queue
+import random
+import asyncio
+import logging
+import threading
+import contextvars
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from app.config import (
+    TRACING_ENABLED, TRACE_SLOW_MS, TRACE_SAMPLE_RATE, TRACE_EXPORT_PATH, TRACE_EXPORT_MAX_MB, TRACE_MAX_SPANS
+)
+
+logger = logging.getLogger(__name__)
+
+# Трасса обрабатываемого обновления и текущий родительский спан.
+# Задачи asyncio копируют контекст, поэтому фоновые этапы обработчика
+# и колбэки asyncpg попадают в ту же трассу
+current_trace = contextvars.ContextVar("current_trace", default=None)
+current_span = contextvars.ContextVar("current_span", default=None)
+
+class Trace:
+    """
+    Трасса одного обновления: корневая длительность (ответ пользователю)
+    и спаны этапов. Экспортируется, когда завершились и обработчик,
+    и запущенные им фоновые задачи
+    """
+    def __init__(self, tracer, name, attrs):
+        self.tracer = tracer
+        self.trace_id = os.urandom(8).hex()
+        self.name = name
+        self.attrs = attrs
+        self.started_at = time.time()
+        self.start = time.monotonic()
+        self.duration = None  # Длительность обработчика
+        self.error = None
+        self.spans = []
+        self.dropped_spans = 0
+        self.last_span_id = 0
+        self.tasks = set()
+        self.exported = False
+
+    def new_span_id(self):
+        self.last_span_id += 1
+        return self.last_span_id
+
+    def add_span(self, name, start, duration, parent, attrs, error=None, span_id=None):
+        if len(self.spans) >= self.tracer.max_spans:
+            self.dropped_spans += 1
+            return
+        span = {
+            "id": span_id or self.new_span_id(),
+            "parent": parent,
+            "name": name,
+            "start_ms": round((start - self.start) * 1000, 2),
+            "duration_ms": round(duration * 1000, 2),
+        }
+        if attrs:
+            span["attrs"] = attrs
+        if error:
+            span["error"] = error
+        self.spans.append(span)
+
+    def attach(self, task):
+        """Фоновая задача обработчика: трасса ждёт её перед экспортом"""
+        self.tasks.add(task)
+        task.add_done_callback(self._task_done)
+
+    def _task_done(self, task):
+        self.tasks.discard(task)
+        self._maybe_export()
+
+    def finish(self, error=None):
+        self.duration = time.monotonic() - self.start
+        self.error = error
+        self._maybe_export()
+
+    def _maybe_export(self):
+        if self.duration is not None and not self.tasks and not self.exported:
+            self.exported = True
+            self.tracer.export(self)
+
+    def to_dict(self):
+        return {
+            "trace_id": self.trace_id,
+            "name": self.name,
+            "ts": self.started_at,
+            "duration_ms": round(self.duration * 1000, 2),
+            "total_ms": round((time.monotonic() - self.start) * 1000, 2),
+            "error": self.error,
+            "attrs": self.attrs,
+            "spans": sorted(self.spans, key=lambda span: span["start_ms"]),
+            "dropped_spans": self.dropped_spans,
+        }
+
+class _Span:
+    def __init__(self, name, attrs):
+        self.name = name
+        self.attrs = attrs
+        self.trace = current_trace.get()
+        self.span_id = None
+        self.token = None
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def __enter__(self):
+        if self.trace is not None:
+            self.start = time.monotonic()
+            self.span_id = self.trace.new_span_id()
+            self.token = current_span.set(self.span_id)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.trace is None:
+            return False
+        current_span.reset(self.token)
+        error = f"{exc_type.__name__}: {exc}" if exc_type else None
+        self.trace.add_span(
+            self.name, self.start, time.monotonic() - self.start, current_span.get(), self.attrs, error, self.span_id
+        )
+        return False
+
+def span(name, **attrs):
+    """
+    Спан этапа внутри текущей трассы (без трассы ничего не записывает):
+        with span("ai deepseek", model=model): ...
+    """
+    return _Span(name, attrs)
+
+def record_span(name, duration, error=None, **attrs):
+    """Спан уже завершившейся операции (колбэки с измеренной длительностью)"""
+    trace = current_trace.get()
+    if trace is not None:
+        trace.add_span(name, time.monotonic() - duration, duration, current_span.get(), attrs, error)
+
+def attach_task(task):
+    """Привязывает фоновую задачу к текущей трассе"""
+    trace = current_trace.get()
+    if trace is not None:
+        trace.attach(task)
+
+def create_detached_task(coro, name=None):
+    """
+    Фоновая задача вне текущей трассы: долгие общие работы (сводки разговоров)
+    не задерживают экспорт трассы и не дописывают спаны в уже экспортированную
+    """
+    context = contextvars.copy_context()
+    context.run(current_trace.set, None)
+    context.run(current_span.set, None)
+    return context.run(asyncio.create_task, coro, name=name)
+
+class JsonlExporter:
+    """
+    Дописывает трассы в JSONL-файл из фонового потока, чтобы запись
+    на диск не блокировала цикл событий. При превышении размера файл
+    переименовывается в .1 (хранится одна предыдущая часть)
+    """
+    def __init__(self, path=TRACE_EXPORT_PATH, max_bytes=int(TRACE_EXPORT_MAX_MB * 1024 * 1024)):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.queue = queue.SimpleQueue()
+        self.thread = None
+
+    def submit(self, entry):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, name="trace-exporter", daemon=True)
+            self.thread.start()
+        self.queue.put(entry)
+
+    def _run(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        while True:
+            entry = self.queue.get()
+            if entry is None:
+                return
+            try:
+                line = json.dumps(entry, ensure_ascii=False, default=str) + "\n"
+                if self.max_bytes and os.path.exists(self.path) and os.path.getsize(self.path) > self.max_bytes:
+                    os.replace(self.path, self.path + ".1")
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(line)
+            except Exception as e:
+                logger.error(f"Не удалось записать трассу: {e}")
+
+    def stop(self, timeout=5):
+        if self.thread is not None:
+            self.queue.put(None)
+            self.thread.join(timeout)
+            self.thread = None
+
+class Tracer:
+    """
+    Трассировка обновлений: экспортируются медленные (дольше slow_ms),
+    завершившиеся ошибкой и случайная доля sample_rate остальных
+    """
+    def __init__(self, exporter=None, enabled=TRACING_ENABLED, slow_ms=TRACE_SLOW_MS,
+                 sample_rate=TRACE_SAMPLE_RATE, max_spans=TRACE_MAX_SPANS):
+        self.exporter = exporter or JsonlExporter()
+        self.enabled = enabled
+        self.slow = slow_ms / 1000
+        self.sample_rate = sample_rate
+        self.max_spans = max_spans
+        self.stats = {"traces": 0, "exported": 0, "slow": 0}
+
+    def start(self, name, **attrs):
+        """Начинает трассу в текущем контексте, возвращает (трассу, токен)"""
+        if not self.enabled:
+            return None, None
+        trace = Trace(self, name, attrs)
+        self.stats["traces"] += 1
+        return trace, current_trace.set(trace)
+
+    def export(self, trace):
+        slow = trace.duration >= self.slow
+        self.stats["slow"] += slow
+        if slow or trace.error or random.random() < self.sample_rate:
+            self.stats["exported"] += 1
+            self.exporter.submit(trace.to_dict())
+
+    def get_stats(self):
+        return dict(self.stats, enabled=self.enabled, slow_ms=self.slow * 1000, path=self.exporter.path)
+
+# Глобальный трассировщик
+tracer = Tracer()
+
+def update_kind(update):
+    """Тип обновления для имени трассы: команда, сообщение или другой тип"""
+    message = update.message
+    if message is None:
+        return update.event_type
+    text = message.text or ""
+    if text.startswith("/"):
+        return text.split()[0].split("@")[0]
+    return "message"
+
+class TracingMiddleware(BaseMiddleware):
+    """Внешний middleware для dp.update: трасса на каждое обновление"""
+    def __init__(self, tracer=tracer):
+        self.tracer = tracer
+
+    async def __call__(self, handler, event, data):
+        message = event.message
+        trace, token = self.tracer.start(
+            f"update {update_kind(event)}", update_id=event.update_id,
+            chat_id=message.chat.id if message else None
+        )
+        if trace is None:
+            return await handler(event, data)
+        error = None
+        try:
+            return await handler(event, data)
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            current_trace.reset(token)
+            trace.finish(error)
+
+class BotApiTracingMiddleware(BaseRequestMiddleware):
+    """Middleware сессии aiogram: спан на каждый вызов Bot API"""
+    async def __call__(self, make_request, bot, method):
+        with span(f"telegram {method.__api_method__}"):
+            return await make_request(bot, method)
@@ -0,0 +1,305 @@
+"""
+Локальные заглушки Telegram Bot API и OpenAI-совместимого API (DeepSeek)
+для сквозных нагрузочных прогонов без сети и реальных ключей.
+
+Пример:
+    python -m benchmarks.fakes --telegram-port 8081 --ai-port 8082 \\
+        --update-rate 50 --latency 0.02 --ai-latency 0.5 --error-rate 0.01
+
+Бот направляется на заглушки переменными окружения:
+    TELEGRAM_API_URL=http://127.0.0.1:8081
+    DEEPSEEK_BASE_URL=http://127.0.0.1:8082/v1
+(TELEGRAM_TOKEN и DEEPSEEK_API_KEY могут быть любыми, например "123456:FAKE" и "fake")
+"""
+import json
+import time
+import random
+import asyncio
+import argparse
+import logging
+from aiohttp import web
+from benchmarks.load import UpdateFactory, DEFAULT_MIX
+from benchmarks.stubs import BOT_ID, BOT_USERNAME
+
+logger = logging.getLogger(__name__)
+
+BOT_USER = {"id": BOT_ID, "is_bot": True, "first_name": "Анатолий", "username": BOT_USERNAME}
+
+class FaultInjector:
+    """Задержка и случайные ошибки ответов"""
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, throttle_rate=0.0, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.random = random.Random(seed)
+
+    async def delay(self):
+        delay = self.latency + self.random.uniform(-self.jitter, self.jitter)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def fault(self):
+        """None, 'error' (5xx) или 'throttle' (429)"""
+        roll = self.random.random()
+        if roll < self.throttle_rate:
+            return "throttle"
+        if roll < self.throttle_rate + self.error_rate:
+            return "error"
+        return None
+
+class FakeTelegram:
+    """Минимальный Bot API: getMe, getUpdates, sendMessage, editMessageText, setMessageReaction"""
+    def __init__(self, faults, update_rate=0.0, target_user_id=1000, seed=42):
+        self.faults = faults
+        self.update_rate = update_rate
+        self.factory = UpdateFactory(200, DEFAULT_MIX, target_user_id, BOT_USERNAME, seed)
+        self.updates = []  # Ожидающие доставки обновления (dict)
+        self.new_updates = asyncio.Event()
+        self.message_id = 0
+        self.stats = {"calls": {}, "faults": 0, "generated": 0, "delivered": 0}
+        self.generator_task = None
+
+    def push_update(self, update):
+        self.updates.append(update)
+        self.new_updates.set()
+
+    async def _generate(self):
+        interval = 1 / self.update_rate
+        while True:
+            _, raw = self.factory.next()
+            self.push_update(json.loads(raw))
+            self.stats["generated"] += 1
+            await asyncio.sleep(interval)
+
+    def _ok(self, result):
+        return web.json_response({"ok": True, "result": result})
+
+    async def _params(self, request):
+        if request.content_type == "application/json":
+            return await request.json()
+        return dict(await request.post())
+
+    async def handle(self, request):
+        method = request.match_info["method"]
+        calls = self.stats["calls"]
+        calls[method] = calls.get(method, 0) + 1
+        params = await self._params(request)
+
+        if method == "getUpdates":
+            return await self.get_updates(params)
+
+        await self.faults.delay()
+        fault = self.faults.fault()
+        if fault:
+            self.stats["faults"] += 1
+            if fault == "throttle":
+                return web.json_response({
+                    "ok": False, "error_code": 429,
+                    "description": "Too Many Requests: retry after 1",
+                    "parameters": {"retry_after": 1}
+                }, status=429)
+            return web.json_response(
+                {"ok": False, "error_code": 502, "description": "Bad Gateway"}, status=502
+            )
+
+        if method == "getMe":
+            return self._ok(BOT_USER)
+        if method in ("sendMessage", "editMessageText"):
+            if method == "sendMessage":
+                self.message_id += 1
+            chat_id = params.get("chat_id")
+            return self._ok({
+                "message_id": int(params.get("message_id") or self.message_id),
+                "date": int(time.time()),
+                "chat": {"id": int(chat_id) if chat_id else 0, "type": "supergroup"},
+                "from": BOT_USER,
+                "text": params.get("text", ""),
+            })
+        # setMessageReaction, deleteWebhook и прочие методы
+        return self._ok(True)
+
+    async def get_updates(self, params):
+        offset = int(params.get("offset") or 0)
+        timeout = float(params.get("timeout") or 0)
+        limit = int(params.get("limit") or 100)
+
+        # Подтверждённые обновления удаляются, как в настоящем API
+        self.updates = [u for u in self.updates if u["update_id"] >= offset]
+        if not self.updates and timeout:
+            self.new_updates.clear()
+            try:
+                await asyncio.wait_for(self.new_updates.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        batch = self.updates[:limit]
+        self.stats["delivered"] += len(batch)
+        return self._ok(batch)
+
+    async def inject(self, request):
+        """POST /fake/updates - добавить обновления вручную"""
+        payload = await request.json()
+        for update in payload if isinstance(payload, list) else [payload]:
+            self.push_update(update)
+        return web.json_response({"queued": len(self.updates)})
+
+    async def get_stats(self, request):
+        return web.json_response(dict(self.stats, queued=len(self.updates)))
+
+    async def on_startup(self, app):
+        if self.update_rate > 0:
+            self.generator_task = asyncio.create_task(self._generate())
+
+    async def on_cleanup(self, app):
+        if self.generator_task:
+            self.generator_task.cancel()
+
+    def make_app(self):
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        app.router.add_get("/bot{token}/{method}", self.handle)
+        app.router.add_post("/fake/updates", self.inject)
+        app.router.add_get("/fake/stats", self.get_stats)
+        app.on_startup.append(self.on_startup)
+        app.on_cleanup.append(self.on_cleanup)
+        return app
+
+class FakeCompletions:
+    """OpenAI-совместимый /chat/completions с потоковыми и обычными ответами"""
+    def __init__(self, faults, reply_words=40, stream_chunk_delay=0.01):
+        self.faults = faults
+        self.reply_words = reply_words
+        self.stream_chunk_delay = stream_chunk_delay
+        self.stats = {"requests": 0, "streamed": 0, "faults": 0, "prompt_chars": 0}
+        self.counter = 0
+
+    def _reply(self, messages):
+        query = messages[-1]["content"] if messages else ""
+        words = ["ну", "шо", "вы", "тут", "опять", "устроили", "ребята", "понимаете"]
+        return f"Ответ на «{query[:40]}»: " + " ".join(
+            self.faults.random.choice(words) for _ in range(self.reply_words)
+        )
+
+    async def handle(self, request):
+        body = await request.json()
+        self.stats["requests"] += 1
+        messages = body.get("messages", [])
+        prompt_chars = sum(len(m.get("content") or "") for m in messages)
+        self.stats["prompt_chars"] += prompt_chars
+
+        await self.faults.delay()
+        fault = self.faults.fault()
+        if fault:
+            self.stats["faults"] += 1
+            status = 429 if fault == "throttle" else 500
+            return web.json_response(
+                {"error": {"message": "Injected fault", "type": "server_error", "code": status}},
+                status=status
+            )
+
+        self.counter += 1
+        completion_id = f"chatcmpl-fake-{self.counter}"
+        model = body.get("model", "deepseek-chat")
+        text = self._reply(messages)
+        usage = {
+            "prompt_tokens": prompt_chars // 4,
+            "completion_tokens": len(text) // 4,
+            "total_tokens": (prompt_chars + len(text)) // 4
+        }
+
+        if not body.get("stream"):
+            return web.json_response({
+                "id": completion_id, "object": "chat.completion",
+                "created": int(time.time()), "model": model,
+                "choices": [{
+                    "index": 0, "finish_reason": "stop",
+                    "message": {"role": "assistant", "content": text}
+                }],
+                "usage": usage
+            })
+
+        self.stats["streamed"] += 1
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        pieces = text.split(" ")
+        for i, piece in enumerate(pieces):
+            chunk = {
+                "id": completion_id, "object": "chat.completion.chunk",
+                "created": int(time.time()), "model": model,
+                "choices": [{
+                    "index": 0, "finish_reason": None,
+                    "delta": {"role": "assistant", "content": piece if i == 0 else " " + piece}
+                }]
+            }
+            await response.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode())
+            if self.stream_chunk_delay:
+                await asyncio.sleep(self.stream_chunk_delay)
+        final = {
+            "id": completion_id, "object": "chat.completion.chunk",
+            "created": int(time.time()), "model": model,
+            "choices": [{"index": 0, "finish_reason": "stop", "delta": {}}],
+            "usage": usage
+        }
+        await response.write(f"data: {json.dumps(final)}\n\ndata: [DONE]\n\n".encode())
+        await response.write_eof()
+        return response
+
+    async def get_stats(self, request):
+        return web.json_response(self.stats)
+
+    def make_app(self):
+        app = web.Application()
+        app.router.add_post("/chat/completions", self.handle)
+        app.router.add_post("/v1/chat/completions", self.handle)
+        app.router.add_get("/fake/stats", self.get_stats)
+        return app
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Заглушки Telegram Bot API и DeepSeek")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--telegram-port", type=int, default=8081)
+    parser.add_argument("--ai-port", type=int, default=8082)
+    parser.add_argument("--update-rate", type=float, default=0.0,
+                        help="Синтетических обновлений в секунду (0 - только /fake/updates)")
+    parser.add_argument("--target-user-id", type=int, default=1000)
+    parser.add_argument("--latency", type=float, default=0.02, help="Задержка Bot API, с")
+    parser.add_argument("--ai-latency", type=float, default=0.5, help="Задержка до первого токена AI, с")
+    parser.add_argument("--jitter", type=float, default=0.2, help="Разброс задержек (доля от среднего)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Доля ответов 5xx")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Доля ответов 429")
+    parser.add_argument("--seed", type=int, default=42)
+    return parser.parse_args(argv)
+
+async def serve(args):
+    telegram = FakeTelegram(
+        FaultInjector(args.latency, args.latency * args.jitter, args.error_rate, args.throttle_rate, args.seed),
+        update_rate=args.update_rate, target_user_id=args.target_user_id, seed=args.seed
+    )
+    completions = FakeCompletions(
+        FaultInjector(args.ai_latency, args.ai_latency * args.jitter, args.error_rate, args.throttle_rate, args.seed)
+    )
+    runners = []
+    for app, port in ((telegram.make_app(), args.telegram_port), (completions.make_app(), args.ai_port)):
+        runner = web.AppRunner(app)
+        await runner.setup()
+        await web.TCPSite(runner, args.host, port).start()
+        runners.append(runner)
+    logger.info(
+        f"Заглушка Bot API: http://{args.host}:{args.telegram_port}, "
+        f"заглушка DeepSeek: http://{args.host}:{args.ai_port}/v1"
+    )
+    try:
+        await asyncio.Event().wait()
+    finally:
+        for runner in runners:
+            await runner.cleanup()
+
+def main(argv=None):
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    try:
+        asyncio.run(serve(parse_args(argv)))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+import time
+import asyncio
+import random
+from types import SimpleNamespace
+from aiogram.client.session.base import BaseSession
+
+BOT_ID = 987654321
+BOT_USERNAME = "mranatoly_bot"
+
+class LatencyStub:
+    """Задержка заглушки: среднее значение и случайный разброс (секунды)"""
+    def __init__(self, mean=0.0, jitter=0.0):
+        self.mean = mean
+        self.jitter = jitter
+        self.calls = 0
+
+    async def wait(self):
+        self.calls += 1
+        delay = self.mean + random.uniform(-self.jitter, self.jitter) if self.jitter else self.mean
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+class StubSession(BaseSession):
+    """
+    Сессия Bot API без сети: ответы формируются локально, сериализуются в JSON
+    и проходят обычную проверку/десериализацию aiogram
+    """
+    def __init__(self, latency=None, **kwargs):
+        super().__init__(**kwargs)
+        self.latency = latency or LatencyStub()
+        self.message_id = 0
+        self.calls = {}
+
+    def _result(self, method):
+        name = type(method).__name__
+        self.calls[name] = self.calls.get(name, 0) + 1
+        if name == "GetMe":
+            return {"id": BOT_ID, "is_bot": True, "first_name": "Анатолий", "username": BOT_USERNAME}
+        if name in ("SendMessage", "EditMessageText"):
+            self.message_id += 1
+            return {
+                "message_id": getattr(method, "message_id", None) or self.message_id,
+                "date": int(time.time()),
+                "chat": {"id": method.chat_id, "type": "supergroup"},
+                "from": {"id": BOT_ID, "is_bot": True, "first_name": "Анатолий", "username": BOT_USERNAME},
+                "text": method.text,
+            }
+        return True
+
+    async def make_request(self, bot, method, timeout=None):
+        await self.latency.wait()
+        content = self.json_dumps({"ok": True, "result": self._result(method)})
+        response = self.check_response(bot=bot, method=method, status_code=200, content=content)
+        return response.result
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        yield b""
+
+    async def close(self):
+        pass
+
+def make_ai_stub(latency):
+    """Заглушка chat.completions.create клиента OpenAI"""
+    async def create(model=None, messages=None, **kwargs):
+        await latency.wait()
+        content = f"Ответ на: {messages[-1]['content'][:50]}"
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content=content))],
+            usage=SimpleNamespace(prompt_tokens=sum(len(m["content"]) for m in messages) // 4, completion_tokens=10)
+        )
+    return create
+
+# Канонические ответы внешних HTTP API
+HTTP_RESPONSES = {
+    "openweathermap.org/data/2.5/weather": {
+        "id": 625144, "main": {"temp": 5.0}, "weather": [{"description": "ясно"}]
+    },
+    "openweathermap.org/data/2.5/group": {"list": []},
+    "currency-api": {"usd": {"byn": 3.2, "rub": 90.0}},
+    "coingecko.com": {"bitcoin": {"usd": 60000}, "worldcoin": {"usd": 2.5}},
+    "fixtures/events": {"response": [
+        {"type": "Goal", "detail": "Normal Goal", "time": {"elapsed": 10, "extra": None},
+         "team": {"id": 541, "name": "Real Madrid"}, "player": {"id": 1, "name": "Vinicius"}}
+    ]},
+    "v3/fixtures": {"response": [
+        {
+            "fixture": {"id": 1000 + i, "date": "2024-01-01T20:00:00+00:00", "timestamp": 1704139200,
+                        "status": {"short": "FT"}},
+            "teams": {"home": {"id": 541, "name": "Real Madrid"}, "away": {"id": 40, "name": "Liverpool"}},
+            "goals": {"home": 1, "away": 0},
+        }
+        for i in range(5)
+    ]},
+}
+
+def make_http_stub(latency):
+    """Заглушка ApiGateway.request: отвечает каноническими данными по URL"""
+    async def request(method, url, headers=None, params=None, data=None, cache_key=None, cache_ttl=300, **kwargs):
+        await latency.wait()
+        for pattern, payload in HTTP_RESPONSES.items():
+            if pattern in url:
+                return payload
+        return {}
+    return request
@@ -0,0 +1,14 @@
+from app.services.ai import format_memory
+
+def test_format_memory_is_compact_and_chronological():
+    memory = [
+        {"role": "assistant", "content": "Салах   опять\nзабил", "timestamp": 1700100000.0},
+        {"role": "user", "content": "х" * 500, "timestamp": 1600000000.0},
+    ]
+    message = format_memory(memory, snippet_chars=50)
+
+    assert message["role"] == "system"
+    lines = message["content"].split("\n")
+    assert lines[1].startswith("[2020-09-13] участник: ")
+    assert len(lines[1].split(": ", 1)[1]) == 50
+    assert lines[2].endswith("ты: Салах опять забил")
@@ -0,0 +1,54 @@
+import asyncio
+import pytest
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, MagicMock
+from app.services.ai_router import AiProvider, AiRouter, AiUnavailableError
+
+def make_provider(name, create, **kwargs):
+    client = MagicMock()
+    client.chat.completions.create = create
+    return AiProvider(name, "http://ai.local/v1", "key", f"{name}-model", client=client, **kwargs)
+
+def reply(content):
+    return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+@pytest.mark.asyncio
+async def test_routes_to_provider_with_lowest_ewma():
+    fast = make_provider("fast", AsyncMock(return_value=reply("быстрый")))
+    slow = make_provider("slow", AsyncMock(return_value=reply("медленный")))
+    fast.ewma, slow.ewma = 0.5, 2.0
+    router = AiRouter([slow, fast], explore_rate=0)
+
+    assert await router.complete([{"role": "user", "content": "привет"}], 999, 1.0) == "быстрый"
+    slow.client.chat.completions.create.assert_not_awaited()
+    # Приоритет добавляет к ожидаемой задержке штраф: резервный провайдер выбирается, только если основной деградировал
+    slow.priority, fast.priority = 0, 1
+    assert router.order()[0] is slow
+
+@pytest.mark.asyncio
+async def test_fails_over_on_timeout_and_cools_down_provider():
+    async def hang(**kwargs):
+        await asyncio.sleep(10)
+
+    primary = make_provider("primary", hang, timeout=0.01)
+    backup = make_provider("backup", AsyncMock(return_value=reply("резерв")), max_tokens=100)
+    backup.ewma = 1.0
+    router = AiRouter([primary, backup], explore_rate=0)
+
+    assert await router.complete([{"role": "user", "content": "?"}], 999, 1.0) == "резерв"
+    assert backup.client.chat.completions.create.call_args.kwargs["max_tokens"] == 100
+    stats = router.get_stats()
+    assert stats["primary"]["timeouts"] == 1 and stats["primary"]["cooldown_s"] > 0
+    assert stats["backup"]["fallbacks"] == 1
+    # Пока основной исключён, запросы сразу идут к резервному
+    assert router.order()[0] is backup
+
+@pytest.mark.asyncio
+async def test_raises_when_all_providers_fail():
+    provider = make_provider("only", AsyncMock(side_effect=RuntimeError("500")))
+    router = AiRouter([provider], max_attempts=3)
+
+    with pytest.raises(AiUnavailableError):
+        await router.complete([{"role": "user", "content": "?"}], 999, 1.0)
+    assert provider.client.chat.completions.create.await_count == 3
+    assert provider.get_stats()["errors"] == 3
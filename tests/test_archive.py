@@ -0,0 +1,55 @@
+import os
+import json
+import pytest
+from unittest.mock import AsyncMock, MagicMock
+from app.database.archive import (
+    ARCHIVE_COLUMNS, GzipShardWriter, ChatArchive, retention_cutoff, shard_path
+)
+
+def test_retention_cutoff_is_day_aligned():
+    now = 1_700_000_000.5
+    cutoff = retention_cutoff(30, now=now)
+    assert cutoff % 86400 == 0
+    assert now - 31 * 86400 < cutoff <= now - 30 * 86400
+
+def test_shard_path():
+    path = shard_path("/archive", 19723)  # 2024-01-01
+    assert path == os.path.join(
+        "/archive", "chat_history", "2024", "01", "chat_history_20240101.ndjson.gz"
+    )
+
+@pytest.mark.asyncio
+async def test_shard_round_trip(tmp_path):
+    rows = [
+        dict(zip(ARCHIVE_COLUMNS, [1, -100, 42, 7, "user", "привет\nмир", 1704067200.0, 0, 0])),
+        dict(zip(ARCHIVE_COLUMNS, [2, -100, 1, 8, "assistant", "ответ", 1704067201.0, 0, 0])),
+    ]
+    writer = GzipShardWriter(str(tmp_path / "shard.ndjson.gz"))
+    for row in rows:
+        await writer.write(json.dumps(row, ensure_ascii=False).encode() + b"\n")
+    await writer.close()
+
+    records = ChatArchive._read_shard(writer.path)
+
+    assert writer.rows == 2
+    assert records == [tuple(row[c] for c in ARCHIVE_COLUMNS) for row in rows]
+
+@pytest.mark.asyncio
+async def test_restore_skips_activity_rollup(tmp_path):
+    row = dict(zip(ARCHIVE_COLUMNS, [1, -100, 42, 7, "user", "привет", 1704067200.0, 0, 0]))
+    writer = GzipShardWriter(str(tmp_path / "shard.ndjson.gz"))
+    await writer.write(json.dumps(row, ensure_ascii=False).encode() + b"\n")
+    await writer.close()
+    pool = MagicMock()
+    conn = AsyncMock()
+    conn.transaction = MagicMock()
+    conn.execute.return_value = "INSERT 0 1"
+    pool.acquire.return_value.__aenter__.return_value = conn
+
+    assert await ChatArchive.restore_archive(pool, writer.path) == 1
+
+    statements = [call.args[0] for call in conn.execute.call_args_list]
+    # Строки уже учтены в chat_activity при первой вставке: триггер агрегатов отключён
+    assert statements[0] == "SET LOCAL app.skip_activity_rollup = 'on'"
+    assert "INSERT INTO chat_history" in statements[-1]
+    conn.transaction.assert_called_once()
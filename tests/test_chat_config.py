@@ -0,0 +1,68 @@
+import asyncio
+import pytest
+from unittest.mock import AsyncMock, patch
+from app.config import TARGET_USER_ID
+from app.services.chat_config import ChatConfigRegistry
+
+def make_row(chat_id, **overrides):
+    row = {
+        "chat_id": chat_id, "history_enabled": True, "ai_enabled": True,
+        "reaction_user_ids": [7], "reaction_emoji": None, "history_limit": None, "ai_rate_limit": 0
+    }
+    row.update(overrides)
+    return row
+
+@pytest.mark.asyncio
+async def test_registry_serves_from_memory_and_reloads_on_notify():
+    registry = ChatConfigRegistry()
+    registry.pool = AsyncMock()
+
+    with patch("app.services.chat_config.ChatConfigs") as configs:
+        configs.get_all = AsyncMock(return_value=[make_row(1), make_row(2, ai_enabled=False)])
+        await registry.load(registry.pool)
+
+        # Чтение настроек не обращается к БД
+        assert registry.get(1).reaction_user_ids == frozenset({7})
+        assert registry.get(1).history_limit == 30
+        assert not registry.get(2).ai_enabled
+        assert not registry.get(3).history_enabled  # Чат без настроек
+        assert registry.get(3).reaction_user_ids == frozenset({TARGET_USER_ID})
+        configs.get_all.assert_awaited_once()
+
+        # Уведомление NOTIFY перечитывает только изменённый чат
+        configs.get = AsyncMock(side_effect=[make_row(1, history_enabled=False), None])
+        registry._on_notify(None, 0, "chat_config", "1")
+        registry._on_notify(None, 0, "chat_config", "2")
+        await asyncio.sleep(0)
+
+    assert not registry.get(1).history_enabled
+    assert 2 not in registry.configs
+    assert registry.get_stats() == {"full_reloads": 1, "notifications": 2, "reconnects": 0, "chats": 1}
+
+@pytest.mark.asyncio
+async def test_notifications_during_reload_are_coalesced_and_applied_in_order():
+    registry = ChatConfigRegistry()
+    registry.pool = AsyncMock()
+    release = asyncio.Event()
+    rows = [make_row(1, ai_enabled=False), make_row(1, ai_enabled=True)]
+
+    async def get(pool, chat_id):
+        row = rows.pop(0)
+        if rows:
+            await release.wait()  # Первое (устаревшее) чтение выполняется долго
+        return row
+
+    with patch("app.services.chat_config.ChatConfigs") as configs:
+        configs.get = get
+        registry._on_notify(None, 0, "chat_config", "1")
+        await asyncio.sleep(0)
+        # Изменения во время чтения
+        registry._on_notify(None, 0, "chat_config", "1")
+        registry._on_notify(None, 0, "chat_config", "1")
+        release.set()
+        await registry.reloads[1]
+
+    # Три уведомления - два последовательных чтения, в памяти последнее состояние
+    assert rows == []
+    assert registry.get(1).ai_enabled
+    assert registry.reloads == {} and registry.pending == set()
@@ -2,7 +2,11 @@ import pytest
 import asyncio
 from unittest.mock import AsyncMock, MagicMock, patch
 from aiogram.types import Message, User, Chat
-from app.handlers.commands import CommandHandlers
+from app.handlers.commands import CommandHandlers, parse_search_args, parse_top_days
+from app.handlers.messages import MessageHandlers
+from app.config import TARGET_CHAT_ID, CODE_VERSION
+from app.services.chat_config import chat_registry, default_config
+from app.services.health import HealthMonitor
 
 @pytest.fixture
 def message_mock():
@@ -55,13 +59,142 @@ async def test_command_version(message_mock, bot_mock, db_pool_mock):
     assert "Версия бота:" in message_mock.reply.call_args[0][0]
 
 @pytest.mark.asyncio
-async def test_check_database_health(bot_mock, db_pool_mock):
+async def test_handle_message_runs_stages_concurrently(message_mock, bot_mock, db_pool_mock, monkeypatch):
+    # Подготовка: в чате ведётся история, сохранение в БД медленное, запрос к AI адресован боту
+    events = []
+    monkeypatch.setitem(
+        chat_registry.configs, TARGET_CHAT_ID, default_config(TARGET_CHAT_ID)._replace(history_enabled=True)
+    )
+    bot_mock.get_me.return_value = MagicMock(id=bot_mock.id, username="AnatolyBot")
+    message_mock.chat.id = TARGET_CHAT_ID
+    message_mock.message_id = 42
+    message_mock.text = "@anatolybot как дела?"
+    message_mock.reply_to_message = None
+    message_mock.reply = AsyncMock(return_value=MagicMock(message_id=43))
+    handlers = MessageHandlers(bot_mock, db_pool_mock)
+    handlers.summarizer = MagicMock(drain=AsyncMock())
+
+    async def slow_save(pool, chat_id, user_id, message_id, role, content):
+        await asyncio.sleep(0.05)
+        events.append(("saved", role))
+        return True
+
+    async def get_history(pool, chat_id, limit=30, exclude_message_id=None, after_summary=False):
+        events.append(("history", exclude_message_id))
+        return []
+
+    memory = [{"role": "user", "content": "Салах забил", "timestamp": 1700000000.0}]
+
+    with patch("app.handlers.messages.ChatHistory") as history, \
+            patch("app.handlers.messages.ChatSummaries") as summaries, \
+            patch("app.handlers.messages.AiHandler") as ai:
+        summaries.get_current = AsyncMock(return_value="Обсуждали Салаха")
+        history.save_message = AsyncMock(side_effect=slow_save)
+        history.get_chat_history = AsyncMock(side_effect=get_history)
+        history.get_relevant_messages = AsyncMock(return_value=memory)
+        ai.get_ai_response = AsyncMock(return_value="Нормально")
+
+        # Действие
+        await handlers.handle_message(message_mock)
+        events.append(("replied", None))
+        await handlers.drain()
+
+    # Проверка: ответ не ждал сохранения, текущее сообщение исключено из истории,
+    # ответ бота сохранён после сообщения пользователя
+    message_mock.reply.assert_called_once_with("Нормально")
+    ai.get_ai_response.assert_awaited_once_with([], "как дела?", memory, "Обсуждали Салаха")
+    assert history.get_chat_history.call_args.kwargs["after_summary"] is True
+    handlers.summarizer.schedule.assert_called_once_with(TARGET_CHAT_ID)
+    assert history.get_relevant_messages.call_args.args[2] == "как дела?"
+    assert events == [("history", 42), ("replied", None), ("saved", "user"), ("saved", "assistant")]
+    assert not handlers.background_tasks
+
+def test_parse_search_args():
+    assert parse_search_args("/search Салах гол") == (1, "Салах гол")
+    assert parse_search_args("/search 3 Салах гол") == (3, "Салах гол")
+    assert parse_search_args("/search 2024") == (1, "2024")
+    assert parse_search_args("/search") == (1, "")
+
+@pytest.mark.asyncio
+async def test_command_search_paginates(message_mock, bot_mock, db_pool_mock):
     # Подготовка
+    message_mock.text = "/search 2 Салах"
+    message_mock.reply = AsyncMock(return_value=MagicMock(message_id=1))
     command_handlers = CommandHandlers(bot_mock, db_pool_mock)
-    
-    # Действие
-    result = await command_handlers.check_database_health()
-    
-    # Проверка
-    assert result is True
-    db_pool_mock.acquire.assert_called_once()
\ No newline at end of file
+    results = [{"user_id": 5, "role": "user", "timestamp": 1700000000.0, "snippet": "«Салах» забил"}]
+
+    with patch("app.handlers.commands.ChatHistory") as history:
+        history.search = AsyncMock(return_value=(12, results))
+        # Действие
+        await command_handlers.command_search(message_mock)
+
+    # Проверка: вторая страница по 5 результатов, поиск в пределах чата
+    history.search.assert_awaited_once_with(db_pool_mock, message_mock.chat.id, "Салах", limit=5, offset=5)
+    response = message_mock.reply.call_args[0][0]
+    assert "стр. 2/3" in response
+    assert "6. 15.11.2023 01:13, id5: «Салах» забил" in response
+    assert "/search 3 Салах" in response
+
+def test_parse_top_days():
+    assert parse_top_days("/top") == 7
+    assert parse_top_days("/top 30") == 30
+    assert parse_top_days("/top@mranatoly_bot 0") == 1
+    assert parse_top_days("/top 100000") == 365
+
+@pytest.mark.asyncio
+async def test_command_top_reads_rollup(message_mock, bot_mock, db_pool_mock):
+    # Подготовка
+    message_mock.text = "/top 30"
+    message_mock.reply = AsyncMock(return_value=MagicMock(message_id=1))
+    bot_mock.get_chat_member = AsyncMock(side_effect=[MagicMock(user=MagicMock(full_name="Анатолий")), Exception("нет")])
+    rows = [
+        {"user_id": 5, "messages": 120, "chars": 5400, "active_days": 20},
+        {"user_id": 6, "messages": 7, "chars": 90, "active_days": 2},
+    ]
+
+    with patch("app.handlers.commands.ChatActivity") as activity:
+        activity.get_top = AsyncMock(return_value=rows)
+        # Действие
+        await CommandHandlers(bot_mock, db_pool_mock).command_top(message_mock)
+
+    # Проверка: запрос только к агрегатам, имя недоступного участника заменено на id
+    activity.get_top.assert_awaited_once_with(db_pool_mock, message_mock.chat.id, 30, 10)
+    response = message_mock.reply.call_args[0][0]
+    assert "1. Анатолий: 120 сообщ., 5400 симв., дней: 20" in response
+    assert "2. id6: 7 сообщ." in response
+
+@pytest.mark.asyncio
+async def test_command_test_uses_cached_results(message_mock, bot_mock, db_pool_mock):
+    monitor = HealthMonitor()
+    monitor.add("postgres", AsyncMock(), critical=True)
+    monitor.add("openweather", AsyncMock(side_effect=RuntimeError("401")))
+    await monitor.run_all()
+    message_mock.reply = AsyncMock(return_value=MagicMock(message_id=1))
+
+    with patch("app.handlers.commands.health_monitor", monitor):
+        await CommandHandlers(bot_mock, db_pool_mock).command_test(message_mock)
+
+    response = message_mock.reply.call_args[0][0]
+    assert "База данных: Работает ✅" in response
+    assert "API погоды: Ошибка ❌ (RuntimeError: 401)" in response
+    db_pool_mock.acquire.assert_not_called()
+
+@pytest.mark.asyncio
+async def test_command_stats_fits_in_one_message(message_mock, bot_mock, db_pool_mock):
+    memory = {
+        "enabled": False, "top_sites": [],
+        "breakdown": {f"probe.{i}": (i, i * 1024) for i in range(500)}
+    }
+    message_mock.reply = AsyncMock(return_value=MagicMock(message_id=1))
+
+    with patch("app.handlers.commands.memory_profiler") as profiler, \
+            patch("app.handlers.commands.ChatActivity") as activity:
+        profiler.get_stats.return_value = memory
+        activity.get_summary = AsyncMock(return_value=None)
+        await CommandHandlers(bot_mock, db_pool_mock).command_stats(message_mock)
+
+    response = message_mock.reply.call_args[0][0]
+    # Показываются только самые большие структуры, ответ не превышает лимит Telegram
+    assert "probe.499" in response and "probe.0:" not in response
+    assert len(response) <= 4000
+    assert response.endswith(f"Версия бота: {CODE_VERSION}")
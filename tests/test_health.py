@@ -0,0 +1,50 @@
+import asyncio
+import json
+import pytest
+from unittest.mock import AsyncMock, MagicMock, patch
+from app.services.health import HealthMonitor
+
+async def hang():
+    await asyncio.sleep(10)
+
+@pytest.mark.asyncio
+async def test_probe_failures_and_timeouts_are_cached():
+    monitor = HealthMonitor()
+    monitor.add("postgres", AsyncMock(side_effect=[None, OSError("connection refused")]), critical=True)
+    monitor.add("coingecko", hang, timeout=0.01)
+
+    with patch("app.services.health.monitoring") as monitoring:
+        monitoring.notify_admin = AsyncMock()
+        await monitor.run_all()
+        await monitor.run_probe("postgres")
+
+    snapshot = monitor.snapshot()
+    assert snapshot["postgres"]["ok"] is False
+    assert snapshot["postgres"]["error"] == "OSError: connection refused"
+    assert snapshot["coingecko"]["error"] == "таймаут 0.01 с"
+    # Администратору сообщается только о смене состояния критичной зависимости
+    monitoring.notify_admin.assert_awaited_once()
+
+@pytest.mark.asyncio
+async def test_readiness_requires_critical_probes_and_started_bot():
+    monitor = HealthMonitor()
+    monitor.add("postgres", AsyncMock(), critical=True)
+    monitor.add("openweather", AsyncMock(side_effect=RuntimeError("502")))
+    monitor.start()
+    try:
+        await monitor.run_all()
+        # Недоступный некритичный API не влияет на готовность, остановка - влияет
+        assert monitor.is_live() and not monitor.is_ready()
+        monitor.ready = True
+        response = await monitor.handle_ready(MagicMock())
+        assert response.status == 200
+        assert json.loads(response.text)["probes"]["openweather"]["ok"] is False
+
+        monitor.probes["postgres"]["check"] = AsyncMock(side_effect=OSError("down"))
+        with patch("app.services.health.monitoring", MagicMock(notify_admin=AsyncMock())):
+            await monitor.run_probe("postgres")
+        assert (await monitor.handle_ready(MagicMock())).status == 503
+        assert (await monitor.handle_live(MagicMock())).status == 200
+    finally:
+        await monitor.stop()
+    assert not monitor.is_live()
@@ -0,0 +1,81 @@
+import asyncio
+import pytest
+from datetime import datetime, timedelta, timezone
+from unittest.mock import AsyncMock, MagicMock, patch
+from apscheduler.triggers.cron import CronTrigger
+from app.services.jobs import JobRunner
+
+def make_runner():
+    return JobRunner(MagicMock(), AsyncMock(), owner="test:1")
+
+@pytest.mark.asyncio
+async def test_overlapping_run_is_skipped():
+    runner = make_runner()
+    started = asyncio.Event()
+    release = asyncio.Event()
+
+    async def slow_job():
+        started.set()
+        await release.wait()
+
+    runner.add("slow", slow_job, trigger=CronTrigger(minute='*'), shared=False, persist=False)
+    first = asyncio.create_task(runner.run("slow"))
+    await started.wait()
+    # Пока первый запуск не закончился, второй пропускается
+    await runner.run("slow")
+    release.set()
+    await first
+
+    stats = runner.stats["slow"]
+    assert (stats["runs"], stats["skipped"], stats["last_status"]) == (1, 1, "ok")
+    assert runner.scheduler.add_job.call_args.kwargs["max_instances"] == 1
+
+@pytest.mark.asyncio
+async def test_lease_held_by_other_instance_skips_run():
+    runner = make_runner()
+    func = AsyncMock()
+    runner.add("retention", func, trigger=CronTrigger(hour=0))
+
+    with patch("app.services.jobs.JobStore") as store:
+        store.acquire_lease = AsyncMock(return_value=False)
+        store.finish = AsyncMock()
+        await runner.run("retention")
+
+    func.assert_not_awaited()
+    store.finish.assert_not_awaited()
+    assert runner.stats["retention"]["skipped"] == 1
+
+@pytest.mark.asyncio
+async def test_failure_is_recorded():
+    runner = make_runner()
+    runner.add("backup", AsyncMock(side_effect=RuntimeError("диск заполнен")),
+               trigger=CronTrigger(hour=3), args=("postgresql://db",))
+
+    with patch("app.services.jobs.JobStore") as store, \
+            patch("app.services.jobs.monitoring") as monitoring:
+        store.acquire_lease = AsyncMock(return_value=True)
+        store.finish = AsyncMock()
+        await runner.run("backup", reason="manual")
+
+    args = store.finish.call_args.args
+    assert args[1:4] == ("backup", "test:1", "manual")
+    assert args[6:] == ("error", "RuntimeError: диск заполнен")
+    monitoring.log_error.assert_called_once()
+    assert runner.stats["backup"]["failures"] == 1
+    assert "backup" not in runner.running
+
+@pytest.mark.asyncio
+async def test_catch_up_schedules_missed_run_once():
+    runner = make_runner()
+    runner.add("retention", AsyncMock(), trigger=CronTrigger(hour=0, minute=0, timezone="UTC"), catch_up=True)
+    runner.add("backup", AsyncMock(), trigger=CronTrigger(hour=3, minute=0, timezone="UTC"), catch_up=True)
+    now = datetime.now(timezone.utc)
+    states = {"retention": now - timedelta(days=2), "backup": now}
+
+    with patch("app.services.jobs.JobStore") as store:
+        store.get_states = AsyncMock(return_value=states)
+        await runner.catch_up()
+
+    # Последний backup только что выполнен, запуск retention - пропущен
+    catch_up_calls = [c for c in runner.scheduler.add_job.call_args_list if c.kwargs.get("trigger") == "date"]
+    assert [c.kwargs["args"] for c in catch_up_calls] == [["retention", "catch_up"]]
@@ -0,0 +1,58 @@
+import asyncio
+import pytest
+from unittest.mock import AsyncMock, MagicMock, patch
+from apscheduler.triggers.cron import CronTrigger
+from app.services.jobs import JobRunner
+from app.services.lifecycle import UpdateTracker, PollingLease
+
+@pytest.mark.asyncio
+async def test_update_tracker_waits_for_inflight_handlers_and_confirms_offset():
+    tracker = UpdateTracker()
+    release = asyncio.Event()
+
+    async def handler(event, data):
+        await release.wait()
+
+    tasks = [asyncio.create_task(tracker(handler, MagicMock(update_id=update_id), {})) for update_id in (41, 42)]
+    await asyncio.sleep(0)
+    assert tracker.inflight == 2
+    assert await tracker.wait_idle(0.01) is False
+
+    release.set()
+    assert await tracker.wait_idle(1) is True
+    await asyncio.gather(*tasks)
+
+    # Следующий экземпляр не получит уже обработанные обновления повторно
+    bot = MagicMock(get_updates=AsyncMock())
+    await tracker.confirm(bot, ["message"])
+    bot.get_updates.assert_awaited_once_with(offset=43, limit=1, timeout=0, allowed_updates=["message"])
+
+@pytest.mark.asyncio
+async def test_polling_lease_waits_for_previous_instance():
+    conn = MagicMock(fetchval=AsyncMock(side_effect=[False, False, True]), close=AsyncMock())
+    conn.is_closed.return_value = False
+    lease = PollingLease("postgresql://db", key=7)
+
+    with patch("app.services.lifecycle.asyncpg.connect", AsyncMock(return_value=conn)), \
+            patch("app.services.lifecycle.LEASE_RETRY_INTERVAL", 0):
+        await lease.acquire()
+        assert conn.fetchval.await_count == 3
+        await lease.release()
+
+    conn.close.assert_awaited_once()
+    assert lease.conn is None
+
+@pytest.mark.asyncio
+async def test_job_runner_drain_cancels_jobs_waiting_for_jitter():
+    runner = JobRunner(MagicMock(), AsyncMock(), owner="test:1")
+    func = AsyncMock()
+    runner.add("retention", func, trigger=CronTrigger(hour=0), heavy=True, shared=False, persist=False)
+
+    with patch("app.services.jobs.MAINTENANCE_JITTER", 600):
+        task = asyncio.create_task(runner.run("retention"))
+        await asyncio.sleep(0)
+        await runner.drain(timeout=1)
+
+    assert task.cancelled()
+    func.assert_not_awaited()
+    assert runner.running == {}
@@ -0,0 +1,28 @@
+import json
+import logging
+from app.log import JsonFormatter, SamplingFilter, parse_sample_rates
+
+def make_record(name, level=logging.INFO, msg="Сообщение %s", args=(1,), **extra):
+    record = logging.LogRecord(name, level, __file__, 1, msg, args, None)
+    record.__dict__.update(extra)
+    return record
+
+def test_parse_sample_rates():
+    assert parse_sample_rates("a.b:0.1, c:1") == {"a.b": 0.1, "c": 1.0}
+
+def test_sampling_keeps_every_nth_info_record():
+    sampler = SamplingFilter({"app.handlers": 0.1})
+    kept = [sampler.filter(make_record("app.handlers.messages")) for _ in range(100)]
+    assert sum(kept) == 10
+
+    # Предупреждения и другие логгеры не сэмплируются
+    assert all(sampler.filter(make_record("app.handlers.messages", logging.WARNING)) for _ in range(10))
+    assert all(sampler.filter(make_record("app.bot")) for _ in range(10))
+
+def test_json_formatter_includes_extra_fields():
+    record = make_record("app.handlers.messages", chat_id=-100, sampled=10)
+    entry = json.loads(JsonFormatter().format(record))
+    assert entry["msg"] == "Сообщение 1"
+    assert entry["level"] == "INFO"
+    assert entry["chat_id"] == -100
+    assert entry["sampled"] == 10
@@ -0,0 +1,34 @@
+import time
+import asyncio
+import pytest
+from app.services.loop_monitor import LoopLagMonitor
+
+def block_event_loop(seconds):
+    time.sleep(seconds)
+
+@pytest.mark.asyncio
+async def test_detects_blocking_call():
+    monitor = LoopLagMonitor(interval=0.02, threshold_ms=50, debug_window=1)
+    monitor.start()
+    try:
+        await asyncio.sleep(0.1)
+        block_event_loop(0.3)
+        await asyncio.sleep(0.1)
+    finally:
+        await monitor.stop()
+
+    stats = monitor.get_stats()
+    assert stats["max_ms"] >= 250
+    assert stats["blocking_events"] >= 1
+    assert "block_event_loop" in monitor.blocking_events[-1]["stack"]
+    assert sum(stats["histogram"].values()) == len(monitor.samples)
+
+def test_histogram_buckets():
+    monitor = LoopLagMonitor()
+    for lag in (0.0005, 0.003, 0.2, 5.0):
+        monitor.record(lag)
+    stats = monitor.get_stats()
+    assert stats["histogram"]["<=1"] == 1
+    assert stats["histogram"]["<=5"] == 1
+    assert stats["histogram"]["<=250"] == 1
+    assert stats["histogram"][">2500"] == 1
@@ -0,0 +1,25 @@
+import pytest
+from unittest.mock import AsyncMock, patch
+from app.services.market import MarketDataService
+
+@pytest.mark.asyncio
+async def test_refresh_keeps_last_good_values():
+    service = MarketDataService()
+
+    with patch("app.services.market.ApiClient") as api:
+        api.get_currency_rates = AsyncMock(return_value=(3.2, 90.0))
+        api.get_crypto_prices = AsyncMock(return_value=(60000, 2.5))
+        first = await service.refresh()
+
+        # Валюты не обновились, криптовалюты обновились
+        api.get_currency_rates = AsyncMock(return_value=(0, 0))
+        api.get_crypto_prices = AsyncMock(return_value=(61000, 2.6))
+        second = await service.refresh()
+
+    assert service.is_ready()
+    assert service.currency_rates() == (3.2, 90.0)
+    assert service.crypto_prices() == (61000, 2.6)
+    assert second.currency_updated == first.currency_updated
+    assert service.failure_count == 1
+    # Снимки неизменяемы: старый снимок не изменился
+    assert first.btc_usd == 60000
@@ -0,0 +1,59 @@
+import pytest
+from unittest.mock import AsyncMock, patch
+from app.services.matches import MatchTracker
+
+KICKOFF = 1_700_000_000
+
+def make_fixture(events, status="1H", home_goals=0, away_goals=0):
+    return {
+        "fixture": {"id": 1, "timestamp": KICKOFF, "status": {"short": status}},
+        "teams": {"home": {"id": 541, "name": "Real Madrid"}, "away": {"id": 40, "name": "Liverpool"}},
+        "goals": {"home": home_goals, "away": away_goals},
+        "events": events,
+    }
+
+def make_goal(player, minute, detail="Normal Goal"):
+    return {
+        "type": "Goal", "detail": detail,
+        "time": {"elapsed": minute, "extra": None},
+        "team": {"id": 541, "name": "Real Madrid"},
+        "player": {"id": hash(player) % 1000, "name": player},
+    }
+
+@pytest.mark.asyncio
+async def test_only_new_goals_are_posted():
+    bot = AsyncMock()
+    tracker = MatchTracker(bot, chat_id=1, team_ids={"real": 541})
+    tracker.fixtures[1] = {"kickoff": KICKOFF, "goals": None}
+
+    # Первый снимок запоминается без уведомлений
+    await tracker.process_fixture(make_fixture([]))
+    await tracker.process_fixture(make_fixture([make_goal("Vinicius", 12)], home_goals=1))
+    await tracker.process_fixture(make_fixture([
+        make_goal("Vinicius", 12),
+        make_goal("Salah", 30, detail="Missed Penalty"),
+    ], home_goals=1))
+
+    assert bot.send_message.await_count == 1
+    assert "Vinicius" in bot.send_message.call_args.kwargs["text"]
+
+    # После окончания матч перестает отслеживаться
+    await tracker.process_fixture(make_fixture([make_goal("Vinicius", 12)], status="FT", home_goals=1))
+    assert 1 not in tracker.fixtures
+
+@pytest.mark.asyncio
+async def test_idle_outside_match_window():
+    tracker = MatchTracker(AsyncMock(), chat_id=1, team_ids={"real": 541})
+    tracker.schedule_updated = KICKOFF
+    tracker.fixtures[1] = {"kickoff": KICKOFF + 3000, "goals": None}
+
+    with patch("app.services.matches.ApiClient") as api:
+        api.get_fixtures_by_ids = AsyncMock(return_value={"response": []})
+        delay = await tracker.tick(now=KICKOFF)
+        api.get_fixtures_by_ids.assert_not_awaited()
+
+        # Проснуться нужно к началу окна матча
+        assert delay == 3000 - 600
+
+        delay = await tracker.tick(now=KICKOFF + 3000)
+        api.get_fixtures_by_ids.assert_awaited_once_with([1])
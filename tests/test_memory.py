@@ -0,0 +1,71 @@
+import pytest
+from unittest.mock import AsyncMock, MagicMock, patch
+from app.services.memory import MemoryProfiler, approx_size
+from app.services.monitoring import monitoring
+from app.handlers.messages import MessageHandlers
+
+def test_approx_size_counts_nested_containers():
+    flat = approx_size({"a": 1})
+    nested = approx_size({"a": {"b": "x" * 10_000}})
+    assert nested > flat + 10_000
+
+def test_approx_size_is_bounded_on_deep_and_large_structures():
+    deep = current = {}
+    for _ in range(5000):
+        current["next"] = current = {}
+    # Глубокий JSON не вызывает RecursionError, большой список обходится не целиком
+    assert approx_size(deep) > 0
+    assert approx_size(["x" * 1000 for _ in range(1000)], max_objects=10) < 20 * 1100
+
+def test_breakdown_uses_registered_probes():
+    data = {i: [i] * 10 for i in range(100)}
+    monitoring.register_size_probe("test.data", lambda: data)
+    try:
+        count, size = MemoryProfiler().get_breakdown()["test.data"]
+    finally:
+        del monitoring.size_probes["test.data"]
+    assert count == 100
+    assert size > 100 * 10 * 8
+
+def test_stats_reuse_recent_breakdown():
+    profiler = MemoryProfiler()
+    probe = lambda: [1, 2, 3]
+    monitoring.register_size_probe("test.cached", probe)
+    try:
+        first = profiler.get_stats()["breakdown"]
+        with patch("app.services.memory.approx_size") as approx:
+            assert profiler.get_stats()["breakdown"] == first
+        approx.assert_not_called()
+    finally:
+        del monitoring.size_probes["test.cached"]
+
+@pytest.mark.asyncio
+async def test_growth_alert():
+    profiler = MemoryProfiler(alert_mb=0.5, frames=1)
+    profiler.start()
+    profiler.task.cancel()
+    leak = []
+    try:
+        with patch.object(monitoring, "notify_admin", AsyncMock()) as notify:
+            await profiler.check()
+            leak.append(bytearray(2 * 1024 * 1024))
+            report = await profiler.check()
+    finally:
+        await profiler.stop()
+
+    assert report and "test_memory.py" in report[0]
+    notify.assert_awaited_once()
+    assert "Рост памяти" in notify.call_args[0][0]
+
+def test_ai_limiters_share_one_probe_without_keeping_handlers_alive():
+    handlers = MessageHandlers(AsyncMock(), AsyncMock())
+    config = MagicMock(chat_id=-100, ai_rate_limit=2)
+    handlers._ai_allowed(config, 1)
+    config.ai_rate_limit = 3
+    handlers._ai_allowed(config, 1)  # Лимит изменился - ограничитель заменён
+
+    probes = [name for name in monitoring.size_probes if "imiter" in name]
+    assert probes == ["MessageHandlers.ai_limiters"]
+    assert list(monitoring.size_probes["MessageHandlers.ai_limiters"]()) == [-100]
+    del handlers
+    assert monitoring.size_probes["MessageHandlers.ai_limiters"]() == {}
@@ -0,0 +1,82 @@
+import pytest
+from datetime import date, datetime, time
+from unittest.mock import AsyncMock, MagicMock, patch
+from app.services.messages import MorningMessageSender, render_digest
+
+CITIES_A = [{"name": "Минск", "query": "Minsk,BY"}, {"name": "Гомель", "query": "Gomel,BY"}]
+CITIES_B = [{"name": "Минск", "query": "Minsk,BY"}]
+
+def test_render_digest():
+    text = render_digest(CITIES_A, {"Minsk,BY": "5°C, ясно"}, (3.2, 90.0), (60000, 2.5))
+    assert "*Минск*: 5°C, ясно" in text
+    assert "*Гомель*: Нет данных" in text
+    assert "USD/BYN*: 3.20 BYN" in text
+
+@pytest.mark.asyncio
+async def test_morning_message_fetches_each_city_once():
+    bot = AsyncMock()
+    bot.send_message.return_value = MagicMock(message_id=1)
+    sender = MorningMessageSender(bot, AsyncMock())
+    subscriptions = [
+        {"chat_id": 1, "cities": CITIES_A, "send_time": time(8, 0)},
+        {"chat_id": 2, "cities": CITIES_B, "send_time": time(8, 0)},
+    ]
+
+    with patch("app.services.messages.DigestSubscriptions") as subs, \
+            patch("app.services.messages.ApiClient") as api:
+        subs.claim_due = AsyncMock(return_value=subscriptions)
+        subs.release = AsyncMock()
+        subs.get_city_ids = AsyncMock(return_value={"Minsk,BY": 625144})
+        subs.save_city_ids = AsyncMock()
+        api.get_city_id = AsyncMock(return_value=627907)
+        api.get_weather_group = AsyncMock(return_value={625144: "5°C, ясно", 627907: "3°C, дождь"})
+        api.get_currency_rates = AsyncMock(return_value=(3.2, 90.0))
+        api.get_crypto_prices = AsyncMock(return_value=(60000, 2.5))
+
+        sent = await sender.send_morning_message(datetime(2024, 3, 1, 8, 0, 20))
+
+    assert len(sent) == 2
+    api.get_city_id.assert_awaited_once_with("Gomel,BY")
+    api.get_weather_group.assert_awaited_once()
+    assert bot.send_message.await_count == 2
+    subs.claim_due.assert_awaited_once_with(sender.db_pool, date(2024, 3, 1), time(7, 0, 20), time(8, 0, 20))
+    subs.release.assert_not_awaited()
+
+@pytest.mark.asyncio
+async def test_late_run_after_midnight_catches_up_from_start_of_day():
+    sender = MorningMessageSender(AsyncMock(), AsyncMock())
+    with patch("app.services.messages.DigestSubscriptions") as subs:
+        subs.claim_due = AsyncMock(return_value=[])
+        assert await sender.send_morning_message(datetime(2024, 3, 1, 0, 1, 40)) == []
+
+    # Окно догоняющей отправки не переходит на вчерашний день
+    subs.claim_due.assert_awaited_once_with(sender.db_pool, date(2024, 3, 1), time.min, time(0, 1, 40))
+
+@pytest.mark.asyncio
+async def test_failed_sends_are_released_for_retry():
+    async def send_message(chat_id, **kwargs):
+        if chat_id == 2:
+            raise RuntimeError("Forbidden: bot was kicked")
+        return MagicMock(message_id=1)
+
+    bot = AsyncMock()
+    bot.send_message.side_effect = send_message
+    sender = MorningMessageSender(bot, AsyncMock())
+    sender.fetch_snapshot = AsyncMock(return_value=({}, (3.2, 90.0), (60000, 2.5)))
+    subscriptions = [
+        {"chat_id": 1, "cities": CITIES_B, "send_time": time(8, 0)},
+        {"chat_id": 2, "cities": CITIES_B, "send_time": time(8, 0)},
+    ]
+
+    with patch("app.services.messages.DigestSubscriptions") as subs:
+        subs.claim_due = AsyncMock(return_value=subscriptions)
+        subs.release = AsyncMock()
+        await sender.send_morning_message(datetime(2024, 3, 1, 8, 0))
+
+        # Сбой получения данных: отметка снимается со всех отобранных чатов
+        sender.fetch_snapshot.side_effect = OSError("network down")
+        assert await sender.send_morning_message(datetime(2024, 3, 1, 8, 1)) is None
+
+    assert [call.args[1:] for call in subs.release.await_args_list] == [
+        ({2}, date(2024, 3, 1)), ({1, 2}, date(2024, 3, 1))
+    ]
@@ -0,0 +1,39 @@
+import pytest
+from unittest.mock import AsyncMock, MagicMock
+from app.database.migrations import add_search_vector, add_activity_rollup, BACKFILL_BATCH_SIZE
+
+@pytest.mark.asyncio
+async def test_search_vector_migration_backfills_in_batches_and_builds_index_concurrently():
+    conn = AsyncMock()
+    conn.fetchrow.return_value = (1, BACKFILL_BATCH_SIZE * 2 + 10)
+    conn.fetchval.return_value = None  # Индекса ещё нет
+    conn.execute.return_value = "UPDATE 7"
+
+    await add_search_vector(conn)
+
+    statements = [call.args[0] for call in conn.execute.call_args_list]
+    batches = [call.args[1:3] for call in conn.execute.call_args_list if "UPDATE chat_history" in call.args[0]]
+    assert batches == [(0, BACKFILL_BATCH_SIZE), (BACKFILL_BATCH_SIZE, BACKFILL_BATCH_SIZE * 2),
+                       (BACKFILL_BATCH_SIZE * 2, BACKFILL_BATCH_SIZE * 3)]
+    assert any(s.startswith("CREATE INDEX CONCURRENTLY idx_chat_history_search") for s in statements)
+    # Индекс строится после заполнения, настройки сессии восстанавливаются
+    assert statements.index(next(s for s in statements if "CONCURRENTLY" in s)) > \
+        statements.index(next(s for s in statements if "UPDATE chat_history" in s))
+    assert statements[-2:] == ["RESET lock_timeout", "RESET statement_timeout"]
+
+@pytest.mark.asyncio
+async def test_activity_rollup_migration_installs_trigger_before_backfill():
+    conn = AsyncMock()
+    conn.transaction = MagicMock()
+    conn.fetchrow.return_value = (1, BACKFILL_BATCH_SIZE + 10)
+
+    await add_activity_rollup(conn)
+
+    statements = [call.args[0] for call in conn.execute.call_args_list]
+    batches = [call.args[1:3] for call in conn.execute.call_args_list if "FROM chat_history" in call.args[0]]
+    # Граница заполнения читается в транзакции с созданием триггера, агрегаты пересчитываются с нуля
+    assert batches == [(0, BACKFILL_BATCH_SIZE), (BACKFILL_BATCH_SIZE, BACKFILL_BATCH_SIZE + 10)]
+    trigger = next(i for i, s in enumerate(statements) if "CREATE TRIGGER trg_chat_activity_rollup" in s)
+    assert trigger < statements.index("TRUNCATE chat_activity")
+    conn.transaction.assert_called_once()
+    assert statements[-2:] == ["RESET lock_timeout", "RESET statement_timeout"]
@@ -0,0 +1,82 @@
+import pytest
+import asyncio
+import datetime
+from unittest.mock import AsyncMock, patch
+from aiogram.types import Chat, Message, User
+from app.services.monitoring import BotMonitoring, error_fingerprint, monitor_function
+
+def fail(message):
+    raise ConnectionError(message)
+
+def raise_and_log(monitoring, message="db down"):
+    try:
+        fail(message)
+    except ConnectionError as e:
+        monitoring.log_error(e, {"context": "test"})
+
+def test_fingerprint_uses_type_and_call_site():
+    errors = []
+    for message in ("a", "b"):
+        try:
+            fail(message)
+        except ConnectionError as e:
+            errors.append(e)
+    try:
+        raise ValueError("a")
+    except ValueError as e:
+        errors.append(e)
+
+    assert error_fingerprint(errors[0]) == error_fingerprint(errors[1])
+    assert error_fingerprint(errors[0]).startswith("ConnectionError@")
+    assert error_fingerprint(errors[0]) != error_fingerprint(errors[2])
+
+@pytest.mark.asyncio
+async def test_repeated_errors_produce_one_alert_and_a_digest():
+    bot = AsyncMock()
+    monitoring = BotMonitoring(bot=bot, admin_chat_id=1)
+
+    for i in range(1000):
+        raise_and_log(monitoring, f"db down {i}")
+    await asyncio.sleep(0)
+
+    assert monitoring.error_count == 1000
+    assert len(monitoring.errors) == 1
+    bot.send_message.assert_awaited_once()
+    assert "Трассировка" in bot.send_message.call_args[0][1]
+
+    await monitoring.send_error_digest()
+    digest = bot.send_message.call_args[0][1]
+    assert "999 раз" in digest
+    assert "db down 999" in digest
+
+    # После сводки счётчик повторов сброшен
+    assert monitoring.build_error_digest() is None
+
+def test_error_table_is_bounded():
+    monitoring = BotMonitoring()
+    for i in range(300):
+        try:
+            exec(compile("raise KeyError(1)", f"generated_{i}.py", "exec"))
+        except KeyError as e:
+            monitoring.log_error(e)
+    assert len(monitoring.errors) == 200
+
+@pytest.mark.asyncio
+async def test_monitor_function_keeps_only_short_argument_descriptions():
+    message = Message(
+        message_id=1, date=datetime.datetime.now(), text="x" * 500,
+        chat=Chat(id=-100, type="group"), from_user=User(id=42, is_bot=False, first_name="Test")
+    )
+
+    @monitor_function
+    async def handler(message, payload=None):
+        raise RuntimeError("boom")
+
+    with patch("app.services.monitoring.monitoring") as monitoring:
+        with pytest.raises(RuntimeError):
+            await handler(message, payload=list(range(10_000)))
+
+    context = monitoring.log_error.call_args.args[1]
+    # В таблице ошибок остаются строки, а не сообщение со ссылками на бота и сессию
+    assert context["args"][0].startswith("Message(chat_id=-100, user_id=42, text='xxx")
+    assert all(len(value) <= 200 for value in context["args"] + list(context["kwargs"].values()))
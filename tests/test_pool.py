@@ -0,0 +1,59 @@
+import asyncio
+import pytest
+from asyncpg.connection import LoggedQuery
+from app.database.pool import InstrumentedPool, DbTelemetry, query_name_from_sql
+
+class FakeConnection:
+    def __init__(self):
+        self.loggers = []
+
+    async def execute(self, query):
+        # asyncpg вызывает логгеры запросов через call_soon
+        record = LoggedQuery(query, (), None, 0.003, None, None, None)
+        for logger in self.loggers:
+            asyncio.get_running_loop().call_soon(logger, record)
+
+class FakePool:
+    def __init__(self, size):
+        self.free = asyncio.Queue()
+        for _ in range(size):
+            self.free.put_nowait(FakeConnection())
+
+    async def acquire(self, timeout=None):
+        return await self.free.get()
+
+    async def release(self, connection):
+        self.free.put_nowait(connection)
+
+def test_query_name_from_sql():
+    assert query_name_from_sql("SELECT role FROM chat_history WHERE chat_id = $1") == "SELECT chat_history"
+    assert query_name_from_sql("\n INSERT INTO chat_reset_ids (chat_id) VALUES ($1)") == "INSERT chat_reset_ids"
+    assert query_name_from_sql("CREATE TABLE IF NOT EXISTS schema_version (v TEXT)") == "CREATE schema_version"
+    assert query_name_from_sql("BEGIN") == "BEGIN"
+
+@pytest.mark.asyncio
+async def test_records_acquire_wait_and_named_queries():
+    telemetry = DbTelemetry()
+    raw = FakePool(1)
+    pool = InstrumentedPool(raw, telemetry)
+    for connection in raw.free._queue:
+        connection.loggers.append(telemetry.record_query)
+
+    async def work(name):
+        async with pool.acquire(name=name) as conn:
+            await conn.execute("SELECT 1 FROM chat_history")
+            await asyncio.sleep(0.02)
+
+    await asyncio.gather(*(work("chat_history.get_history") for _ in range(3)))
+    async with pool.acquire() as conn:
+        await conn.execute("DELETE FROM chat_history")
+    await asyncio.sleep(0)
+
+    stats = telemetry.get_stats()
+    assert stats["acquire"]["count"] == 4
+    # Второй и третьей задачам пришлось ждать освобождения единственного соединения
+    assert stats["acquire"]["max_ms"] >= 15
+    assert stats["max_waiting"] == 2
+    assert stats["waiting"] == 0
+    assert stats["queries"]["chat_history.get_history"]["count"] == 3
+    assert stats["queries"]["DELETE chat_history"]["count"] == 1
@@ -0,0 +1,55 @@
+import time
+from unittest.mock import patch
+from app.services.quota import (
+    QuotaBudgeter, PRIORITY_USER, PRIORITY_BACKGROUND, PRIORITY_OPTIONAL, UNKNOWN_RESET_RETRY
+)
+
+def make_headers(remaining, limit=100, reset=3600):
+    return {
+        "x-ratelimit-requests-limit": str(limit),
+        "x-ratelimit-requests-remaining": str(remaining),
+        "x-ratelimit-requests-reset": str(reset),
+    }
+
+def test_full_budget_allows_everything():
+    budgeter = QuotaBudgeter()
+    budgeter.update("key", make_headers(90))
+    assert budgeter.allow("key", PRIORITY_OPTIONAL)
+    assert budgeter.scale_ttl("key", 300) == 300
+
+def test_shrinking_budget_defers_optional_calls():
+    budgeter = QuotaBudgeter()
+    budgeter.update("key", make_headers(15))
+
+    assert not budgeter.allow("key", PRIORITY_OPTIONAL)
+    assert budgeter.allow("key", PRIORITY_BACKGROUND)
+    assert budgeter.allow("key", PRIORITY_USER)
+    assert budgeter.scale_ttl("key", 300) == 1200
+    assert budgeter.get_stats()["key"]["deferred"] == 1
+
+def test_exhausted_budget_reserved_for_users():
+    budgeter = QuotaBudgeter()
+    budgeter.update("key", make_headers(3))
+    assert not budgeter.allow("key", PRIORITY_BACKGROUND)
+    assert budgeter.allow("key", PRIORITY_USER)
+    assert budgeter.scale_ttl("key", 300) == float("inf")
+
+    budgeter.mark_exhausted("key")
+    assert not budgeter.allow("key", PRIORITY_USER)
+
+def test_budget_resets_after_reset_time():
+    budgeter = QuotaBudgeter()
+    budgeter.update("key", make_headers(0, reset=-1))
+    assert budgeter.allow("key", PRIORITY_OPTIONAL)
+
+def test_exhausted_budget_without_reset_time_is_retried():
+    budgeter = QuotaBudgeter()
+    budgeter.mark_exhausted("key")
+    budgeter.update("other", {"x-ratelimit-requests-remaining": "0"})
+    assert not budgeter.allow("key", PRIORITY_USER)
+    assert not budgeter.allow("other", PRIORITY_USER)
+
+    # Время сброса неизвестно: через UNKNOWN_RESET_RETRY запрос пропускается и обновит заголовки
+    with patch("app.services.quota.time.time", return_value=time.time() + UNKNOWN_RESET_RETRY + 1):
+        assert budgeter.allow("key", PRIORITY_USER)
+        assert budgeter.allow("other", PRIORITY_USER)
@@ -0,0 +1,32 @@
+import sys
+import json
+import asyncio
+import pytest
+from app import runtime
+
+@pytest.fixture
+def restore_runtime(monkeypatch):
+    monkeypatch.setattr(runtime, "json_loads", runtime.json_loads)
+    monkeypatch.setattr(runtime, "json_dumps", runtime.json_dumps)
+    monkeypatch.setattr(runtime, "enabled", {"uvloop": False, "orjson": False})
+    policy = asyncio.get_event_loop_policy()
+    yield
+    asyncio.set_event_loop_policy(policy)
+
+def test_falls_back_to_stdlib_without_optional_packages(monkeypatch, restore_runtime):
+    monkeypatch.setitem(sys.modules, "uvloop", None)
+    monkeypatch.setitem(sys.modules, "orjson", None)
+
+    assert runtime.install_fast_runtime() == {"uvloop": False, "orjson": False}
+    assert runtime.json_loads is json.loads
+    assert runtime.json_dumps is json.dumps
+
+def test_orjson_dumps_returns_str(monkeypatch, restore_runtime):
+    pytest.importorskip("orjson")
+    monkeypatch.setitem(sys.modules, "uvloop", None)
+
+    assert runtime.install_fast_runtime()["orjson"]
+    payload = {"chat_id": 1, "text": "Привет"}
+    dumped = runtime.json_dumps(payload)
+    assert isinstance(dumped, str)
+    assert runtime.json_loads(dumped) == payload
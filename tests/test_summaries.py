@@ -0,0 +1,35 @@
+import pytest
+from unittest.mock import AsyncMock, patch
+from app.services.summaries import ConversationSummarizer
+
+def make_rows(first_id, count):
+    return [{"id": i, "user_id": 5, "role": "user", "content": f"сообщение {i}"} for i in range(first_id, first_id + count)]
+
+@pytest.mark.asyncio
+async def test_folds_aged_out_messages_in_batches():
+    summarizer = ConversationSummarizer(AsyncMock(), recent_window=10, min_batch=3, batch_max=4)
+    state = {"summary": None, "until_id": 0}
+    # 4 + 4 + 2 сообщения вне окна: два полных пакета, остаток меньше min_batch ждёт следующего раза
+    batches = [make_rows(1, 4), make_rows(5, 4), make_rows(9, 2)]
+
+    async def save(pool, chat_id, reset_id, summary, until_id):
+        state.update(summary=summary, until_id=until_id)
+
+    with patch("app.services.summaries.ChatHistory") as history, \
+            patch("app.services.summaries.ChatSummaries") as summaries, \
+            patch("app.services.summaries.AiHandler") as ai:
+        history.get_reset_id = AsyncMock(return_value=2)
+        summaries.get_state = AsyncMock(side_effect=lambda *args: (state["summary"], state["until_id"]))
+        summaries.get_aged_out = AsyncMock(side_effect=batches)
+        summaries.save = AsyncMock(side_effect=save)
+        ai.summarize = AsyncMock(side_effect=["сводка 1", "сводка 2"])
+
+        # Повторный вызов не запускает вторую задачу для того же чата
+        task = summarizer.schedule(100)
+        assert summarizer.schedule(100) is task
+        await task
+
+    assert state == {"summary": "сводка 2", "until_id": 8}
+    assert ai.summarize.call_args_list[1].args[0] == "сводка 1"
+    assert summaries.get_aged_out.call_args_list[1].args[3:] == (4, 10, 4)
+    assert summarizer.get_stats() == {"runs": 2, "folded_messages": 8, "errors": 0, "active": 0}
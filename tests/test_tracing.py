@@ -0,0 +1,100 @@
+import asyncio
+import pytest
+from unittest.mock import MagicMock, patch
+from app.services.tracing import (
+    Tracer, TracingMiddleware, span, record_span, attach_task, create_detached_task, current_trace
+)
+
+def make_tracer(slow_ms=100, sample_rate=0.0):
+    exporter = MagicMock(path="traces.jsonl")
+    return Tracer(exporter=exporter, enabled=True, slow_ms=slow_ms, sample_rate=sample_rate, max_spans=50)
+
+def make_update(text="/stats"):
+    update = MagicMock(update_id=7, event_type="message")
+    update.message.text = text
+    update.message.chat.id = -100
+    return update
+
+@pytest.mark.asyncio
+async def test_spans_nest_and_background_tasks_delay_export():
+    tracer = make_tracer(slow_ms=0)
+    release = asyncio.Event()
+
+    async def save_history():
+        await release.wait()
+        record_span("db save_message", 0.002, query="save_message")
+
+    async def handler(event, data):
+        with span("ai.response"):
+            with span("ai deepseek", model="deepseek-chat"):
+                await asyncio.sleep(0)
+        attach_task(asyncio.create_task(save_history()))
+        return "ok"
+
+    assert await TracingMiddleware(tracer)(handler, make_update(), {}) == "ok"
+    assert current_trace.get() is None
+    # Ответ отправлен, но сохранение истории ещё идёт: трасса не экспортирована
+    tracer.exporter.submit.assert_not_called()
+
+    release.set()
+    await asyncio.sleep(0.01)
+    entry = tracer.exporter.submit.call_args.args[0]
+    assert entry["name"] == "update /stats"
+    assert entry["attrs"] == {"update_id": 7, "chat_id": -100}
+    spans = {span["name"]: span for span in entry["spans"]}
+    assert spans["ai deepseek"]["parent"] == spans["ai.response"]["id"]
+    assert spans["ai.response"]["parent"] is None
+    assert spans["db save_message"]["attrs"] == {"query": "save_message"}
+
+@pytest.mark.asyncio
+async def test_only_slow_and_failed_traces_are_exported():
+    tracer = make_tracer(slow_ms=100)
+    middleware = TracingMiddleware(tracer)
+
+    async def fast(event, data):
+        with span("db get_chat_config"):
+            pass
+
+    async def failing(event, data):
+        raise RuntimeError("boom")
+
+    await middleware(fast, make_update("привет"), {})
+    tracer.exporter.submit.assert_not_called()
+
+    with pytest.raises(RuntimeError):
+        await middleware(failing, make_update(), {})
+    entry = tracer.exporter.submit.call_args.args[0]
+    assert entry["error"] == "RuntimeError: boom"
+
+    with patch("app.services.tracing.time.monotonic", side_effect=[0.0, 0.5, 0.5]):
+        trace, token = tracer.start("update message")
+        current_trace.reset(token)
+        trace.finish()
+    assert tracer.get_stats()["traces"] == 3
+    assert tracer.get_stats()["slow"] == 1
+    assert tracer.exporter.submit.call_count == 2
+
+def test_spans_outside_trace_are_ignored():
+    with span("telegram sendMessage") as outer:
+        outer.set(status=200)
+    record_span("db.acquire", 0.01)
+    assert current_trace.get() is None
+
+@pytest.mark.asyncio
+async def test_detached_task_runs_outside_trace():
+    tracer = make_tracer(slow_ms=0)
+    seen = []
+
+    async def summarize():
+        seen.append(current_trace.get())
+        record_span("db chat_summaries.save", 0.001)
+
+    async def handler(event, data):
+        return create_detached_task(summarize())
+
+    task = await TracingMiddleware(tracer)(handler, make_update("привет"), {})
+    # Трасса не ждёт общей фоновой задачи и не получает её спанов
+    tracer.exporter.submit.assert_called_once()
+    await task
+    assert seen == [None]
+    assert tracer.exporter.submit.call_args.args[0]["spans"] == []